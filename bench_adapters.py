@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# blocks/s of the generic parse_block() against the per-registry adapters (db/adapters.py), and a diff of their rows
+# ./bench_adapters.py                                          20 000 synthetic blocks per registry
+# ./bench_adapters.py downloads/ripe.db.inetnum.gz downloads/arin.db.gz    the dumps, registry from the file name
+# ./bench_adapters.py --blocks 200000 --registries lacnic arin
+# A dump is read once (create_db.py read_blocks()), both parsers then run on the same blocks in memory.
+import argparse
+import random
+import time
+
+import create_db
+from db.adapters import ADAPTERS, get_adapter, dump_type
+from db.iputil import iprange_to_cidrs, prefix_str
+
+BLOCKS = 20000
+REGISTRIES = [adapter.source for adapter in ADAPTERS]
+GENERIC_TABLES = ('cidr', 'attr', 'parent')
+# the attributes nobody reads, as many as in the real objects
+NOISE = "admin-c:        {h}-{R}\ntech-c:         {h}-{R}\nmnt-lower:      {m}\nmnt-routes:     {m}\nremarks:        ---\n"
+
+
+def ip(rng):
+  return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+
+
+# one block of a registry dump, the classes it has in the proportions of a dump (contacts and maintainers included)
+def synthetic_block(registry, rng):
+  R = registry.upper()
+  h = f"H{rng.randint(1, 9999)}"
+  m = f"MNT-{rng.randint(1, 500)}"
+  pick = rng.random()
+  if registry == 'lacnic':
+    if pick < 0.6:
+      prefix = rng.choice([f"{ip(rng)}.0/24", f"{ip(rng)}/24", f"{ip(rng).rsplit('.', 1)[0]}/16"])
+      return (f"inetnum:     {prefix}\nstatus:      allocated\nowner:       Owner {h}\nownerid:     BR-XXXX-LACNIC\nresponsible: Someone\n"
+              f"address:     Rua X, 1\ncountry:     BR\nowner-c:     {h}\ntech-c:      {h}\nabuse-c:     {h}\ninetrev:     {prefix}\n"
+              f"nserver:     ns1.example.br\ncreated:     20040101\nchanged:     20200101\nsource:      LACNIC\n")
+    if pick < 0.7:
+      return f"aut-num:     AS{rng.randint(1, 270000)}\nowner:       Owner {h}\nownerid:     BR-XXXX-LACNIC\ncountry:     BR\nowner-c:     {h}\ncreated:     20040101\nchanged:     20200101\nsource:      LACNIC\n"
+    return f"person:      Someone {h}\nnic-hdl-br:  {h}\ne-mail:      x@example.br\naddress:     Rua X, 1\nphone:       +55 11 5555\ncreated:     20040101\nchanged:     20200101\nsource:      LACNIC\n"
+  if registry == 'arin':
+    if pick < 0.6:
+      return (f"route:          {ip(rng)}.0/24\norigin:         AS{rng.randint(1, 400000)}\ndescr:          Customer {h}\n                Suite 201\n"
+              f"member-of:      RS-{m}\nadmin-c:        {h}-ARIN\ntech-c:         {h}-ARIN\nmnt-by:         {m}\nchanged:        noc@example.com 2001{rng.randint(1, 12):02}15\nsource:         ARIN\n")
+    if pick < 0.7:
+      members = ', '.join(f"AS{rng.randint(1, 400000)}" for _ in range(rng.randint(1, 30)))
+      return f"as-set:         AS-{h}\ndescr:          Customers\nmembers:        {members}\n                AS-{m}\n" + NOISE.format(h=h, R=R, m=m) + f"mnt-by:         {m}\ncreated:        2022-07-01T17:58:34Z\nlast-modified:  2023-09-27T14:44:31Z\nsource:         ARIN\n"
+    return f"mntner:         {m}\ndescr:          Maintainer\n" + NOISE.format(h=h, R=R, m=m) + "auth:           CRYPT-PW xx\nsource:         ARIN\n"
+  if pick < 0.6:
+    start = ip(rng)
+    return (f"inetnum:        {start}.0 - {start}.255\nnetname:        NET-{rng.randint(1, 2000)}\ndescr:          Customer {h}\ncountry:        {rng.choice(['DE', 'CN', 'ZA', 'NL'])}\n"
+            + NOISE.format(h=h, R=R, m=m) + f"org:            ORG-{h}-{R}\nstatus:         ASSIGNED PA\nmnt-by:         {m}\nnotify:         noc@example.net\n"
+            f"created:        2010-01-01T00:00:00Z\nlast-modified:  2020-01-01T00:00:00Z\nsource:         {R}\n")
+  if pick < 0.7:
+    return (f"inet6num:       2001:{rng.randint(0, 65535):x}::/32\nnetname:        NET6-{rng.randint(1, 2000)}\ncountry:        EU\n" + NOISE.format(h=h, R=R, m=m)
+            + f"status:         ALLOCATED-BY-RIR\nmnt-by:         {m}\ncreated:        2010-01-01T00:00:00Z\nlast-modified:  2020-01-01T00:00:00Z\nsource:         {R}\n")
+  if pick < 0.8:
+    return (f"organisation:   ORG-{h}-{R}\norg-name:       Company {h}\norg-type:       OTHER\naddress:        Street 1\n" + NOISE.format(h=h, R=R, m=m)
+            + f"mnt-ref:        {m}\nmnt-by:         {m}\ncreated:        2010-01-01T00:00:00Z\nlast-modified:  2020-01-01T00:00:00Z\nsource:         {R}\n")
+  if pick < 0.9:
+    return (f"role:           Company {h} NOC\naddress:        Street 1\ne-mail:         noc@example.net\nnic-hdl:        {h}-{R}\n" + NOISE.format(h=h, R=R, m=m)
+            + f"mnt-by:         {m}\ncreated:        2010-01-01T00:00:00Z\nlast-modified:  2020-01-01T00:00:00Z\nsource:         {R}\n")
+  return f"person:         Someone {h}\naddress:        Street 1\nphone:          +31 20 5555\nnic-hdl:        {h}-{R}\nmnt-by:         {m}\nsource:         {R}\n"
+
+
+# the blocks as read_blocks() returns them: remarks dropped, cust_source appended
+def synthetic_blocks(registry, count):
+  rng = random.Random(42)
+  blocks = []
+  for _ in range(count):
+    lines = [line for line in synthetic_block(registry, rng).split('\n') if line and not line.startswith('remarks:')]
+    blocks.append(('\n'.join(lines) + f"\ncust_source: {registry}").encode('utf-8'))
+  return blocks
+
+
+# rows -> comparable: the parent rows of parse_properties() come out of a set, in any order.
+# The member rows (organisation, role..) are adapters only, a block with nothing else is one parse_block() skips.
+def normalize(rows):
+  if rows is None or not any(rows[table] for table in GENERIC_TABLES):
+    return None
+  return {table: sorted(tuple(sorted(row.items(), key=lambda item: item[0])) for row in rows[table]) for table in GENERIC_TABLES}
+
+
+# each parser starts with cold range/prefix caches, the first one would warm them for the second
+def run(parse, blocks):
+  iprange_to_cidrs.cache_clear()
+  prefix_str.cache_clear()
+  start = time.perf_counter()
+  results = [parse(block) for block in blocks]
+  return results, time.perf_counter() - start
+
+
+# kind: the class of a split dump, its adapter only reads that class
+def bench(name, registry, blocks, kind=None):
+  adapter = get_adapter(registry, types=[kind] if kind else None)
+  generic, generic_seconds = run(create_db.parse_block, blocks)
+  fast, fast_seconds = run(adapter.parse, blocks)
+  differ = [block for block, a, b in zip(blocks, generic, fast) if normalize(a) != normalize(b)]
+  kept = sum(1 for rows in fast if rows is not None)
+  members = sum(len(rows['member']) for rows in fast if rows is not None)
+  print(f"{name:28} {type(adapter).__name__:15} {len(blocks):8} {kept:8} {members:8} {len(blocks) / generic_seconds:10.0f} "
+        f"{len(blocks) / fast_seconds:10.0f} {generic_seconds / fast_seconds:7.1f}x {len(differ):7}")
+  return differ
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='generic parse_block() against the per-registry adapters')
+  parser.add_argument('files', nargs='*', help="dump files (.gz or plain), synthetic blocks when none is given")
+  parser.add_argument('-n', '--blocks', type=int, default=BLOCKS, help="synthetic blocks per registry")
+  parser.add_argument('--registries', nargs='+', choices=REGISTRIES, default=REGISTRIES, help="synthetic registries to measure")
+  parser.add_argument('--show', type=int, default=1, help="print the first n blocks whose rows differ")
+  args = parser.parse_args()
+
+  print(f"{'input':28} {'adapter':15} {'blocks':>8} {'kept':>8} {'members':>8} {'generic/s':>10} {'adapter/s':>10} {'speedup':>8} {'differ':>7}")
+  differ = []
+  if args.files:
+    for path in args.files:
+      name = path.split('/')[-1]
+      differ += bench(name, create_db.get_source(name), create_db.read_blocks(path), dump_type(name))
+  else:
+    for registry in args.registries:
+      differ += bench(f"synthetic {registry}", registry, synthetic_blocks(registry, args.blocks))
+  for block in differ[:args.show]:
+    print(f"\n# rows differ:\n{block.decode('utf-8', 'replace')}\n# generic {create_db.parse_block(block)}")
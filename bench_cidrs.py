@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# benchmark of the inetnum range -> CIDR conversion: netaddr (create_db.py up to 2.2.5) against db/iputil.py
+# ./bench_cidrs.py                                   random ranges, a share of them repeated
+# ./bench_cidrs.py downloads/done/ripe.db.inetnum.gz the inetnum ranges of a dump
+import argparse
+import gzip
+import random
+import re
+import time
+
+from netaddr import iprange_to_cidrs as netaddr_iprange_to_cidrs
+
+from db import iputil
+
+RANGES = 200000
+REPEAT = 0.3
+RANGE_RE = re.compile(rb'^inetnum:[\s]*((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})', re.MULTILINE)
+
+
+def random_ranges(count, repeat):
+  ranges = []
+  for _ in range(count):
+    if ranges and random.random() < repeat:
+      ranges.append(random.choice(ranges))
+      continue
+    start = random.getrandbits(32) & ~((1 << random.randint(0, 16)) - 1)
+    end = min(start + random.getrandbits(random.randint(0, 20)), 2**32 - 1)
+    ranges.append((iputil.int_to_ipv4(start).encode('utf-8'), iputil.int_to_ipv4(end).encode('utf-8')))
+  return ranges
+
+
+def dump_ranges(filepath):
+  opemethod = gzip.open if filepath.endswith('.gz') else open
+  with opemethod(filepath, mode='rb') as f:
+    return RANGE_RE.findall(f.read())
+
+
+# the 2.2.5 path: decode, netaddr objects, encode to bytes, decoded again by parse_blocks()
+def netaddr_path(ranges):
+  for ip_start, ip_end in ranges:
+    cidrs = netaddr_iprange_to_cidrs(ip_start.decode('utf-8'), ip_end.decode('utf-8'))
+    [x.decode('utf-8') for x in (str(x).encode('utf-8') for x in cidrs)]
+
+
+def iputil_path(ranges):
+  for ip_start, ip_end in ranges:
+    list(iputil.iprange_to_cidrs(ip_start, ip_end))
+
+
+def iputil_uncached_path(ranges):
+  for ip_start, ip_end in ranges:
+    list(iputil.iprange_to_cidrs.__wrapped__(ip_start, ip_end))
+
+
+def measure(name, function, ranges):
+  start = time.perf_counter()
+  function(ranges)
+  elapsed = time.perf_counter() - start
+  print(f"{name:18} {elapsed:8.3f} seconds  {len(ranges) / elapsed:10.0f} ranges/s")
+  return elapsed
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='inetnum range -> CIDR benchmark')
+  parser.add_argument('-n', '--ranges', type=int, default=RANGES, help="number of random ranges")
+  parser.add_argument('--repeat', type=float, default=REPEAT, help="share of random ranges seen before")
+  parser.add_argument('dump', nargs='?', help="read the inetnum ranges of this dump instead")
+  args = parser.parse_args()
+
+  ranges = dump_ranges(args.dump) if args.dump else random_ranges(args.ranges, args.repeat)
+  print(f"{len(ranges)} ranges, {len(set(ranges))} distinct")
+  baseline = measure('netaddr', netaddr_path, ranges)
+  uncached = measure('iputil uncached', iputil_uncached_path, ranges)
+  iputil.iprange_to_cidrs.cache_clear()
+  cached = measure('iputil memoized', iputil_path, ranges)
+  print(f"speedup: {baseline / uncached:.1f}x uncached, {baseline / cached:.1f}x memoized, cache {iputil.iprange_to_cidrs.cache_info()}")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# load test for http_server.py: keep-alive connections, records requests/s and latency percentiles
+# ./bench_http.py --url http://localhost:8080 -n 20000 --concurrency 100
+# ./bench_http.py --url http://localhost:8080 /ip/8.8.8.8 /autnum/15169
+import argparse
+import asyncio
+import random
+import time
+
+import aiohttp
+
+URL = 'http://localhost:8080'
+REQUESTS = 10000
+CONCURRENCY = 50
+
+
+def random_paths(count):
+  return [f"/ip/{random.randint(1, 223)}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}" for _ in range(count)]
+
+
+def percentile(values, p):
+  return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def worker(session, url, paths, latencies, statuses):
+  while paths:
+    path = paths.pop()
+    start = time.perf_counter()
+    try:
+      async with session.get(url + path) as response:
+        await response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    except aiohttp.ClientError as e:
+      statuses[e.__class__.__name__] = statuses.get(e.__class__.__name__, 0) + 1
+    latencies.append(time.perf_counter() - start)
+
+
+async def bench(url, paths, concurrency):
+  latencies = []
+  statuses = {}
+  # one TCPConnector = connections are kept alive and reused between requests
+  connector = aiohttp.TCPConnector(limit=concurrency)
+  async with aiohttp.ClientSession(connector=connector) as session:
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(session, url, paths, latencies, statuses) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+  latencies.sort()
+  print(f"requests:    {len(latencies)} in {elapsed:.2f} seconds, concurrency {concurrency}")
+  print(f"throughput:  {len(latencies) / elapsed:.0f} requests/s")
+  print(f"latency ms:  p50 {percentile(latencies, 50) * 1000:.2f}  p90 {percentile(latencies, 90) * 1000:.2f}  p99 {percentile(latencies, 99) * 1000:.2f}  max {latencies[-1] * 1000:.2f}")
+  print(f"statuses:    {statuses}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='HTTP lookup service load test')
+  parser.add_argument('--url', type=str, default=URL, help="base url of http_server.py")
+  parser.add_argument('-n', '--requests', type=int, default=REQUESTS, help="number of requests")
+  parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="concurrent keep-alive connections")
+  parser.add_argument('paths', nargs='*', help="paths to request in a loop, random /ip/ lookups by default")
+  args = parser.parse_args()
+
+  if args.paths:
+    paths = [args.paths[i % len(args.paths)] for i in range(args.requests)]
+  else:
+    paths = random_paths(args.requests)
+  asyncio.run(bench(args.url.rstrip('/'), paths, args.concurrency))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# memory of the cidr rows held by a lookup process: BlockCidr instances, dicts, __slots__ Records, db/records.py RecordStore
+# ./bench_records.py                                   1 000 000 synthetic rows
+# ./bench_records.py --rows 5000000 --kinds store      a full dataset, the store only
+# ./bench_records.py -c postgresql://whoisd:whoisd@db:5432/whoisd   the cidr table
+# Each kind is built in a fresh interpreter: peak RSS (ru_maxrss) is per process and never goes down.
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+ROWS = 1000000
+KINDS = ('orm', 'dict', 'slots', 'store')
+COUNTRIES = ['US', 'DE', 'GB', 'FR', 'NL', 'BR', 'CN', 'JP', 'ZA', 'AU', 'IN', 'RU', None]
+SOURCES = ['arin', 'ripe', 'apnic', 'lacnic', 'afrinic']
+STATUSES = ['ASSIGNED PA', 'ALLOCATED PA', 'ASSIGNED', 'ALLOCATION', None]
+FETCH_SIZE = 10000
+
+
+# cidr-like rows, netnames repeated like the real ones (customer blocks of a handful of ISPs)
+def synthetic_rows(count):
+  rng = random.Random(42)
+  for i in range(count):
+    route = rng.random() < 0.3
+    yield {
+      'inetnum': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/{rng.randint(16, 24)}",
+      'autnum': f"AS{rng.randint(1, 400000)}" if route else '',
+      'attr': 'route' if route else 'inetnum',
+      'netname': f"NET-{rng.randint(0, count // 20)}",
+      'country': rng.choice(COUNTRIES),
+      'status': rng.choice(STATUSES),
+      'source': rng.choice(SOURCES),
+    }
+
+
+def database_rows(connection_string):
+  import psycopg
+  from psycopg.rows import dict_row
+  from db.lookup import get_dsn
+  with psycopg.connect(get_dsn(connection_string)) as conn:
+    # named cursor: streamed from the server, the input is not held in memory next to what is measured
+    with conn.cursor(name='bench_records', row_factory=dict_row) as cur:
+      cur.itersize = FETCH_SIZE
+      cur.execute("SELECT inetnum, autnum, attr, netname, country, status, source FROM cidr")
+      yield from cur
+
+
+def peak_rss():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# child process: build one kind, print its numbers as JSON
+def measure(kind, rows):
+  if kind == 'orm':
+    from db.model import BlockCidr
+  from db.records import Record, RecordStore, FIELDS
+  baseline = peak_rss()
+  start = time.perf_counter()
+  if kind == 'orm':
+    held = [BlockCidr(**row) for row in rows]
+  elif kind == 'dict':
+    held = list(rows)
+  elif kind == 'slots':
+    held = [Record(*(row[field] for field in FIELDS)) for row in rows]
+  else:
+    held = RecordStore.from_rows(rows)
+  build = time.perf_counter() - start
+  count = len(held)
+  # random reads, what a lookup does once the owner index is known
+  picks = [random.randrange(count) for _ in range(100000)] if count else []
+  start = time.perf_counter()
+  for i in picks:
+    held[i].netname if kind != 'dict' else held[i]['netname']
+  read = time.perf_counter() - start
+  print(json.dumps({'kind': kind, 'rows': count, 'peak': peak_rss(), 'delta': peak_rss() - baseline, 'build': build,
+                    'read_us': read * 1e6 / len(picks) if picks else 0.0}))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='memory of the lookup side cidr records')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, default=None, help="measure the rows of this database instead of synthetic ones")
+  parser.add_argument('-n', '--rows', type=int, default=ROWS, help="synthetic rows")
+  parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS), help="representations to measure")
+  parser.add_argument('--child', choices=KINDS, default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    if args.connection_string:
+      # imported before the baseline, it is not part of what is measured
+      import db.lookup
+    measure(args.child, database_rows(args.connection_string) if args.connection_string else synthetic_rows(args.rows))
+    sys.exit(0)
+
+  print(f"{'kind':8} {'rows':>10} {'peak RSS':>12} {'held':>12} {'bytes/row':>10} {'build':>9} {'read':>9}")
+  for kind in args.kinds:
+    command = [sys.executable, __file__, '--child', kind, '--rows', str(args.rows)]
+    if args.connection_string:
+      command += ['-c', args.connection_string]
+    result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+    print(f"{kind:8} {result['rows']:10} {result['peak'] / 2**20:9.0f} MB {result['delta'] / 2**20:9.0f} MB "
+          f"{result['delta'] / max(result['rows'], 1):10.0f} {result['build']:8.1f}s {result['read_us']:7.2f}us")
@@ -3,34 +3,63 @@
 import argparse
 import gzip
 import time
-from multiprocessing import cpu_count, Queue, Process, Lock, current_process
-# https://docs.python.org/2/library/multiprocessing.html#multiprocessing.sharedctypes.Value
-from multiprocessing.sharedctypes import Value
+from multiprocessing import cpu_count, Queue, Process, current_process
+from queue import Empty
 import logging
 import re
 import os
+from datetime import datetime
 import random
 import code
 
-from db.model import BlockCidr, BlockMember, BlockAttr, BlockParent
-from db.helper import setup_connection
+from db.model import BlockCidr, BlockMember, BlockAttr, BlockParent, BlockMeta, BlockCheckpoint
+from db.helper import setup_connection, create_missing, finalize_shadow, drop_shadow, pool_stats, dispose_engines, SHADOW_SCHEMA
 # https://docs.sqlalchemy.org/en/20/core/operators.html
-from sqlalchemy import select, and_, or_, not_
+from sqlalchemy import select, delete, and_, or_, not_
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError, PendingRollbackError
-from netaddr import iprange_to_cidrs
-
-VERSION = '2.0.23'
-FILELIST = ['afrinic.db.gz', 'apnic.db.inetnum.gz', 'arin.db.gz', 'lacnic.db.gz', 'ripe.db.inetnum.gz', 'apnic.db.inet6num.gz', 'ripe.db.inet6num.gz']
+from db.iputil import iprange_to_cidrs, prefix_str, cache_info
+from db import export
+from db.ranges import build_ranges, build_tree
+from db.asn import refresh_asns
+from db.history import record_history
+from db.profiling import StageTimer, start_profile, stop_profile, merge_profiles
+from db.progress import Progress, REPORT_SECONDS
+from db.batch import CommitBatcher, BATCH_ROWS, BATCH_MS
+from db.adapters import get_adapter, member_type, dump_type, CLASS_TABLES
+from db.version import VERSION
+
+# v2.2.20: the files are discovered in DOWNLOAD_DIR (discover_files()), registry by registry in this order
+DOWNLOAD_DIR = './downloads'
+REGISTRIES = ['afrinic', 'apnic', 'arin', 'lacnic', 'ripe']
 NUM_WORKERS = cpu_count()
 # NUM_WORKERS = 1
 # LOG_FORMAT = '%(asctime)-15s - %(name)-9s/%(funcName)20s - %(levelname)-8s - %(processName)-11s %(process)d - %(filename)s - %(message)s'
 LOG_FORMAT = '[%(name)s:%(lineno)4s - %(funcName)20s ] %(levelname)-8s: %(processName)-11s %(process)d - %(filename)s - %(message)s'
-COMMIT_COUNT = 10000
+# v2.2.16: rows per commit, or COMMIT_MS milliseconds since the oldest pending row, whichever comes first
+COMMIT_COUNT = BATCH_ROWS
 # COMMIT_COUNT = 300  # testing
+COMMIT_MS = BATCH_MS
 BLOCKLOAD_MODULO = {0:10000,8000000:100000,99999999:1000000}
 NUM_BLOCKS = 0
 CURRENT_FILENAME = "empty"
 RESET_DB = False
+# v2.2.5: the workers receive chunks of CHUNK_SIZE consecutive blocks, each chunk is committed with its checkpoint row
+CHUNK_SIZE = 1000
+RESUME = False
+# v2.2.7: columnar export of the parsed rows (db/export.py), with or without the postgres load
+EXPORT_DIR = None
+EXPORT_FORMAT = 'parquet'
+NO_DB = False
+# v2.2.14: per-stage timers in the workers, cProfile dumps in PROFILE_DIR
+STAGE_TIMES = False
+PROFILE_DIR = None
+# v2.2.19: per-registry parsers (db/adapters.py), parse_block() with --generic_parser
+GENERIC_PARSER = False
+# v2.2.21: the classes loaded (--types), None for all of CLASS_TABLES
+TYPES = None
+# v2.2.22: record the versions of the cidr rows in the history table after the import
+HISTORY = False
+TIMER = StageTimer()
 AUTOFLUSH = False
 DEBUG = False
 
@@ -50,25 +79,6 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
 
-# https://eli.thegreenplace.net/2012/01/04/shared-counter-with-pythons-multiprocessing#the-right-way
-class CounterShared(object):
-  def __init__(self, initval=0):
-    self.val = Value('i', initval)
-    self.lock = Lock()
-  
-  def increment(self):
-    with self.lock:
-      self.val.value += 1
-  
-  def decrement(self):
-    with self.lock:
-      self.val.value -= 1
-  
-  def value(self):
-    with self.lock:
-      return self.val.value
-
-
 def get_source(filename: str):
   if filename.startswith('afrinic'):
     return 'afrinic'
@@ -84,6 +94,43 @@ def get_source(filename: str):
     logger.error(f"Can not determine source for {filename}")
   return None
 
+# v2.2.20: the dumps of DOWNLOAD_DIR, monolithic (afrinic.db.gz, arin.db.gz, lacnic.db.gz, ripe.db.gz) or split by class
+# (apnic.db.role.gz, ripe.db.inet6num.gz..): per registry, the monolithic dump then the splits in CLASS_TABLES order.
+# The splits of the classes that are not loaded (domain, poem..) and the files of no known registry are skipped.
+def discover_files(directory: str) -> list:
+  classes = list(CLASS_TABLES)
+  entries = []
+  for entry in sorted(os.listdir(directory)):
+    if not os.path.isfile(os.path.join(directory, entry)) or '.db' not in entry:
+      continue
+    source = get_source(entry)
+    kind = dump_type(entry)
+    if source not in REGISTRIES:
+      continue
+    if kind is not None and kind not in CLASS_TABLES:
+      logger.info(f"skipping {entry}: {kind} objects are not loaded")
+      continue
+    entries.append((REGISTRIES.index(source), -1 if kind is None else classes.index(kind), entry))
+  return [entry for _, _, entry in sorted(entries)]
+
+# v2.2.21: the classes to load from a file: --types, only its own class for a split dump
+def file_types(filename: str) -> list:
+  kind = dump_type(filename)
+  return [name for name in (TYPES or CLASS_TABLES) if kind is None or name == kind]
+
+
+# the checkpoint key of a file: the chunks are slices of the blocks read_blocks() keeps, parsed by the adapter or parse_block()
+def checkpoint_reader(filename: str) -> str:
+  return f"{'generic' if GENERIC_PARSER else 'adapter'}:{','.join(sorted(reader_types(filename)))}"
+
+
+# the classes read_blocks() keeps: those the adapter of the file parses, all of them for parse_block() which sorts them out
+def reader_types(filename: str) -> list:
+  types = file_types(filename)
+  if GENERIC_PARSER:
+    return types
+  return [name.decode('utf-8') for name in get_adapter(get_source(filename), types=types).wanted]
+
 ###################### testing ######################
 # import re
 # block=b'''as-set:         AS-1002-CUSTOMERS
@@ -130,6 +177,20 @@ def parse_properties(block: str, name: str) -> list:
   else:
     return []
 
+# members: of as-set/route-set objects, continuation lines included: large sets spread their members over many lines
+#   members:        AS1001, AS1002,
+#                   AS-FOO
+def parse_members(block: bytes, name: bytes) -> list:
+  members = []
+  for match in re.findall(rb'^%s:[ \t]*(.*(?:\n[ \t+].*)*)' % (name), block, re.MULTILINE):
+    for member in re.split(r'[\s,]+', match.decode('utf-8').replace('\n+', ' ')):
+      if not member:
+        continue
+      # set names and ASNs are case insensitive, prefixes keep their range operator (192.0.2.0/24^+)
+      members.append(member if '/' in member else member.split('^')[0].upper())
+  return list(dict.fromkeys(members))
+
+
 def parse_property(block: str, name: str) -> str:
   match = re.findall(rb'^%s:\s?(.+)$' % (name), block, re.MULTILINE)
   print
@@ -152,31 +213,28 @@ def parse_property_inetnum(block: str):
   match = re.findall(
     rb'^inetnum:[\s]*((?:\d{1,3}\.){3}\d{1,3})[\s]*-[\s]*((?:\d{1,3}\.){3}\d{1,3})', block, re.MULTILINE)
   if match:
-    # netaddr can only handle strings, not bytes
-    ip_start = match[0][0].decode('utf-8')
-    ip_end = match[0][1].decode('utf-8')
-    cidrs = iprange_to_cidrs(ip_start, ip_end)
-    return (str(x).encode('utf-8') for x in cidrs)
+    # v2.2.6: integer range -> CIDR, memoized on the matched bytes (db/iputil.py) instead of netaddr objects
+    return iprange_to_cidrs(match[0][0], match[0][1])
   # direct CIDR in lacnic db
   match = re.findall(rb'^inetnum:[\s]*((?:\d{1,3}\.){3}\d{1,3}/\d+)', block, re.MULTILINE)
   if match:
-    return [match[0]]
+    return [prefix_str(match[0])]
   # lacnic with wrong ip
   # inetnum:  177.46.7/24
   match = re.findall(rb'^inetnum:[\s]*((?:\d{1,3}\.){2}\d{1,3}/\d+)', block, re.MULTILINE)
   if match:
     tmp = match[0].split(b"/")
-    return [f"{tmp[0].decode('utf-8')}.0/{tmp[1].decode('utf-8')}".encode("utf-8")]
+    return [f"{tmp[0].decode('utf-8')}.0/{tmp[1].decode('utf-8')}"]
   # inetnum:  148.204/16
   match = re.findall(rb'^inetnum:[\s]*((?:\d{1,3}\.){1}\d{1,3}/\d+)', block, re.MULTILINE)
   if match:
     tmp = match[0].split(b"/")
-    return [f"{tmp[0].decode('utf-8')}.0.0/{tmp[1].decode('utf-8')}".encode("utf-8")]
+    return [f"{tmp[0].decode('utf-8')}.0.0/{tmp[1].decode('utf-8')}"]
   # IPv6
   match = re.findall(
     rb'^inet6num:[\s]*([0-9a-fA-F:\/]{1,43})', block, re.MULTILINE)
   if match:
-    return [match[0]]
+    return [prefix_str(match[0])]
   # return None
   
   # no sir, a route is not an inet. 
@@ -190,24 +248,30 @@ def parse_property_inetnum(block: str):
   match = re.findall(
     rb'^route:[\s]*((?:\d{1,3}\.){3}\d{1,3}/\d{1,2})', block, re.MULTILINE)
   if match:
-    return [match[0]]
+    return [prefix_str(match[0])]
   # route6 IPv6
   match = re.findall(
     rb'^route6:[\s]*([0-9a-fA-F:\/]{1,43})', block, re.MULTILINE)
   if match:
-    return [match[0]]
+    return [prefix_str(match[0])]
   return None
 
 
-def read_blocks(filepath: str) -> list:
+# v2.2.21: the class of a block is read from its first line: a block of a class that is not in types is skipped line by
+# line without being buffered, the kept ones are joined once from their lines (no more bytes += per line).
+# types: the class names to keep, all the loaded classes (CLASS_TABLES) by default
+def read_blocks(filepath: str, types=None) -> list:
   if filepath.endswith('.gz'):
     opemethod = gzip.open
   else:
     opemethod = open
   cust_source = get_source(filepath.split('/')[-1])
-  single_block = b''
+  source_line = b"cust_source: %s" % (cust_source.encode('utf-8'))
+  keep = frozenset(name.encode('utf-8') for name in (CLASS_TABLES if types is None else types))
+  lines = None            # the lines of the block being kept
+  skipping = False        # inside a block of a class not kept
   blocks = []
-  ignored_blocks = 0
+  ignored = {}            # class -> blocks skipped
   filesize = os.stat(filepath).st_size
   for cutoff in BLOCKLOAD_MODULO.keys():
     if filesize > cutoff: modulo = BLOCKLOAD_MODULO[cutoff]
@@ -219,23 +283,33 @@ def read_blocks(filepath: str) -> list:
         continue
       # block end
       if line.strip() == b'':
-        if single_block.lower().startswith((b'inetnum:', b'inet6num:', b'route:', b'route6:', b'as-set:', b'inetnum', b'route', b'inet6num', b'route6', b'mntner', b'person', b'role', b'organisation', b'irt', b'aut-num', b'as-set', b'route-set', b'domain')):
+        if lines:
           # add source
-          single_block += b"cust_source: %s" % (cust_source.encode('utf-8'))
-          blocks.append(single_block)
+          lines.append(source_line)
+          blocks.append(b''.join(lines))
           if len(blocks) % modulo == 0:
-            logger.debug(f"read_blocks: another {modulo} blocks so far, Kept ({len(blocks)} blocks, Ignored {ignored_blocks} blocks, ")
-          single_block = b''
+            logger.debug(f"read_blocks: another {modulo} blocks so far, Kept ({len(blocks)} blocks, Ignored {sum(ignored.values())} blocks)")
           # comment out to only parse x blocks
           # if len(blocks) == 100:
           #  break
+        lines = None
+        skipping = False
+      elif lines is not None:
+        lines.append(line)
+      elif not skipping:
+        # first line of a block: its class
+        name = line.partition(b':')[0].strip().lower()
+        if name in keep:
+          lines = [line]
         else:
-          # empty block
-          single_block = b''
-          ignored_blocks += 1
-      else:
-        single_block += line
-  logger.info(f"read_blocks: Kept {len(blocks)} blocks + Ignored {ignored_blocks} blocks = Total {len(blocks) + ignored_blocks} blocks")
+          skipping = True
+          ignored[name] = ignored.get(name, 0) + 1
+    # the last block, when the file does not end with a blank line
+    if lines:
+      lines.append(source_line)
+      blocks.append(b''.join(lines))
+  skipped = ', '.join(f"{name.decode('utf-8', 'replace')} {count}" for name, count in sorted(ignored.items(), key=lambda item: -item[1]))
+  logger.info(f"read_blocks: Kept {len(blocks)} blocks + Ignored {sum(ignored.values())} blocks = Total {len(blocks) + sum(ignored.values())} blocks{f' (ignored: {skipped})' if skipped else ''}")
   return blocks
 
 
@@ -283,41 +357,6 @@ def partition(pred, iterable):
   return trues, falses
 
 
-# https://docs.sqlalchemy.org/en/20/tutorial/data_select.html#using-select-statements
-# https://docs.sqlalchemy.org/en/20/core/operators.html
-def selectCidrRow(session, table, cidr, autnum):
-  stmt = select(table).where(and_(table.inetnum == cidr, table.autnum == autnum))
-  # sqlalchemy.exc.InvalidRequestError: This session is in 'prepared' state; no further SQL can be emitted within this transaction.
-  try:
-    session.flush() # if autoflush=True, select will flush; better perf if only select flushes, we spare the flush time from add()
-    # rows = session.query(table).filter(table.inetnum == cidr).first()
-    rows = session.execute(stmt).first()
-  except:
-    rows = None
-  logger.debug(f"(cidr=\"{cidr}\",autnum=\"{autnum}\" : rows={rows}")    # ('4.53.100.168/29',)
-  return rows
-
-
-# selectParentRow(BlockParent, "4.36.104.120/29")
-# selectParentRow(BlockParent, "ARIN", ""4.36.104.120/29")
-# def selectParentRow(session, table, child):
-  # return session.query(BlockParent).filter(BlockParent.child == child).first()
-# https://docs.sqlalchemy.org/en/20/tutorial/data_select.html#using-select-statements
-# https://docs.sqlalchemy.org/en/20/core/operators.html
-# v2.0.20:  Okay we have a problem here, in multiprocessing: since 1 route has multiple autnum, we get dupes mntn-by going into parent table.
-#           That's not a problem with 1 thread, but in multithread, the select of Process-x occasionally happens before the insert of Process-y and boom we get an IntegrityError
-def selectParentRow(session, table, parent, parent_type, child, child_type):
-  # https://docs.sqlalchemy.org/en/20/tutorial/data_select.html#using-select-statements
-  # stmt = select(table).where(table.parent == parent, table.parent_type == parent_type, table.child == child, table.child_type == child_type)
-  # return session.execute(stmt).first()
-  try:
-    session.flush() # if autoflush=True, select will flush; better perf if only select flushes, we spare the flush time from add()
-    rows = session.query(table).filter(and_(table.parent == parent, table.parent_type == parent_type, table.child == child, table.child_type == child_type)).first()
-  except:
-    rows = None
-  return rows
-
-
 def printDbSize(session, message):
   try:
     countCidr = session.query(BlockCidr).count()
@@ -362,769 +401,717 @@ def getSessionParentRow(session, table, parent, parent_type, child, child_type):
 
 
 
-def parse_blocks(jobs: Queue, connection_string: str, blocks_total, bskip_total, bdupes_total):
-# def parse_blocks(jobs: Queue, reader, writter, blocks_total, bskip_total, bdupes_total):
-  # A Session object is basically an ongoing transaction of changes to a database (update, insert, delete). These operations aren't persisted to the database until they are committed (if your program aborts for some reason in mid-session transaction, any uncommitted changes within are lost).
-  # The session object registers transaction operations with session.add(), but doesn't yet communicate them to the database until session.flush() is called.
-  # session.flush() communicates a series of operations to the database (insert, update, delete). The database maintains them as pending operations in a transaction. The changes aren't persisted permanently to disk, or visible to other transactions until the database receives a COMMIT for the current transaction (which is what session.commit() does).
-  # session.commit() commits (persists) those changes to the database.
-  # flush() is always called as part of a call to commit() (1).
-  # When you use a Session object to query the database, the query will return results both from the database and from the flushed parts of the uncommitted transaction it holds. By default, Session objects autoflush their operations, but this can be disabled.
-  session = setup_connection(connection_string)
-
-  # all the value below are PER WORKER
-  inserts = 0             # insert main rows
-  dupes = 0               # dupes main rows detected
-  rollbacks = 0           # dupes main rows missed = race condition
-  insertsp = 0            # insert parent rows
-  dupesp = 0              # dupes parent rows detected
-  rollbacksp = 0          # dupes parent rows missed = race condition
-  blocks_processed = 0    # processed rows: bypassed, added, and rollbacked
-  bskip = 0               # this worker's blocks skipped
-  TIME2COMMIT = False
+# v2.2.7: parsing only, no database: {'cidr': [..], 'parent': [..]} lists of column dicts, None when the block is skipped.
+# parse_blocks() inserts the rows, db/export.py writes them to parquet/arrow files.
+def parse_block(block: bytes):
+  source = parse_property(block, b'cust_source')
+  
+  # BlockCidr: inetnum, route, inet6num, route6
+  TIMER.lap('tokenize')
+  inetnum       = parse_property_inetnum(block)   # v2.2.6: a list of str CIDRs, no longer bytes
+  TIMER.lap('cidr-convert')
+  # route         = parse_property_route(block)   # easier to combine inetnum and route
+  
+  # BlockMember: mntner, person, role, organisation, irt
+  mntner        = parse_property(block, b'mntner')
+  person        = parse_property(block, b'person')
+  role          = parse_property(block, b'role')
+  organisation  = parse_property(block, b'organisation')
+  irt           = parse_property(block, b'irt')
+  
+  # BlockAttr: aut-num, as-set, route-set, domain
+  autnum        = parse_property(block, b'aut-num')
+  asset         = parse_property(block, b'as-set')
+  routeset      = parse_property(block, b'route-set')
+  domain        = parse_property(block, b'domain')
+  
+  # if not inetnum and not mntner and not person and not role and not organisation and not domain and not irt and not autnum and not asset and not routeset:
+  # v2.2.13: aut-num, as-set and route-set are parsed too, db/sets.py expands the sets
+  if not inetnum and not autnum and not asset and not routeset:
+    # invalid entry, do not parse
+    # logger.info(f"Could not parse block {block}.")
+    return None
+  # logger.info(block)
 
-  seconds = 0.0000000000000001
-  seconds_total = 0.0000000000000001
-  start_time = time.time()
-  while True:
-    block = jobs.get()
-    if block is None:
-      logger.debug(f"------------- End of blocks -------------")
-      break
-    
-    source = parse_property(block, b'cust_source')
+  
+  # Attribute Name    Presence   Repeat     Indexed
+  # inetnum:          mandatory  single     primary/lookup key
+  # netname:          mandatory  single     lookup key
+  # descr:            optional   multiple  
+  # country:          mandatory  multiple  
+  # geofeed:          optional   single
+  # geoloc:           optional   single    
+  # language:         optional   multiple  
+  # org:              optional   single     inverse key
+  # sponsoring-org:   optional   single    
+  # admin-c:          mandatory  multiple   inverse key
+  # tech-c:           mandatory  multiple   inverse key
+  # abuse-c:          optional   single     inverse key
+  # status:           mandatory  single    
+  # assignment-size:  optional   single 
+  # remarks:          optional   multiple  
+  # notify:           optional   multiple   inverse key
+  # mnt-by:           mandatory  multiple   inverse key
+  # mnt-lower:        optional   multiple   inverse key
+  # mnt-routes:       optional   multiple   inverse key
+  # mnt-domains:      optional   multiple   inverse key
+  # mnt-irt:          optional   multiple   inverse key
+  # created:          generated  single
+  # last-modified:    generated  single
+  # source:           mandatory  single  
+
+  # Attribute Name  Presence   Repeat     Indexed
+  # route:          mandatory  single     primary/lookup key
+  # descr:          optional   multiple   
+  # origin:         mandatory  single     primary/inverse key
+  # pingable:       optional   multiple   
+  # ping-hdl:       optional   multiple   inverse key
+  # holes:          optional   multiple   
+  # org:            optional   multiple   inverse key
+  # member-of:      optional   multiple   inverse key     <- must match mbrs-by-ref in referenced attr
+  # inject:         optional   multiple   
+  # aggr-mtd:       optional   single     
+  # aggr-bndry:     optional   single     
+  # export-comps:   optional   single     
+  # components:     optional   single     
+  # remarks:        optional   multiple   
+  # notify:         optional   multiple   inverse key
+  # mnt-lower:      optional   multiple   inverse key
+  # mnt-routes:     optional   multiple   inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # created:        generated  single     
+  # last-modified:  generated  single     
+  # source:         mandatory  single     
+  
+  rows = {'cidr': [], 'parent': [], 'attr': []}
+  # BlockCidr: inetnum, route
+  # if inetnum or route:
+  if inetnum:
+    # INETNUM netname: is a name given to a range of IP address space. 
+    # A netname is made up of letters, digits, the underscore character and the hyphen character. 
+    # The first character of a name must be a letter, and the last character of a name must be a letter or a digit. 
+    # It is recommended that the same netname be used for any set of assignment ranges used for a common purpose, such as a customer or service.
+    netname = parse_property(block, b'netname')
+    if netname:
+      attr='inetnum'
+    else:
+      # We need to be able to reference routes with aut-num as they have no name.
+      # Therefore, we use route==netname in the parent table as parent for inverse keys
+      # netname = route = 1.1.1.0/24
+      netname = inetnum[0]
+      attr='route'
     
-    # BlockCidr: inetnum, route, inet6num, route6
-    inetnum       = parse_property_inetnum(block)   # will always be a list of byte encoded
-    # route         = parse_property_route(block)   # easier to combine inetnum and route
+    # ROUTE origin: is autnum=AS Number of the Autonomous System that originates the route into the interAS routing system. 
+    # The corresponding aut-num attr for this Autonomous System may not exist in the RIPE Database.
+    autnum = parse_property(block, b'origin')
     
-    # BlockMember: mntner, person, role, organisation, irt
-    mntner        = parse_property(block, b'mntner')
-    person        = parse_property(block, b'person')
-    role          = parse_property(block, b'role')
-    organisation  = parse_property(block, b'organisation')
-    irt           = parse_property(block, b'irt')
+    description = parse_property(block, b'descr')
+    remarks = parse_property(block, b'remarks')
     
-    # BlockAttr: aut-num, as-set, route-set, domain
-    autnum        = parse_property(block, b'aut-num')
-    asset         = parse_property(block, b'as-set')
-    routeset      = parse_property(block, b'route-set')
-    domain        = parse_property(block, b'domain')
+    country = parse_property(block, b'country')
+    # if we have a city attr, append it to the country
+    # we likely will never have one, instead they can be found in remarks
+    # city = parse_property(block, b'city')
     
-    # if not inetnum and not mntner and not person and not role and not organisation and not domain and not irt and not autnum and not asset and not routeset:
-    if not inetnum:
-      # invalid entry, do not parse
-      # logger.info(f"Could not parse block {block}.")
-      bskip += 1
-      bskip_total.increment()
-      continue
-    # logger.info(block)
-
+    # Parent table:
+    mntby     = ('mntner', parse_properties(block, b'mnt-by'))
+    memberof  = ('route-set', parse_properties(block, b'member-of'))
+    org       = ('organisation', parse_properties(block, b'org'))
+    mntlowers = ('mntner', parse_properties(block, b'mnt-lower'))
+    mntroutes = ('mntner', parse_properties(block, b'mnt-routes'))
+    mntdomains= ('mntner', parse_properties(block, b'mnt-domains'))
+    mntnfy    = ('mntner', parse_properties(block, b'mnt-nfy'))
+    mntirt    = ('mntner', parse_properties(block, b'mnt-irt'))
+    adminc    = ('mntner', parse_properties(block, b'admin-c'))
+    techc     = ('mntner', parse_properties(block, b'tech-c'))
+    abusec    = ('mntner', parse_properties(block, b'abuse-c'))
     
-    # Attribute Name    Presence   Repeat     Indexed
-    # inetnum:          mandatory  single     primary/lookup key
-    # netname:          mandatory  single     lookup key
-    # descr:            optional   multiple  
-    # country:          mandatory  multiple  
-    # geofeed:          optional   single
-    # geoloc:           optional   single    
-    # language:         optional   multiple  
-    # org:              optional   single     inverse key
-    # sponsoring-org:   optional   single    
-    # admin-c:          mandatory  multiple   inverse key
-    # tech-c:           mandatory  multiple   inverse key
-    # abuse-c:          optional   single     inverse key
-    # status:           mandatory  single    
-    # assignment-size:  optional   single 
-    # remarks:          optional   multiple  
-    # notify:           optional   multiple   inverse key
-    # mnt-by:           mandatory  multiple   inverse key
-    # mnt-lower:        optional   multiple   inverse key
-    # mnt-routes:       optional   multiple   inverse key
-    # mnt-domains:      optional   multiple   inverse key
-    # mnt-irt:          optional   multiple   inverse key
-    # created:          generated  single
-    # last-modified:    generated  single
-    # source:           mandatory  single  
-
-    # Attribute Name  Presence   Repeat     Indexed
-    # route:          mandatory  single     primary/lookup key
-    # descr:          optional   multiple   
-    # origin:         mandatory  single     primary/inverse key
-    # pingable:       optional   multiple   
-    # ping-hdl:       optional   multiple   inverse key
-    # holes:          optional   multiple   
-    # org:            optional   multiple   inverse key
-    # member-of:      optional   multiple   inverse key     <- must match mbrs-by-ref in referenced attr
-    # inject:         optional   multiple   
-    # aggr-mtd:       optional   single     
-    # aggr-bndry:     optional   single     
-    # export-comps:   optional   single     
-    # components:     optional   single     
-    # remarks:        optional   multiple   
-    # notify:         optional   multiple   inverse key
-    # mnt-lower:      optional   multiple   inverse key
-    # mnt-routes:     optional   multiple   inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # created:        generated  single     
-    # last-modified:  generated  single     
-    # source:         mandatory  single     
+    # Emails and local stuff
+    notifys   = ('e-mail', parse_properties(block, b'notify'))
     
-    # BlockCidr: inetnum, route
-    # if inetnum or route:
-    if inetnum:
-      # INETNUM netname: is a name given to a range of IP address space. 
-      # A netname is made up of letters, digits, the underscore character and the hyphen character. 
-      # The first character of a name must be a letter, and the last character of a name must be a letter or a digit. 
-      # It is recommended that the same netname be used for any set of assignment ranges used for a common purpose, such as a customer or service.
-      netname = parse_property(block, b'netname')
-      if netname:
-        attr='inetnum'
-      else:
-        # We need to be able to reference routes with aut-num as they have no name.
-        # Therefore, we use route==netname in the parent table as parent for inverse keys
-        # netname = route = 1.1.1.0/24
-        netname = inetnum[0].decode('utf-8')
-        attr='route'
-      
-      # ROUTE origin: is autnum=AS Number of the Autonomous System that originates the route into the interAS routing system. 
-      # The corresponding aut-num attr for this Autonomous System may not exist in the RIPE Database.
-      autnum = parse_property(block, b'origin')
-      
-      description = parse_property(block, b'descr')
-      remarks = parse_property(block, b'remarks')
-      
-      country = parse_property(block, b'country')
-      # if we have a city attr, append it to the country
-      # we likely will never have one, instead they can be found in remarks
-      # city = parse_property(block, b'city')
-      
-      # Parent table:
-      mntby     = ('mntner', parse_properties(block, b'mnt-by'))
-      memberof  = ('route-set', parse_properties(block, b'member-of'))
-      org       = ('organisation', parse_properties(block, b'org'))
-      mntlowers = ('mntner', parse_properties(block, b'mnt-lower'))
-      mntroutes = ('mntner', parse_properties(block, b'mnt-routes'))
-      mntdomains= ('mntner', parse_properties(block, b'mnt-domains'))
-      mntnfy    = ('mntner', parse_properties(block, b'mnt-nfy'))
-      mntirt    = ('mntner', parse_properties(block, b'mnt-irt'))
-      adminc    = ('mntner', parse_properties(block, b'admin-c'))
-      techc     = ('mntner', parse_properties(block, b'tech-c'))
-      abusec    = ('mntner', parse_properties(block, b'abuse-c'))
-      
-      # Emails and local stuff
-      notifys   = ('e-mail', parse_properties(block, b'notify'))
-      
-      created   = parse_property(block, b'created')
-      last_modified = parse_property(block, b'last-modified')
-      if not last_modified:
-        changed = parse_property(block, b'changed')
-        # *@ripe.net   19960624
-        # *@domain.com 20060331
-        # maybe repeated multiple times, we only take the first
-        if re.match(r'^.+?@.+? \d+', changed):
-          date = changed.split(" ")[1].strip()
-          if len(date) == 8:
-            year = int(date[0:4])
-            month = int(date[4:6])
-            day = int(date[6:8])
-            # some sanity checks for dates
-            if month >= 1 and month <=12 and day >= 1 and day <= 31:
-              last_modified = f"{year}-{month}-{day}"
-            else:
-              logger.debug(f"ignoring invalid changed date {date} ({attr} {inetnum[0].decode('utf-8')} block={blocks_processed - 1})")
-          else:
-            logger.debug(f"ignoring invalid changed date {date} ({attr} {inetnum[0].decode('utf-8')} block={blocks_processed - 1})")
-        elif "@" in changed:
-          # email in changed field without date
-          logger.debug(f"ignoring invalid changed date {changed} ({attr} {inetnum[0].decode('utf-8')} block={blocks_processed - 1})")
-        else:
-          last_modified = changed
-      status = parse_property(block, b'status')
-      
-      # v2.0.19
-      # v2.0.21
-      session.begin_nested()
-      
-      # https://stackoverflow.com/questions/2136739/error-handling-in-sqlalchemy
-      # https://stackoverflow.com/questions/32461785/sqlalchemy-check-before-insert-in-python
-      # logger.debug('----------------------------------------------------- for cidr in inetnum: %s --- % attr')
-      for cidr in inetnum:
-        # logger.debug(f"inetnum={cidr.decode('utf-8')}, attr={attr}, netname={netname}, autnum={autnum}")
-        
-        # 1. Looking for an existing Block object for these url value
-        # v2.0.20:  Okay we have a problem here, in multiprocessing: since 1 route has multiple autnum, we get dupes mntn-by going into parent table.
-        #           That's not a problem with 1 thread, but in multithread, the select of Process-x occasionally happens before the insert of Process-y and boom we get an IntegrityError
-        b = selectCidrRow(session, BlockCidr, cidr.decode('utf-8'), autnum)
-        # b = getSessionCidrRow(session, BlockCidr, cidr.decode('utf-8'), autnum)
-        if b:
-          # 2. A Block object exist and so we move on
-          dupes += 1
-          continue
-        # 3. A Block object doesn't exist so we create an instance
-        b = BlockCidr(inetnum=cidr.decode('utf-8'), autnum=autnum, netname=netname, attr=attr, description=description, remarks=remarks, country=country, created=created, last_modified=last_modified, status=status, source=source)
-        # 4. We create a savepoint in case of race condition 
-        # session.begin_nested()
+    created   = parse_property(block, b'created')
+    last_modified = parse_property(block, b'last-modified')
+    if not last_modified:
+      # v2.2.7: '' when there is neither last-modified nor changed, re.match(None) used to kill the worker
+      changed = parse_property(block, b'changed') or ''
+      # *@ripe.net   19960624
+      # *@domain.com 20060331
+      # maybe repeated multiple times, we only take the first
+      if re.match(r'^.+?@.+? \d+', changed):
+        date = changed.split(" ")[1].strip()
         try:
-          # logger.debug('counter2: %d' % inserts)
-          logger.debug("%s: BlockCidr %d/%d/%d:%d/%d inserts/blocks/btotal:dupes/dtotal (cidr='%s',autnum='%s',netname='%s','%s',..)" % ('before',inserts,blocks_processed,blocks_total.value(),dupes,bdupes_total.value(), cidr.decode('utf-8'),autnum,netname,attr))
-          session.add(b)
-          # session.merge(b)
-          # logger.debug('counter3: %d' % inserts)
-          # The session.add() will not be flushed until the next "query operation" happens on the Session
-          # 5. We try to insert and release the savepoint.
-          # session.flush()   # supposedly done with add() when autoflush=True
-          # session.commit()
-          # logger.debug('counter4: %d' % inserts)
-        except (IntegrityError) as e:
-          # It is absolutely impossible to have fuplicate cidr, therefore that would be an actual error to raise
-          # 6. The insert fail due to a concurrent transaction/actual dupe
-          # session.rollback()
-          rollbacks +=1
-          bdupes_total.increment()
-          logger.debug("%s: BlockCidr %d/%d/%d:%d/%d inserts/blocks/btotal:dupes/dtotal (cidr='%s',autnum='%s',netname='%s','%s',..)" % (e.__class__.__name__,inserts,blocks_processed,blocks_total.value(),dupes,bdupes_total.value(), cidr.decode('utf-8'),autnum,netname,attr))
-          # logger.debug('counter6: %d: %s' % (inserts, type(e))) #  <class 'sqlalchemy.exc.IntegrityError'>
-          # logger.debug('counter6: %d: %s' % (inserts, type(e))) #  <class 'sqlalchemy.exc.PendingRollbackError'>
-          # logger.debug(block)
-        except (Exception) as e:
-          # session.rollback()
-          rollbacks +=1
-          logger.error("%s: BlockCidr %d/%d/%d:%d/%d inserts/blocks/btotal:dupes/dtotal (cidr='%s',autnum='%s',netname='%s','%s',..)" % (e.__class__.__name__,inserts,blocks_processed,blocks_total.value(),dupes,bdupes_total.value(), cidr.decode('utf-8'),autnum,netname,attr))
-        else:
-          # inserts = updateCounter(inserts)
-          inserts, TIME2COMMIT = updateCounterLocal(inserts, TIME2COMMIT)
-          # inserts += 1
-      # session.commit()
-      # Okay.. there are so many of these relationships (order of magnitude 2 or 3 compared to actual inetnums) that we end up with deadlock detected
-      # By 31577 blocks we are up to 17633 dupes and down to 37 inserts/s
-      # By 95382 blocks we are up to 67665 dupes and down to 15 inserts/s
+          # a date postgres refuses (19960231) would reject the whole row
+          if len(date) != 8:
+            raise ValueError(date)
+          last_modified = datetime(int(date[0:4]), int(date[4:6]), int(date[6:8])).strftime('%Y-%m-%d')
+        except ValueError:
+          logger.debug(f"ignoring invalid changed date {date} ({attr} {inetnum[0]})")
+      elif changed:
+        # email without date, or no email at all: nothing for the last_modified column
+        logger.debug(f"ignoring invalid changed date {changed} ({attr} {inetnum[0]})")
+    status = parse_property(block, b'status')
+    
+    # v2.2.7: an inetnum has no origin: '' instead of None, autnum is part of the primary key and
+    # the NOT NULL violation used to roll back every inetnum row, only the routes were loaded
+    rows['cidr'] = [
+      {'inetnum': cidr, 'autnum': autnum or '', 'netname': netname, 'attr': attr, 'description': description, 'remarks': remarks,
+       'country': country, 'created': created, 'last_modified': last_modified, 'status': status, 'source': source}
+      for cidr in inetnum
+    ]
+    # inverse keys: the object is the child of its maintainers
+    # for parent_type, parents in [mntby, memberof, org, mntlowers, mntroutes, mntdomains, mntnfy, mntirt, adminc, techc, abusec, notifys]:
+    # v2.2.11: and of its organisation, db/search.py groups the netranges by it
+    for parent_type, parents in [mntby, org]:
+      for parent in parents:
+        rows['parent'].append({'parent': parent, 'parent_type': parent_type, 'child': netname, 'child_type': attr})
+    # local keys: the object is the parent of its e-mails
+    for child_type, children in [notifys]:
+      for child in children:
+        rows['parent'].append({'parent': netname, 'parent_type': attr, 'child': child, 'child_type': child_type})
+    
+  # Attribute Name  Presence   Repeat     Indexed
+  # mntner:         mandatory  single     primary/lookup key
+  # descr:          optional   multiple  
+  # org:            optional   multiple   inverse key
+  # admin-c:        mandatory  multiple   inverse key
+  # tech-c:         optional   multiple   inverse key
+  # upd-to:         mandatory  multiple   inverse key
+  # mnt-nfy:        optional   multiple   inverse key
+  # auth:           mandatory  multiple   inverse key
+  # remarks:        optional   multiple  
+  # notify:         optional   multiple   inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # mnt-ref:        optional   multiple   inverse key 
+  # created:        generated  single
+  # last-modified:  generated  single
+  # source:         mandatory  single  
+
+  # Attribute Name    Presence   Repeat     Indexed
+  # organisation:     mandatory  single     primary/lookup key
+  # org-name:         mandatory  single     lookup key
+  # org-type:         mandatory  single    
+  # descr:            optional   multiple  
+  # remarks:          optional   multiple  
+  # address:          mandatory  multiple 
+  # country:          optional   single 
+  # phone:            optional   multiple  
+  # fax-no:           optional   multiple  
+  # e-mail:           mandatory  multiple   lookup key
+  # geoloc:           optional   single    
+  # language:         optional   multiple  
+  # org:              optional   multiple   inverse key
+  # admin-c:          optional   multiple   inverse key
+  # tech-c:           optional   multiple   inverse key
+  # abuse-c:          optional   single     inverse key
+  # ref-nfy:          optional   multiple   inverse key
+  # mnt-ref:          mandatory  multiple   inverse key
+  # notify:           optional   multiple   inverse key
+  # mnt-by:           mandatory  multiple   inverse key
+  # created:          generated  single
+  # last-modified:    generated  single
+  # source:           mandatory  single   
+
+  # Attribute Name    Presence   Repeat     Indexed 
+  # person:           mandatory  single     lookup key
+  # nic-hdl:          mandatory  single     primary/lookup key
+  # address:          mandatory  multiple  
+  # phone:            mandatory  multiple  
+  # fax-no:           optional   multiple  
+  # e-mail:           optional   multiple   lookup key
+  # org:              optional   multiple   inverse key
+  # remarks:          optional   multiple  
+  # notify:           optional   multiple   inverse key
+  # mnt-by:           mandatory  multiple   inverse key
+  # mnt-ref:          optional   multiple   inverse key
+  # created:          generated  single
+  # last-modified:    generated  single
+  # source:           mandatory  single  
+
+  # Attribute Name  Presence   Repeat     Indexed
+  # role:           mandatory  single     lookup key
+  # nic-hdl:        mandatory  single     primary/lookup key
+  # address:        mandatory  multiple  
+  # phone:          optional   multiple  
+  # fax-no:         optional   multiple  
+  # e-mail:         mandatory  multiple   lookup key
+  # org:            optional   multiple   inverse key
+  # admin-c:        optional   multiple   inverse key
+  # tech-c:         optional   multiple   inverse key
+  # remarks:        optional   multiple  
+  # notify:         optional   multiple   inverse key
+  # abuse-mailbox:  optional   single     inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # mnt-ref:        optional   multiple   inverse key
+  # created:        generated  single
+  # last-modified:  generated  single
+  # source:         mandatory  single   
+  
+  # Attribute Name   Presence   Repeat     Indexed
+  # irt:            mandatory  single     primary/lookup key
+  # address:        mandatory  multiple  
+  # phone:          optional   multiple  
+  # fax-no:         optional   multiple  
+  # e-mail:         mandatory  multiple   lookup key
+  # signature:      optional   multiple  
+  # encryption:     optional   multiple  
+  # org:            optional   multiple   inverse key
+  # admin-c:        mandatory  multiple   inverse key
+  # tech-c:         mandatory  multiple   inverse key
+  # auth:           mandatory  multiple   inverse key
+  # remarks:        optional   multiple  
+  # irt-nfy:        optional   multiple   inverse key
+  # notify:         optional   multiple   inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # mnt-ref:        optional   multiple   inverse key
+  # created:        generated  single
+  # last-modified:  generated  single
+  # source:         mandatory  single   
+  
+  # BlockMember: mntner, person, role, organisation, irt
+  # mntner = parse_property(block, b'mntner')
+  # person = parse_property(block, b'person')
+  # role = parse_property(block, b'role')
+  # organisation = parse_property(block, b'organisation')
+  # irt = parse_property(block, b'irt')
+  
+  # if mntner or person or role or organisation or irt:
+    # if mntner:
+      # idd = name = mntner
+      # attr = 'mntner'
+    # if person:
+      # idd = parse_property(block, b'nic-hdl')
+      # name = person
+      # attr = 'person'
+    # if role:
+      # idd = parse_property(block, b'nic-hdl')
+      # name = role
+      # attr = 'role'
+    # if organisation:
+      # idd = organisation
+      # name = parse_property(block, b'org-name')
+      # attr = 'organisation'
+    # if irt:
+      # idd = name = irt
+      # attr = 'irt'
       
-      # logger.debug('----------------------------------------------------- for parent in parents: %s --- % attr')
-      # inverse keys:
-      # session.begin_nested()
-      # for parent_type, parents in [mntby, memberof, org, mntlowers, mntroutes, mntdomains, mntnfy, mntirt, adminc, techc, abusec, notifys]:
-      for parent_type, parents in [mntby]:
-        for parent in parents:
-          # if parent in ('MNT-CLOUD14','MNT-IEVOL','MNT-ESLAC-Z') and netname == '8.224.34.0/24':
-            # logger.info("%s: BlockParent %d dupe: select * from parent where parent='%s' and parent_type='%s' and child='%s' and child_type='%s';" % ('before',inserts, parent,parent_type,netname,attr))
-            # logger.info(block)
-          # 1. Looking for an existing Block object for these url value
-          b = selectParentRow(session, BlockParent, parent, parent_type, netname, attr)
-          # b = getSessionParentRow(session, BlockParent, parent, parent_type, netname, attr)   # so it works as long as you flush
-          if b:
-            # 2. A Block object exist and so we move on
-            dupesp +=1
-            continue
-          # 3. A Block object doesn't exist so we create an instance
-          b = BlockParent(parent=parent, parent_type=parent_type, child=netname, child_type=attr)
-          # 4. We create a savepoint in case of race condition 
-          # session.begin_nested()
-          try:
-            session.add(b)
-            # session.merge(b)
-            # getSessionParentRow(session, BlockParent, 'MNT-ET-547', 'mntner', '2.57.166.0/23', 'route')
-            # time.sleep(2)
-            # 5. We try to insert and release the savepoint
-            # session.flush()   # supposedly done with add() when autoflush=True
-            # session.commit()
-          except (IntegrityError) as e:
-            # 6. The insert fail due to a concurrent transaction/actual dupe
-            # session.rollback()
-            rollbacksp +=1
-            logger.debug("%s: BlockParent dupe %d: select * from parent where parent='%s' and parent_type='%s' and child='%s' and child_type='%s';" % (e.__class__.__name__,inserts, parent,parent_type,netname,attr))
-          except Exception as e:
-            # session.rollback()
-            rollbacksp +=1
-            logger.error("%s: BlockParent error %d: ('%s','%s','%s','%s')" % (e.__class__.__name__,inserts, parent,parent_type,netname,attr))
-          else:
-            # insertsp = updateCounter(inserts)
-            # insertsp, TIME2COMMIT = updateCounterLocal(insertsp, TIME2COMMIT)
-            insertsp += 1
-          
-        
-      # session.commit()
-      # logger.debug('----------------------------------------------------- for child in children: %s --- % attr')
-      # local keys:
-      # session.begin_nested()
-      for child_type, children in [notifys]:
-        for child in children:
-          # 1. Looking for an existing Block object for these url value
-          b = selectParentRow(session, BlockParent, netname, attr, child, child_type)
-          # b = getSessionParentRow(session, BlockParent, netname, attr, child, child_type)
-          if b:
-            # 2. A Block object exist and so we move on
-            dupesp +=1
-            continue
-          # 3. A Block object doesn't exist so we create an instance
-          b = BlockParent(parent=netname, parent_type=attr, child=child, child_type=child_type)
-          # 4. We create a savepoint in case of race condition 
-          # session.begin_nested()
-          try:
-            session.add(b)
-            # session.merge(b)
-            # 5. We try to insert and release the savepoint
-            # session.flush()   # supposedly done with add() when autoflush=True
-            # session.commit()
-          except (IntegrityError) as e:
-            # 6. The insert fail due to a concurrent transaction/actual dupe
-            # session.rollback()
-            rollbacksp +=1
-            logger.debug("%s: BlockParent dupe %d: ('%s','%s','%s','%s')" % (e.__class__.__name__,inserts, parent,parent_type,netname,attr))
-          except Exception as e:
-            # session.rollback()
-            rollbacksp +=1
-            logger.error("%s: BlockParent error %d: ('%s','%s','%s','%s')" % (e.__class__.__name__,inserts, parent,parent_type,netname,attr))
-          else:
-            # insertsp = updateCounter(inserts)
-            # insertsp, TIME2COMMIT = updateCounterLocal(insertsp, TIME2COMMIT)
-            insertsp += 1
-          
-        
-      # session.commit()
+    # description = parse_property(block, b'descr')
+    # remarks     = parse_property(block, b'remarks')
     
-    # Attribute Name  Presence   Repeat     Indexed
-    # mntner:         mandatory  single     primary/lookup key
-    # descr:          optional   multiple  
-    # org:            optional   multiple   inverse key
-    # admin-c:        mandatory  multiple   inverse key
-    # tech-c:         optional   multiple   inverse key
-    # upd-to:         mandatory  multiple   inverse key
-    # mnt-nfy:        optional   multiple   inverse key
-    # auth:           mandatory  multiple   inverse key
-    # remarks:        optional   multiple  
-    # notify:         optional   multiple   inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # mnt-ref:        optional   multiple   inverse key 
-    # created:        generated  single
-    # last-modified:  generated  single
-    # source:         mandatory  single  
-
-    # Attribute Name    Presence   Repeat     Indexed
-    # organisation:     mandatory  single     primary/lookup key
-    # org-name:         mandatory  single     lookup key
-    # org-type:         mandatory  single    
-    # descr:            optional   multiple  
-    # remarks:          optional   multiple  
-    # address:          mandatory  multiple 
-    # country:          optional   single 
-    # phone:            optional   multiple  
-    # fax-no:           optional   multiple  
-    # e-mail:           mandatory  multiple   lookup key
-    # geoloc:           optional   single    
-    # language:         optional   multiple  
-    # org:              optional   multiple   inverse key
-    # admin-c:          optional   multiple   inverse key
-    # tech-c:           optional   multiple   inverse key
-    # abuse-c:          optional   single     inverse key
-    # ref-nfy:          optional   multiple   inverse key
-    # mnt-ref:          mandatory  multiple   inverse key
-    # notify:           optional   multiple   inverse key
-    # mnt-by:           mandatory  multiple   inverse key
-    # created:          generated  single
-    # last-modified:    generated  single
-    # source:           mandatory  single   
-
-    # Attribute Name    Presence   Repeat     Indexed 
-    # person:           mandatory  single     lookup key
-    # nic-hdl:          mandatory  single     primary/lookup key
-    # address:          mandatory  multiple  
-    # phone:            mandatory  multiple  
-    # fax-no:           optional   multiple  
-    # e-mail:           optional   multiple   lookup key
-    # org:              optional   multiple   inverse key
-    # remarks:          optional   multiple  
-    # notify:           optional   multiple   inverse key
-    # mnt-by:           mandatory  multiple   inverse key
-    # mnt-ref:          optional   multiple   inverse key
-    # created:          generated  single
-    # last-modified:    generated  single
-    # source:           mandatory  single  
-
-    # Attribute Name  Presence   Repeat     Indexed
-    # role:           mandatory  single     lookup key
-    # nic-hdl:        mandatory  single     primary/lookup key
-    # address:        mandatory  multiple  
-    # phone:          optional   multiple  
-    # fax-no:         optional   multiple  
-    # e-mail:         mandatory  multiple   lookup key
-    # org:            optional   multiple   inverse key
-    # admin-c:        optional   multiple   inverse key
-    # tech-c:         optional   multiple   inverse key
-    # remarks:        optional   multiple  
-    # notify:         optional   multiple   inverse key
-    # abuse-mailbox:  optional   single     inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # mnt-ref:        optional   multiple   inverse key
-    # created:        generated  single
-    # last-modified:  generated  single
-    # source:         mandatory  single   
+    # # Parent table:
+    # org         =   ('organisation', parse_properties(block, b'org'))
+    # mntby       =   ('mntner', parse_properties(block, b'mnt-by'))
+    # adminc      =   ('mntner', parse_properties(block, b'admin-c'))
+    # techc       =   ('mntner', parse_properties(block, b'tech-c'))
+    # abusec      =   ('mntner', parse_properties(block, b'abuse-c'))
+    # mntnfys     =   ('mntner', parse_properties(block, b'mnt-nfy'))
+    # mntrefs     =   ('mntner', parse_properties(block, b'mnt-ref'))
     
-    # Attribute Name   Presence   Repeat     Indexed
-    # irt:            mandatory  single     primary/lookup key
-    # address:        mandatory  multiple  
-    # phone:          optional   multiple  
-    # fax-no:         optional   multiple  
-    # e-mail:         mandatory  multiple   lookup key
-    # signature:      optional   multiple  
-    # encryption:     optional   multiple  
-    # org:            optional   multiple   inverse key
-    # admin-c:        mandatory  multiple   inverse key
-    # tech-c:         mandatory  multiple   inverse key
-    # auth:           mandatory  multiple   inverse key
-    # remarks:        optional   multiple  
-    # irt-nfy:        optional   multiple   inverse key
-    # notify:         optional   multiple   inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # mnt-ref:        optional   multiple   inverse key
-    # created:        generated  single
-    # last-modified:  generated  single
-    # source:         mandatory  single   
+    # # Emails and local stuff)
+    # address     =   ('address', parse_properties(block, b'address'))
+    # phone       =   ('phone', parse_properties(block, b'phone'))
     
-    # BlockMember: mntner, person, role, organisation, irt
-    # mntner = parse_property(block, b'mntner')
-    # person = parse_property(block, b'person')
-    # role = parse_property(block, b'role')
-    # organisation = parse_property(block, b'organisation')
-    # irt = parse_property(block, b'irt')
+    # notifys     =   ('e-mail', parse_properties(block, b'notify'))
+    # irtnfys     =   ('e-mail', parse_properties(block, b'irt-nfy'))
+    # emails      =   ('e-mail', parse_properties(block, b'e-mail'))
+    # refnfys     =   ('e-mail', parse_properties(block, b'ref-nfy'))
+    # updtos      =   ('e-mail', parse_properties(block, b'upd-to'))
     
-    # if mntner or person or role or organisation or irt:
-      # if mntner:
-        # idd = name = mntner
-        # attr = 'mntner'
-      # if person:
-        # idd = parse_property(block, b'nic-hdl')
-        # name = person
-        # attr = 'person'
-      # if role:
-        # idd = parse_property(block, b'nic-hdl')
-        # name = role
-        # attr = 'role'
-      # if organisation:
-        # idd = organisation
-        # name = parse_property(block, b'org-name')
-        # attr = 'organisation'
-      # if irt:
-        # idd = name = irt
-        # attr = 'irt'
-        
-      # description = parse_property(block, b'descr')
-      # remarks     = parse_property(block, b'remarks')
-      
-      # # Parent table:
-      # org         =   ('organisation', parse_properties(block, b'org'))
-      # mntby       =   ('mntner', parse_properties(block, b'mnt-by'))
-      # adminc      =   ('mntner', parse_properties(block, b'admin-c'))
-      # techc       =   ('mntner', parse_properties(block, b'tech-c'))
-      # abusec      =   ('mntner', parse_properties(block, b'abuse-c'))
-      # mntnfys     =   ('mntner', parse_properties(block, b'mnt-nfy'))
-      # mntrefs     =   ('mntner', parse_properties(block, b'mnt-ref'))
-      
-      # # Emails and local stuff)
-      # address     =   ('address', parse_properties(block, b'address'))
-      # phone       =   ('phone', parse_properties(block, b'phone'))
-      
-      # notifys     =   ('e-mail', parse_properties(block, b'notify'))
-      # irtnfys     =   ('e-mail', parse_properties(block, b'irt-nfy'))
-      # emails      =   ('e-mail', parse_properties(block, b'e-mail'))
-      # refnfys     =   ('e-mail', parse_properties(block, b'ref-nfy'))
-      # updtos      =   ('e-mail', parse_properties(block, b'upd-to'))
-      
-      # b = BlockCidr(idd=idd, attr=attr, name=name, description=description, remarks=remarks)
-      # session.add(b)
-      # inserts = updateCounter(inserts)
+    # b = BlockCidr(idd=idd, attr=attr, name=name, description=description, remarks=remarks)
+    # session.add(b)
+    # inserts = updateCounter(inserts)
+    
+    # # inverse keys:
+    # for parent_type, parents in [org, mntby, adminc, techc, abusec, mntnfys, mntrefs]:
+      # for parent in parents:
+        # try:
+          # b = BlockParent(parent=parent, parent_type=parent_type, child=netname, child_type=attr)
+          # session.add(b)
+          # inserts = updateCounter(inserts)
+          # session.flush()
+        # except SQLAlchemyError as e:
+          # error = str(e.__dict__['orig'])
+          # print(type(e), error)
+    
+    # # local keys:
+    # for child_type, children in [address, phone, notifys, irtnfys, emails, refnfys, updtos]:
+      # for child in children:
+        # try:
+          # b = BlockParent(parent=netname, parent_type=attr, child=child, child_type=child_type)
+          # session.add(b)
+          # inserts = updateCounter(inserts)
+          # session.flush()
+        # except SQLAlchemyError as e:
+          # error = str(e.__dict__['orig'])
+          # print(type(e), error)
+  
+  
+  
+  # Attribute Name   Presence   Repeat     Indexed 
+  # aut-num:         mandatory  single     primary/lookup
+  # as-name:         mandatory  single          <- most often == netname
+  # descr:           optional   multiple  
+  # member-of:       optional   multiple   inverse
+  # import-via:      optional   multiple  
+  # import:          optional   multiple  
+  # mp-import:       optional   multiple  
+  # export-via:      optional   multiple  
+  # export:          optional   multiple  
+  # mp-export:       optional   multiple  
+  # default:         optional   multiple  
+  # mp-default:      optional   multiple  
+  # remarks:         optional   multiple  
+  # org:             optional   single     inverse
+  # sponsoring-org:  optional   single     inverse
+  # admin-c:         mandatory  multiple   inverse
+  # tech-c:          mandatory  multiple   inverse
+  # abuse-c:         optional   single     inverse
+  # status:          generated  single    
+  # notify:          optional   multiple   inverse
+  # mnt-by:          mandatory  multiple   inverse
+  # created:         generated  single
+  # last-modified:   generated  single
+  # source:          mandatory  single  
+
+  # Attribute Name  Presence   Repeat     Indexed
+  # as-set:         mandatory  single     primary/lookup key
+  # descr:          optional   multiple
+  # members:        optional   multiple  
+  # mbrs-by-ref:    optional   multiple   inverse key
+  # remarks:        optional   multiple  
+  # org:            optional   multiple   inverse key
+  # tech-c:         mandatory  multiple   inverse key
+  # admin-c:        mandatory  multiple   inverse key
+  # notify:         optional   multiple   inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # mnt-lower:      optional   multiple   inverse key
+  # created:        generated  single
+  # last-modified:  generated  single
+  # source:         mandatory  single 
+
+  # Attribute Name  Presence   Repeat     Indexed
+  # route-set:      mandatory  single     primary/lookup key
+  # descr:          optional   multiple
+  # members:        optional   multiple  
+  # mp-members:     optional   multiple  
+  # mbrs-by-ref:    optional   multiple   inverse key
+  # remarks:        optional   multiple  
+  # org:            optional   multiple   inverse key
+  # tech-c:         mandatory  multiple   inverse key
+  # admin-c:        mandatory  multiple   inverse key
+  # notify:         optional   multiple   inverse key
+  # mnt-by:         mandatory  multiple   inverse key
+  # mnt-lower:      optional   multiple   inverse key
+  # created:        generated  single
+  # last-modified:  generated  single
+  # source:         mandatory  single   
+  
+  # Attribute Name    Presence       Repeat       Indexed
+  # domain:           mandatory      single       primary/lookup
+  # descr:            optional       multiple
+  # org:              optional       multiple     inverse
+  # admin-c:          mandatory      multiple     inverse
+  # tech-c:           mandatory      multiple     inverse
+  # zone-c:           mandatory      multiple     inverse
+  # nserver:          mandatory      multiple     inverse
+  # ds-rdata:         optional       multiple     inverse
+  # remarks:          optional       multiple
+  # notify:           optional       multiple     inverse
+  # mnt-by:           mandatory      multiple     inverse
+  # created:          generated      single
+  # last-modified:    generated      single
+  # source:           mandatory      single
+  
+  # BlockAttr: aut-num, as-set, route-set, domain
+  # autnum = parse_property(block, b'aut-num')
+  # asset = parse_property(block, b'as-set')
+  # routeset = parse_property(block, b'route-set')
+  # domain = parse_property(block, b'domain')
+  
+  # if autnum or asset or routeset or domain:
+    # if autnum:
+      # name = autnum
+      # attr = 'aut-num'
+    # if asset:
+      # name = asset
+      # attr = 'as-set'
+    # if routeset:
+      # name = routeset
+      # attr = 'route-set'
+    # if domain:
+      # name = domain
+      # attr = 'domain'
       
-      # # inverse keys:
-      # for parent_type, parents in [org, mntby, adminc, techc, abusec, mntnfys, mntrefs]:
-        # for parent in parents:
-          # try:
-            # b = BlockParent(parent=parent, parent_type=parent_type, child=netname, child_type=attr)
-            # session.add(b)
-            # inserts = updateCounter(inserts)
-            # session.flush()
-          # except SQLAlchemyError as e:
-            # error = str(e.__dict__['orig'])
-            # print(type(e), error)
+    # description = parse_property(block, b'descr')
+    # remarks     = parse_property(block, b'remarks')
+    
+    # # Parent table:
+    # # if asset:
+      # # mbrsbyref = ('aut-num', parse_properties(block, b'mbrs-by-ref'))
+    # # else:
+      # # # route-set contains a mix of aut-num and routes (CIDR), just great...
+      # # # TODO: identify each value and create 2 lists one for each type
+      # # mbrsbyref = (None, [])
+      # # # mbrsbyref   = ('organisation', parse_properties(block, b'mbrs-by-ref'))
+    # org         = ('organisation', parse_properties(block, b'org'))
+    # mntby       = ('mntner', parse_properties(block, b'mnt-by'))
+    # mntlowers   = ('mntner', parse_properties(block, b'mnt-lower'))
+    # adminc      = ('mntner', parse_properties(block, b'admin-c'))
+    # techc       = ('mntner', parse_properties(block, b'tech-c'))
+    # abusec      = ('mntner', parse_properties(block, b'abuse-c'))
       
-      # # local keys:
-      # for child_type, children in [address, phone, notifys, irtnfys, emails, refnfys, updtos]:
-        # for child in children:
-          # try:
-            # b = BlockParent(parent=netname, parent_type=attr, child=child, child_type=child_type)
-            # session.add(b)
-            # inserts = updateCounter(inserts)
-            # session.flush()
-          # except SQLAlchemyError as e:
-            # error = str(e.__dict__['orig'])
-            # print(type(e), error)
+    # # Emails and local stuff
+    # notifys     = ('e-mail', parse_properties(block, b'notify'))
+    # members = routes_members = autnums_members = (None, [])
     
+    # if asset:
+      # members     = ('aut-num', parse_properties(block, b'members'))
+    # else:
+      # # route-set contains a mix of aut-num and routes (CIDR), just great...
+      # # TODO: identify each value and create 2 lists one for each type: DONE
+      # routes, autnums = partition(lambda x: re.search(rb'([0-9a-fA-F:\.]+/{1,3})', x), parse_properties(block, b'members'))
+      # print('routes',routes)
+      # print('autnums',autnums)
+      # if routes:
+        # routes_members = ('route', routes)
+      # if autnums:
+        # autnums_members = ('aut-num', autnums)
     
+    # b = BlockAttr(name=name, attr=attr, description=description, remarks=remarks)
+    # session.add(b)
+    # inserts = updateCounter(inserts)
     
-    # Attribute Name   Presence   Repeat     Indexed 
-    # aut-num:         mandatory  single     primary/lookup
-    # as-name:         mandatory  single          <- most often == netname
-    # descr:           optional   multiple  
-    # member-of:       optional   multiple   inverse
-    # import-via:      optional   multiple  
-    # import:          optional   multiple  
-    # mp-import:       optional   multiple  
-    # export-via:      optional   multiple  
-    # export:          optional   multiple  
-    # mp-export:       optional   multiple  
-    # default:         optional   multiple  
-    # mp-default:      optional   multiple  
-    # remarks:         optional   multiple  
-    # org:             optional   single     inverse
-    # sponsoring-org:  optional   single     inverse
-    # admin-c:         mandatory  multiple   inverse
-    # tech-c:          mandatory  multiple   inverse
-    # abuse-c:         optional   single     inverse
-    # status:          generated  single    
-    # notify:          optional   multiple   inverse
-    # mnt-by:          mandatory  multiple   inverse
-    # created:         generated  single
-    # last-modified:   generated  single
-    # source:          mandatory  single  
-
-    # Attribute Name  Presence   Repeat     Indexed
-    # as-set:         mandatory  single     primary/lookup key
-    # descr:          optional   multiple
-    # members:        optional   multiple  
-    # mbrs-by-ref:    optional   multiple   inverse key
-    # remarks:        optional   multiple  
-    # org:            optional   multiple   inverse key
-    # tech-c:         mandatory  multiple   inverse key
-    # admin-c:        mandatory  multiple   inverse key
-    # notify:         optional   multiple   inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # mnt-lower:      optional   multiple   inverse key
-    # created:        generated  single
-    # last-modified:  generated  single
-    # source:         mandatory  single 
-
-    # Attribute Name  Presence   Repeat     Indexed
-    # route-set:      mandatory  single     primary/lookup key
-    # descr:          optional   multiple
-    # members:        optional   multiple  
-    # mp-members:     optional   multiple  
-    # mbrs-by-ref:    optional   multiple   inverse key
-    # remarks:        optional   multiple  
-    # org:            optional   multiple   inverse key
-    # tech-c:         mandatory  multiple   inverse key
-    # admin-c:        mandatory  multiple   inverse key
-    # notify:         optional   multiple   inverse key
-    # mnt-by:         mandatory  multiple   inverse key
-    # mnt-lower:      optional   multiple   inverse key
-    # created:        generated  single
-    # last-modified:  generated  single
-    # source:         mandatory  single   
+    # # inverse keys:
+    # for parent_type, parents in [org, mntby, mntlowers, adminc, techc, abusec]:
+      # for parent in parents:
+        # try:
+          # b = BlockParent(parent=parent, parent_type=parent_type, child=name, child_type=attr)
+          # session.add(b)
+          # inserts = updateCounter(inserts)
+          # session.flush()
+        # except SQLAlchemyError as e:
+          # error = str(e.__dict__['orig'])
+          # print(type(e), error)
     
-    # Attribute Name    Presence       Repeat       Indexed
-    # domain:           mandatory      single       primary/lookup
-    # descr:            optional       multiple
-    # org:              optional       multiple     inverse
-    # admin-c:          mandatory      multiple     inverse
-    # tech-c:           mandatory      multiple     inverse
-    # zone-c:           mandatory      multiple     inverse
-    # nserver:          mandatory      multiple     inverse
-    # ds-rdata:         optional       multiple     inverse
-    # remarks:          optional       multiple
-    # notify:           optional       multiple     inverse
-    # mnt-by:           mandatory      multiple     inverse
-    # created:          generated      single
-    # last-modified:    generated      single
-    # source:           mandatory      single
+    # # local keys:
+    # for child_type, children in [notifys, members, routes_members, autnums_members]:
+      # for child in children:
+        # try:
+          # b = BlockParent(parent=name, parent_type=attr, child=child, child_type=child_type)
+          # session.add(b)
+          # inserts = updateCounter(inserts)
+          # session.flush()
+        # except SQLAlchemyError as e:
+          # error = str(e.__dict__['orig'])
+          # print(type(e), error)
+  
+  # v2.2.13: aut-num, as-set, route-set: the object in attr, its members as parent rows (set -> member)
+  if not inetnum:
+    if asset:
+      name, attr = asset.upper(), 'as-set'
+    elif routeset:
+      name, attr = routeset.upper(), 'route-set'
+    else:
+      name, attr = autnum.upper(), 'aut-num'
+    rows['attr'].append({'name': name, 'attr': attr, 'description': parse_property(block, b'descr'), 'remarks': parse_property(block, b'remarks')})
+    for parent_type, parents in [('mntner', parse_properties(block, b'mnt-by')), ('organisation', parse_properties(block, b'org'))]:
+      for parent in parents:
+        rows['parent'].append({'parent': parent, 'parent_type': parent_type, 'child': name, 'child_type': attr})
+    if attr != 'aut-num':
+      for member in parse_members(block, b'members') + parse_members(block, b'mp-members'):
+        rows['parent'].append({'parent': name, 'parent_type': attr, 'child': member, 'child_type': member_type(member)})
+  
+  return rows
+
+
+def parse_blocks(jobs: Queue, connection_string: str, schema, progress: Progress, worker: int, results: Queue = None):
+# def parse_blocks(jobs: Queue, reader, writter, blocks_total, bskip_total, bdupes_total):
+  # A Session object is basically an ongoing transaction of changes to a database (update, insert, delete). These operations aren't persisted to the database until they are committed (if your program aborts for some reason in mid-session transaction, any uncommitted changes within are lost).
+  # The session object registers transaction operations with session.add(), but doesn't yet communicate them to the database until session.flush() is called.
+  # session.flush() communicates a series of operations to the database (insert, update, delete). The database maintains them as pending operations in a transaction. The changes aren't persisted permanently to disk, or visible to other transactions until the database receives a COMMIT for the current transaction (which is what session.commit() does).
+  # session.commit() commits (persists) those changes to the database.
+  # flush() is always called as part of a call to commit() (1).
+  # When you use a Session object to query the database, the query will return results both from the database and from the flushed parts of the uncommitted transaction it holds. By default, Session objects autoflush their operations, but this can be disabled.
+  # schema: SHADOW_SCHEMA when rebuilding with --reset_db, None to write into the live tables
+  # v2.2.14: --stage_times/--profile, the totals go back to main() through results, with the rows this worker lost
+  # v2.2.15: the counters go to slot worker of progress, main() sums them and reports the rates and ETA
+  global TIMER
+  TIMER = StageTimer(STAGE_TIMES or bool(PROFILE_DIR))
+  profiler = start_profile() if PROFILE_DIR else None
+  session = None if NO_DB else setup_connection(connection_string, schema=schema)
+  exporter = export.Exporter(EXPORT_DIR, EXPORT_FORMAT, get_source(CURRENT_FILENAME), CURRENT_FILENAME.replace('.gz', '')) if EXPORT_DIR else None
+  TIMER.reset()
+
+  # v2.2.16: the rows are written and committed in batches of --commit_count rows or --commit_ms milliseconds (db/batch.py)
+  batcher = CommitBatcher(session, COMMIT_COUNT, COMMIT_MS, CHUNK_SIZE, TIMER, checkpoint_reader(CURRENT_FILENAME)) if session else None
+  # v2.2.19: the parser of the registry of this file, the generic parse_block() with --generic_parser
+  # v2.2.20: restricted to its class for a split dump
+  adapter = None if GENERIC_PARSER else get_adapter(get_source(CURRENT_FILENAME), TIMER, file_types(CURRENT_FILENAME))
+
+  # all the value below are PER WORKER
+  blocks_processed = 0    # processed rows: bypassed, added, and rollbacked
+  bskip = 0               # this worker's blocks skipped
+
+  job = None
+  pending = []
+  while True:
+    if not pending:
+      # the chunk is done: its checkpoint is committed with the batch holding its last rows
+      if job is not None and batcher:
+        batcher.checkpoint(job)
+      job = jobs.get()
+      TIMER.lap('queue')
+      if job is None:
+        logger.debug(f"------------- End of blocks -------------")
+        break
+      pending = list(reversed(job[3]))
+    block = pending.pop()
     
-    # BlockAttr: aut-num, as-set, route-set, domain
-    # autnum = parse_property(block, b'aut-num')
-    # asset = parse_property(block, b'as-set')
-    # routeset = parse_property(block, b'route-set')
-    # domain = parse_property(block, b'domain')
+    rows = adapter.parse(block) if adapter else parse_block(block)
+    TIMER.lap('tokenize')
+    if rows is None:
+      bskip += 1
+      update_progress(progress, worker, blocks_processed, bskip, batcher)
+      continue
     
-    # if autnum or asset or routeset or domain:
-      # if autnum:
-        # name = autnum
-        # attr = 'aut-num'
-      # if asset:
-        # name = asset
-        # attr = 'as-set'
-      # if routeset:
-        # name = routeset
-        # attr = 'route-set'
-      # if domain:
-        # name = domain
-        # attr = 'domain'
-        
-      # description = parse_property(block, b'descr')
-      # remarks     = parse_property(block, b'remarks')
-      
-      # # Parent table:
-      # # if asset:
-        # # mbrsbyref = ('aut-num', parse_properties(block, b'mbrs-by-ref'))
-      # # else:
-        # # # route-set contains a mix of aut-num and routes (CIDR), just great...
-        # # # TODO: identify each value and create 2 lists one for each type
-        # # mbrsbyref = (None, [])
-        # # # mbrsbyref   = ('organisation', parse_properties(block, b'mbrs-by-ref'))
-      # org         = ('organisation', parse_properties(block, b'org'))
-      # mntby       = ('mntner', parse_properties(block, b'mnt-by'))
-      # mntlowers   = ('mntner', parse_properties(block, b'mnt-lower'))
-      # adminc      = ('mntner', parse_properties(block, b'admin-c'))
-      # techc       = ('mntner', parse_properties(block, b'tech-c'))
-      # abusec      = ('mntner', parse_properties(block, b'abuse-c'))
-        
-      # # Emails and local stuff
-      # notifys     = ('e-mail', parse_properties(block, b'notify'))
-      # members = routes_members = autnums_members = (None, [])
-      
-      # if asset:
-        # members     = ('aut-num', parse_properties(block, b'members'))
-      # else:
-        # # route-set contains a mix of aut-num and routes (CIDR), just great...
-        # # TODO: identify each value and create 2 lists one for each type: DONE
-        # routes, autnums = partition(lambda x: re.search(rb'([0-9a-fA-F:\.]+/{1,3})', x), parse_properties(block, b'members'))
-        # print('routes',routes)
-        # print('autnums',autnums)
-        # if routes:
-          # routes_members = ('route', routes)
-        # if autnums:
-          # autnums_members = ('aut-num', autnums)
-      
-      # b = BlockAttr(name=name, attr=attr, description=description, remarks=remarks)
-      # session.add(b)
-      # inserts = updateCounter(inserts)
-      
-      # # inverse keys:
-      # for parent_type, parents in [org, mntby, mntlowers, adminc, techc, abusec]:
-        # for parent in parents:
-          # try:
-            # b = BlockParent(parent=parent, parent_type=parent_type, child=name, child_type=attr)
-            # session.add(b)
-            # inserts = updateCounter(inserts)
-            # session.flush()
-          # except SQLAlchemyError as e:
-            # error = str(e.__dict__['orig'])
-            # print(type(e), error)
-      
-      # # local keys:
-      # for child_type, children in [notifys, members, routes_members, autnums_members]:
-        # for child in children:
-          # try:
-            # b = BlockParent(parent=name, parent_type=attr, child=child, child_type=child_type)
-            # session.add(b)
-            # inserts = updateCounter(inserts)
-            # session.flush()
-          # except SQLAlchemyError as e:
-            # error = str(e.__dict__['orig'])
-            # print(type(e), error)
+    # v2.2.7: --export_dir, the rows go to the files before (or instead of) the database
+    if exporter:
+      exporter.add(rows)
+      TIMER.lap('export')
     
+    # v2.2.7: no session with --no_db
+    # v2.2.16: no savepoint and no dedup SELECT per row any more, the batcher drops the dupes with ON CONFLICT DO NOTHING
+    if batcher:
+      batcher.add(rows, job[2])
     
     blocks_processed += 1
-    logger.debug(f"{TIME2COMMIT} blocks_processed {blocks_processed} blocks_total {blocks_total.value()}")
-    # wrong:    https://docs.python.org/3/library/multiprocessing.html#multiprocessing.Value
-    # blocks_total.value() += 1
-    # wrong:    https://stackoverflow.com/questions/2080660/how-to-increment-a-shared-counter-from-multiple-processes
-    # with inserts.get_lock():
-      # blocks_total.value() += 1
-    # still wrong:  https://eli.thegreenplace.net/2012/01/04/shared-counter-with-pythons-multiprocessing#the-right-way
-    # with lock:
-      # blocks_total.value() += 1
-    # https://docs.python.org/2/library/multiprocessing.html#multiprocessing.sharedctypes.Value
-    # blocks_total.value() += 1
-    blocks_total.increment()
-    
-    # v2.0.17
-    # v2.0.19
-    # v2.0.21
-    # v2.0.23
-    try:
-      session.commit()
-    except Exception as e:
-      session.rollback()
-      logger.error(f"{TIME2COMMIT} blocks_processed {blocks_processed} blocks_total {blocks_total.value()} !{e.__class__.__name__}!")
-    
-    # We do many more loops for each block because of the parent table, also we decrement it sometimes, and will inevitably pass the mark. cannot use counter inserts here:
-    # if inserts % COMMIT_COUNT == 0:
-    # Using a separate counter: inserts for actually added rows makes sense when updating the database, but less sense when building it. Lots of work for little results.
-    if blocks_processed % COMMIT_COUNT == 0:
-    # if blocks_total.value() % COMMIT_COUNT == 0:
-    # Using a function to increment inserts, that updates a global variable TIME2COMMIT works better when there are more INSERTs then blocks
-    # if TIME2COMMIT:
-      # time.sleep(1)
-      # TIME2COMMIT = False
-      # if blocks_processed == 1: continue
-      try:
-        session.commit()
-        # psycopg.OperationalError: sending query failed: cannot exit pipeline mode while busy; PQsendQuery not allowed in pipeline mode
-      except Exception as e:
-        # usually PendingRollbackError, therefore cannot rollback: SAWarning: Session's state has been changed on a non-active transaction - this state will be discarded.
-        session.rollback()
-        if DEBUG:
-          logger.error(f"TIME2COMMIT {e.__class__.__name__}: {e}")
-        else:
-          percent = (blocks_processed * 100) / NUM_BLOCKS
-          if percent >= 100: percent = 100
-          seconds = time.time() - start_time
-          seconds_total += seconds
-          start_time = time.time()
-          insertsps = round(inserts / seconds_total)
-          insertspps = round(insertsp / seconds_total)
-          logger.error('{} {}/{}/{}:{}/{}/{} inserts/dupes/rollbacks:blocks/btotal/bskip + {}/{}/{} insertsp/dupesp/rollbacksp ({:.0f} seconds) {:.0f}% done, ({:.0f}/{:.0f} inserts/p/s)'.format(e.__class__.__name__, inserts,dupes,rollbacks,blocks_processed,blocks_total.value(),bskip, insertsp,dupesp,rollbacksp, seconds, percent, insertsps,insertspps))# printDbSize(session, 'after')
-          # v2.0.19: [create_db: 959 -         parse_blocks ] ERROR   : Process-4   20 - arin.db.gz - TIME2COMMIT StatementError: (builtins.RecursionError) maximum recursion depth exceeded
-          #          [SQL: RELEASE SAVEPOINT sa_savepoint_144]
-      else:
-        # session.close()
-        # session = setup_connection(connection_string)
-        
-        # each work will perform roughly the same number of blocks, but this number will never be the same
-        # therefore blocks_processed * NUM_WORKERS will NEVER be == NUM_BLOCKS
-        # percent = (blocks_processed * NUM_WORKERS * 100) / NUM_BLOCKS
-        percent = (blocks_processed * 100) / NUM_BLOCKS
-        if percent >= 100: percent = 100
-        seconds = time.time() - start_time
-        seconds_total += seconds
-        start_time = time.time()
-        insertsps = round(inserts / seconds_total)
-        insertspps = round(insertsp / seconds_total)
-        logger.info('committed {}/{}/{}:{}/{}/{} inserts/dupes/rollbacks:blocks/btotal/bskip + {}/{}/{} insertsp/dupesp/rollbacksp ({:.0f} seconds) {:.0f}% done, ({:.0f}/{:.0f} inserts/p/s)'.format(inserts,dupes,rollbacks,blocks_processed,blocks_total.value(),bskip, insertsp,dupesp,rollbacksp, seconds, percent, insertsps,insertspps))# printDbSize(session, 'after')
-        # v2.0.21
-        # session.begin_nested()
-      # /commit
+    # v2.2.15: no shared lock per block any more (CounterShared), this worker's own slot only
+    update_progress(progress, worker, blocks_processed, bskip, batcher)
     # /block
   # /while true
   
-  session.commit()
-  percent = (blocks_processed * 100) / NUM_BLOCKS
-  if percent >= 100: percent = 100
-  seconds = time.time() - start_time
-  seconds_total += seconds
-  start_time = time.time()
-  insertsps = round(inserts / seconds_total)
-  insertspps = round(insertsp / seconds_total)
-  logger.info('done {}/{}/{}:{}/{}/{} inserts/dupes/rollbacks:blocks/btotal/bskip + {}/{}/{} insertsp/dupesp/rollbacksp ({:.0f} seconds) {:.0f}% done, ({:.0f}/{:.0f} inserts/p/s)'.format(inserts,dupes,rollbacks,blocks_processed,blocks_total.value(),bskip, insertsp,dupesp,rollbacksp, seconds, percent, insertsps,insertspps))
+  if batcher:
+    batcher.flush()
+    update_progress(progress, worker, blocks_processed, bskip, batcher)
+    logger.info(f"done {blocks_processed}/{bskip} blocks/bskip, batches {batcher.stats()}")
+  else:
+    logger.info(f"done {blocks_processed}/{bskip} blocks/bskip")
   # printDbSize(session, 'done')
-  session.close()
+  if session:
+    session.close()
+    logger.info(f"pool {pool_stats(connection_string)}")
+    dispose_engines()
+  if exporter:
+    logger.info(f"exported {exporter.close()} rows to {EXPORT_DIR}")
+  logger.info(f"cidr caches {cache_info()}")
+  if results is not None:
+    result = TIMER.result()
+    result['profile'] = stop_profile(profiler, PROFILE_DIR, CURRENT_FILENAME.replace('.gz', '')) if profiler else None
+    result['failed'] = batcher.failed if batcher else 0
+    result['rejected'] = batcher.rejected if batcher else 0
+    results.put(result)
   # v2.0.22
   # logger.info(getSessionParentRow(session, BlockParent, 'MNT-ET-547', 'mntner', '2.57.166.0/23', 'route'))
 
 
+# the counters of this worker, in db/progress.py FIELDS order
+def update_progress(progress, worker, blocks, skipped, batcher):
+  if batcher:
+    progress.update(worker, blocks, skipped, batcher.conflicts, batcher.inserted[BlockCidr] + batcher.inserted[BlockAttr] + batcher.inserted[BlockMember],
+                    batcher.inserted[BlockParent], batcher.commits, batcher.rows)
+  else:
+    progress.update(worker, blocks, skipped)
+
+
+# chunks of this very file (same size, same chunk size, same parser and classes) committed by a previous run
+def load_checkpoints(connection_string, schema, filename, size):
+  session = setup_connection(connection_string, schema=schema)
+  reader = checkpoint_reader(filename)
+  stmt = select(BlockCheckpoint.chunk, BlockCheckpoint.reader).where(and_(BlockCheckpoint.filename == filename, BlockCheckpoint.size == size, BlockCheckpoint.chunk_size == CHUNK_SIZE))
+  rows = session.execute(stmt).all()
+  session.close()
+  others = {row.reader for row in rows if row.reader != reader}
+  if others:
+    logger.warning(f"resume: checkpoints of {filename} written with {', '.join(sorted(others))} ignored, this run reads {reader}")
+  return {row.chunk for row in rows if row.reader == reader}
+
+
+def clear_checkpoints(connection_string, schema, filename):
+  session = setup_connection(connection_string, schema=schema)
+  session.execute(delete(BlockCheckpoint).where(BlockCheckpoint.filename == filename))
+  session.commit()
+  session.close()
+
+
+# the lookup services derive their ETag and cache invalidation from this timestamp
+def record_import(connection_string, schema):
+  session = setup_connection(connection_string, schema=schema)
+  try:
+    session.merge(BlockMeta(key='imported', value=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())))
+    session.merge(BlockMeta(key='version', value=VERSION))
+    session.commit()
+  except Exception as e:
+    session.rollback()
+    logger.error(f"record_import {e.__class__.__name__}: {e}")
+  session.close()
+
+
 def main(connection_string):
   overall_start_time = time.time()
-  setup_connection(connection_string, RESET_DB)
+  # v2.2.0: --reset_db builds into a shadow schema that is swapped live at the end, readers never see a partial dataset
+  schema = SHADOW_SCHEMA if RESET_DB else None
+  if NO_DB:
+    # v2.2.7: --no_db, parse (and export) only
+    schema = None
+  elif RESET_DB:
+    # v2.2.5: --resume keeps the shadow schema of the interrupted run instead of recreating it
+    setup_connection(connection_string, RESET_DB, schema, resume=RESUME)
+  else:
+    create_missing(connection_string)
   # reader = setup_connection(connection_string, RESET_DB)
-
-  for entry in FILELIST:
+  files_loaded = 0
+  # rows the workers could not write: their chunks have no checkpoint, nothing is swapped live until --resume loads them
+  rows_lost = 0
+  workers_lost = 0
+  # v2.2.14: stage times of all the workers of all the files, and their cProfile dumps
+  stage_times = StageTimer(STAGE_TIMES or bool(PROFILE_DIR))
+  profiles = []
+
+  filelist = discover_files(DOWNLOAD_DIR) if os.path.isdir(DOWNLOAD_DIR) else []
+  if filelist:
+    logger.info(f"{len(filelist)} dump files in {DOWNLOAD_DIR}: {' '.join(filelist)}")
+  else:
+    logger.info(f"no dump file in {DOWNLOAD_DIR}. Please download using download_dumps.sh")
+  for entry in filelist:
     global CURRENT_FILENAME
     CURRENT_FILENAME = entry
-    f_name = f"./downloads/{entry}"
+    f_name = f"{DOWNLOAD_DIR}/{entry}"
+    if not file_types(entry):
+      # a split of a class left out by --types: not loaded, not moved to done/
+      logger.info(f"skipping {f_name}: {dump_type(entry)} is not in --types")
+      continue
     if os.path.exists(f_name):
       logger.info(f"loading database file: {f_name}")
       start_time = time.time()
       
-      blocks = read_blocks(f_name)
+      blocks = read_blocks(f_name, reader_types(entry))
       # blocks = read_blocks(f_name)[:10000]  # testing
+      stage_times.add('read', time.time() - start_time)
+      
+      # chunk n = blocks n*CHUNK_SIZE..(n+1)*CHUNK_SIZE-1 in file order, the checkpoints identify the file by name and size
+      size = os.path.getsize(f_name)
+      if NO_DB:
+        done = set()
+      elif RESUME:
+        done = load_checkpoints(connection_string, schema, entry, size)
+      else:
+        done = set()
+        clear_checkpoints(connection_string, schema, entry)
+      chunks = [(entry, size, chunk, blocks[start:start + CHUNK_SIZE]) for chunk, start in enumerate(range(0, len(blocks), CHUNK_SIZE)) if chunk not in done]
+      if done:
+        logger.info(f"resume: {len(done)} chunks of {CHUNK_SIZE} blocks already committed, {len(chunks)} chunks left")
       
       global NUM_BLOCKS
-      NUM_BLOCKS = len(blocks)
+      NUM_BLOCKS = sum(len(job[3]) for job in chunks)
       
       seconds = time.time() - start_time
       seconds_total = seconds
@@ -1132,29 +1119,26 @@ def main(connection_string):
       logger.info(f"file loading finished: {round(seconds)} seconds ({round(NUM_BLOCKS / seconds)} blocks/s)")
 
       jobs = Queue()
-      # lock = Lock()
-      # blocks_total = Value('i', 0, lock=lock)
-      # bskip_total = Value('i', 0, lock=lock)
-      # Classes seem faster
-      blocks_total = CounterShared(0)
-      bskip_total = CounterShared(0)
-      bdupes_total = CounterShared(0)
+      # v2.2.15: one slot of counters per worker, summed here only
+      progress = Progress(NUM_WORKERS, NUM_BLOCKS)
 
       workers = []
+      results = Queue()
       # start workers
       logger.info(f"BLOCKS PARSING START: starting {NUM_WORKERS} processes for {NUM_BLOCKS} blocks (~{round(NUM_BLOCKS/NUM_WORKERS)} per worker)")
       
       # writter = setup_connection(connection_string)
-      for _ in range(NUM_WORKERS):
-        p = Process(target=parse_blocks, args=(jobs, connection_string, blocks_total, bskip_total, bdupes_total), daemon=True)
+      for worker in range(NUM_WORKERS):
+        p = Process(target=parse_blocks, args=(jobs, connection_string, schema, progress, worker, results), daemon=True)
         # p = Process(target=parse_blocks, args=(jobs, reader, writter, blocks_total, bskip_total, bdupes_total), daemon=True)
         p.start()
         workers.append(p)
 
       # add tasks
-      random.shuffle(blocks)  # critical if comit 
-      for b in blocks:
-        jobs.put(b)
+      # v2.2.5: shuffle the chunks, the blocks of a chunk stay in file order
+      random.shuffle(chunks)  # critical if comit 
+      for job in chunks:
+        jobs.put(job)
       seconds = time.time() - start_time
       seconds_total += seconds
       start_time = time.time()
@@ -1162,24 +1146,95 @@ def main(connection_string):
 
       for _ in range(NUM_WORKERS):
         jobs.put(None)
-      jobs.close()
-      jobs.join_thread()
 
-      # wait to finish
+      # wait to finish, reporting every REPORT_SECONDS; the queue feeder thread keeps feeding the workers meanwhile
       for p in workers:
-        p.join()
+        while p.is_alive():
+          p.join(REPORT_SECONDS)
+          if p.is_alive():
+            logger.info(f"progress: {progress.report()}")
+      jobs.close()
+      jobs.join_thread()
+      # a few hundred bytes per worker: already in the pipe when the worker exits, a dead worker sends nothing
+      failed = 0
+      rejected = 0
+      missing = 0
+      for _ in workers:
+        try:
+          result = results.get(timeout=5)
+        except Empty:
+          # its last batch never committed: the file is incomplete, the results of the other workers still count
+          missing += 1
+          continue
+        failed += result['failed']
+        rejected += result['rejected']
+        stage_times.merge(result)
+        if result['profile']:
+          profiles.append(result['profile'])
 
       seconds = time.time() - start_time
       seconds_total += seconds
-      logger.info(f"BLOCKS PARSING DONE: {round(seconds_total)} seconds ({round(blocks_total.value() / seconds_total)} blocks/s) for {blocks_total.value()} blocks out of {NUM_BLOCKS}")
+      totals = progress.totals()
+      logger.info(f"BLOCKS PARSING DONE: {round(seconds_total)} seconds ({round(totals['blocks'] / seconds_total)} blocks/s) for {totals['blocks']} blocks out of {NUM_BLOCKS}, {totals['skipped']} skipped, {totals['dupes']} dupes")
+      files_loaded += 1
+      if rejected:
+        # refused by the database, a --resume would refuse them again: the file counts as loaded
+        logger.warning(f"{rejected} rows of {f_name} rejected by the database, see the errors above")
+      if failed or missing:
+        # the checkpoints and the file stay for --resume, which only loads the chunks that lost rows
+        rows_lost += failed
+        workers_lost += missing
+        logger.error(f"{failed} rows of {f_name} lost{f', {missing} workers dead' if missing else ''}: checkpoints and file kept, rerun with --resume")
+        continue
+      if not NO_DB:
+        clear_checkpoints(connection_string, schema, entry)
       try:
-        os.rename(f"./downloads/{entry}", f"./downloads/done/{entry}")
+        os.rename(f_name, f"{DOWNLOAD_DIR}/done/{entry}")
       except Exception as error:
         logger.error(error)
     else:
       logger.info(f"File {f_name} not found. Please download using download_dumps.sh")
 
   CURRENT_FILENAME = "empty"
+  incomplete = rows_lost or workers_lost
+  if files_loaded and not NO_DB and not (schema and incomplete):
+    # v2.2.9: flatten the prefixes into cidr_range for the single-row ip lookups
+    start_time = time.time()
+    ranges = build_ranges(connection_string, schema)
+    logger.info(f"cidr_range rebuilt: {ranges} ranges in {round(time.time() - start_time)} seconds")
+    # v2.2.10: prefix tree as cidr -> cidr parent rows
+    start_time = time.time()
+    edges = build_tree(connection_string, schema)
+    logger.info(f"prefix tree rebuilt: {edges} cidr -> cidr parent rows in {round(time.time() - start_time)} seconds")
+    # v2.2.12: per-ASN prefix aggregates, only the ASNs of the rows written by this import
+    start_time = time.time()
+    asns, full = refresh_asns(connection_string, schema)
+    logger.info(f"asn {'rebuilt' if full else 'refreshed'}: {asns} ASNs in {round(time.time() - start_time)} seconds")
+  # an incomplete import is neither stamped nor recorded in the history
+  if files_loaded and not NO_DB and not incomplete:
+    record_import(connection_string, schema)
+    # v2.2.22: --history, before the swap: the shadow cidr rows against the open versions
+    if HISTORY:
+      start_time = time.time()
+      closed, opened = record_history(connection_string, schema)
+      logger.info(f"history: {closed} versions closed, {opened} opened in {round(time.time() - start_time)} seconds")
+  if schema:
+    if incomplete:
+      # the shadow is what --resume completes, the live tables stay as they are
+      logger.error(f"{rows_lost} rows lost{f', {workers_lost} workers dead' if workers_lost else ''}: shadow schema {schema} kept and not swapped live, rerun with --resume")
+    elif files_loaded:
+      start_time = time.time()
+      finalize_shadow(connection_string, schema)
+      logger.info(f"shadow schema {schema} indexed, analyzed and swapped live: {round(time.time() - start_time)} seconds")
+    else:
+      # never swap an empty shadow over the live dataset
+      drop_shadow(connection_string, schema)
+      logger.info(f"no file loaded: shadow schema {schema} dropped, live tables untouched")
+  dispose_engines()
+  if stage_times.enabled:
+    logger.info(f"stage times, cumulative over the workers:\n{stage_times.summary()}")
+  if profiles:
+    logger.info(f"{len(profiles)} worker profiles in {PROFILE_DIR}, merged:\n{merge_profiles(profiles)}")
   logger.info(
     f"script finished: {round(time.time() - overall_start_time, 2)} seconds")
 
@@ -1190,8 +1245,19 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Create DB')
   parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
   parser.add_argument("-d", "--debug", action='store_true', default=DEBUG, help="set loglevel to DEBUG")
-  parser.add_argument('--reset_db', action='store_true', default=RESET_DB, help="reset the database")
-  parser.add_argument('--commit_count', type=int, default=COMMIT_COUNT, help="commit every nth")
+  parser.add_argument('--reset_db', action='store_true', default=RESET_DB, help="rebuild the database in a shadow schema and swap it live when done")
+  parser.add_argument('--commit_count', type=int, default=COMMIT_COUNT, help="commit every n rows (batched INSERT .. ON CONFLICT DO NOTHING)")
+  parser.add_argument('--commit_ms', type=int, default=COMMIT_MS, help="or every n milliseconds, whichever comes first")
+  parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE, help="blocks per job, each chunk is committed with a checkpoint")
+  parser.add_argument('--export_dir', type=str, default=EXPORT_DIR, help="also write the parsed rows to partitioned files in this directory (needs pyarrow)")
+  parser.add_argument('--export_format', choices=sorted(export.FORMATS), default=EXPORT_FORMAT, help="parquet or arrow (IPC file) export")
+  parser.add_argument('--no_db', action='store_true', default=NO_DB, help="do not load postgres, parse and export only")
+  parser.add_argument('--resume', action='store_true', default=RESUME, help="skip the chunks committed by an interrupted run, with --reset_db keep its shadow schema")
+  parser.add_argument('--stage_times', action='store_true', default=STAGE_TIMES, help="time the worker stages (tokenize, cidr-convert, dedup-check, insert, commit..) and print the totals")
+  parser.add_argument('--profile', dest='profile_dir', type=str, default=PROFILE_DIR, help="write a cProfile dump per worker to this directory and print the merged top functions, implies --stage_times")
+  parser.add_argument('--types', nargs='+', choices=list(CLASS_TABLES), default=TYPES, help="load only these object classes (default: all of them)")
+  parser.add_argument('--history', action='store_true', default=HISTORY, help="keep the versions of the cidr rows over the imports in the history table (query.py --at)")
+  parser.add_argument('--generic_parser', action='store_true', default=GENERIC_PARSER, help="parse every file with the generic parse_block() instead of the per-registry adapters")
   parser.add_argument('--version', action='version', version=f"%(prog)s {VERSION}")
   
   args = parser.parse_args()
@@ -1205,6 +1271,21 @@ if __name__ == '__main__':
   DEBUG         = args.debug
   RESET_DB      = args.reset_db
   COMMIT_COUNT  = args.commit_count
+  COMMIT_MS     = args.commit_ms
+  CHUNK_SIZE    = args.chunk_size
+  RESUME        = args.resume
+  EXPORT_DIR    = args.export_dir
+  EXPORT_FORMAT = args.export_format
+  NO_DB         = args.no_db
+  STAGE_TIMES   = args.stage_times
+  PROFILE_DIR   = args.profile_dir
+  GENERIC_PARSER = args.generic_parser
+  TYPES         = args.types
+  HISTORY       = args.history
+  if EXPORT_DIR and not export.available():
+    parser.error("--export_dir needs pyarrow: pip install pyarrow")
+  if NO_DB and not EXPORT_DIR:
+    logger.warning("--no_db without --export_dir: the blocks are parsed and thrown away")
   
   main(args.connection_string)
 
@@ -1836,7 +1917,7 @@ if __name__ == '__main__':
 # [create_db:1103 -         parse_blocks ] INFO    : Process-3   19 - arin.db.gz - done 28452/0/0:28452/113895/2516 inserts/dupes/rollbacks:blocks/btotal/bskip + 23493/6934/0 insertsp/dupesp/rollbacksp (53 seconds) 23% done, (160/132 inserts/p/s)
 # [create_db:1103 -         parse_blocks ] INFO    : Process-2   18 - arin.db.gz - done 28329/0/0:28329/113895/2629 inserts/dupes/rollbacks:blocks/btotal/bskip + 23470/6853/0 insertsp/dupesp/rollbacksp (53 seconds) 23% done, (159/132 inserts/p/s)
 # [create_db:1174 -                 main ] INFO    : MainProcess 16 - arin.db.gz - BLOCKS PARSING DONE: 179 seconds (635 blocks/s) for 113895 blocks out of 124320
-
+# v2.2.16 2 284 blocks/s: batches of --commit_count rows or --commit_ms, 1 INSERT .. ON CONFLICT DO NOTHING/table/batch, no savepoint and no select/row: cidr=4000 parent=6000, 0% loss   synthetic 4000 blocks, 1 worker: 20 seconds before, 2 now
 
 
 
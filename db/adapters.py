@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import logging
+import re
+from datetime import datetime
+
+from db.iputil import iprange_to_cidrs, prefix_str
+
+# Per-registry parsers of the dump blocks, the fast path of create_db.py parse_block() (kept as the generic reference).
+# parse_block() runs a regex over the whole block for each of ~30 attributes, for every block, whatever the registry.
+# An adapter reads the class of the object from its first line, drops the classes that are not loaded before looking
+# at the rest, then splits the block in one pass into the attributes that class needs (CLASS_ATTRIBUTES) and that
+# this registry uses. Each one keeps its own precompiled prefix patterns:
+#   RIPE, APNIC, AFRINIC  RPSL, inetnum as a range "192.0.2.0 - 192.0.2.255", last-modified
+#   LACNIC                inetnum as a prefix, including the short forms "177.46.7/24" and "148.204/16", no netname,
+#                         no route objects, changed: dates
+#   ARIN                  the IRR dump only (route, route6, aut-num, as-set, route-set, mntner), changed: dates on the old objects
+# The cidr/attr/parent rows are those of parse_block(). bench_adapters.py measures both paths and compares their rows.
+# v2.2.20: the handles (organisation, role, person, mntner, irt) go to the member table, parse_block() skips them.
+# The split dumps (apnic.db.role.gz..) get an adapter restricted to their class: get_adapter(source, types=..).
+
+logger = logging.getLogger('create_db')
+
+IPV4 = rb'(?:\d{1,3}\.){3}\d{1,3}'
+RANGE_RE = re.compile(rb'^(%s)\s*-\s*(%s)' % (IPV4, IPV4))
+CIDR_RE = re.compile(rb'^(%s/\d+)' % IPV4)
+ROUTE_RE = re.compile(rb'^(%s/\d{1,2})' % IPV4)
+IPV6_RE = re.compile(rb'^([0-9a-fA-F:\/]{1,43})')
+CHANGED_RE = re.compile(r'^.+?@.+? \d+')
+SPLIT_RE = re.compile(r'[ ,]+')
+MEMBERS_RE = re.compile(r'[\s,]+')
+ASN_RE = re.compile(r'^AS\d+$')
+
+# class attribute -> table of its rows
+CIDR_CLASSES = (b'inetnum', b'inet6num', b'route', b'route6')
+ATTR_CLASSES = (b'aut-num', b'as-set', b'route-set')
+MEMBER_CLASSES = (b'organisation', b'role', b'person', b'mntner', b'irt')
+CLASS_TABLES = {name.decode('utf-8'): table for table, names in (('cidr', CIDR_CLASSES), ('attr', ATTR_CLASSES), ('member', MEMBER_CLASSES))
+                for name in names}
+# the attributes read from each class, besides the class attribute and cust_source
+INETNUM_ATTRIBUTES = (b'netname', b'descr', b'remarks', b'country', b'mnt-by', b'org', b'notify', b'created', b'last-modified', b'changed', b'status')
+ROUTE_ATTRIBUTES = (b'origin', b'descr', b'remarks', b'mnt-by', b'org', b'notify', b'created', b'last-modified', b'changed')
+SET_ATTRIBUTES = (b'descr', b'remarks', b'mnt-by', b'org', b'members', b'mp-members')
+CLASS_ATTRIBUTES = {
+  b'inetnum': INETNUM_ATTRIBUTES,
+  b'inet6num': INETNUM_ATTRIBUTES,
+  b'route': ROUTE_ATTRIBUTES,
+  b'route6': ROUTE_ATTRIBUTES,
+  b'aut-num': SET_ATTRIBUTES,
+  b'as-set': SET_ATTRIBUTES,
+  b'route-set': SET_ATTRIBUTES,
+  b'organisation': (b'org-name', b'descr', b'remarks'),
+  b'role': (b'nic-hdl', b'descr', b'remarks'),
+  b'person': (b'nic-hdl', b'remarks'),
+  b'mntner': (b'descr', b'remarks'),
+  b'irt': (b'descr', b'remarks'),
+}
+# member table: class -> the attribute holding its handle (idd) and the one holding its name
+MEMBER_KEYS = {b'organisation': (b'organisation', b'org-name'), b'role': (b'nic-hdl', b'role'), b'person': (b'nic-hdl', b'person'),
+               b'mntner': (b'mntner', b'mntner'), b'irt': (b'irt', b'irt')}
+ALL_ATTRIBUTES = frozenset(CLASS_ATTRIBUTES).union(*CLASS_ATTRIBUTES.values(), (b'cust_source',))
+
+
+# AS15169 -> aut-num, AS-FOO / AS1:AS-FOO -> as-set, RS-FOO / AS1:RS-FOO -> route-set, 192.0.2.0/24 -> route
+def member_type(member: str) -> str:
+  if '/' in member:
+    return 'route'
+  last = member.split(':')[-1]
+  if last.startswith('RS-'):
+    return 'route-set'
+  if ASN_RE.match(last):
+    return 'aut-num'
+  return 'as-set'
+
+
+class RpslAdapter(object):
+  source = None
+  CLASSES = CIDR_CLASSES + ATTR_CLASSES + MEMBER_CLASSES
+  # the attributes this registry uses
+  ATTRIBUTES = ALL_ATTRIBUTES
+  # the attributes whose continuation lines are read, the others keep their first line like parse_block() does
+  CONTINUED = frozenset((b'members', b'mp-members'))
+
+  # types: the classes of a split dump (apnic.db.role.gz -> ['role']), None for all of them
+  def __init__(self, timer=None, types=None):
+    self.timer = timer
+    classes = [name for name in self.CLASSES if types is None or name.decode('utf-8') in types]
+    # class -> the attributes kept from its blocks
+    self.wanted = {name: frozenset(CLASS_ATTRIBUTES[name] + (name, b'cust_source')) & self.ATTRIBUTES for name in classes}
+
+  # block -> (class, {attribute: [values]}), (None, None) when the class is not loaded
+  def tokenize(self, block: bytes):
+    lines = block.split(b'\n')
+    name = lines[0].partition(b':')[0].lower()
+    wanted = self.wanted.get(name)
+    if wanted is None:
+      return None, None
+    continued = self.CONTINUED
+    attrs = {}
+    last = None
+    for line in lines:
+      if not line:
+        continue
+      if line[:1] in b' \t+':
+        if last is not None:
+          values = attrs[last]
+          values[-1] = values[-1] + b'\n' + line
+        continue
+      key, _, value = line.partition(b':')
+      # RPSL attribute names are case-insensitive: INETNUM: and Route: are the class line too
+      key = key.lower()
+      if key in wanted:
+        if key in attrs:
+          attrs[key].append(value)
+        else:
+          attrs[key] = [value]
+        last = key if key in continued else None
+      else:
+        last = None
+    return name, attrs
+
+  # parse_property(): the values joined, whitespace collapsed
+  @staticmethod
+  def prop(attrs, name):
+    values = [value.strip() for value in attrs.get(name, ())]
+    values = [value for value in values if value]
+    if not values:
+      return None
+    return ' '.join(b' '.join(values).decode('utf-8').split())
+
+  # parse_properties(): the distinct values, split on spaces and commas
+  @staticmethod
+  def props(attrs, name):
+    values = [value.strip() for value in attrs.get(name, ())]
+    values = [value for value in values if value]
+    if not values:
+      return []
+    return list(set(SPLIT_RE.sub(',', b' '.join(values).decode('utf-8')).split(',')))
+
+  # parse_members(): continuation lines included, set names and ASNs upper-cased
+  @staticmethod
+  def members(attrs, name):
+    members = []
+    for value in attrs.get(name, ()):
+      for member in MEMBERS_RE.split(value.decode('utf-8').replace('\n+', ' ')):
+        if not member:
+          continue
+        members.append(member if '/' in member else member.split('^')[0].upper())
+    return members
+
+  def inetnum(self, value):
+    match = RANGE_RE.match(value)
+    if match:
+      # v2.2.6: integer range -> CIDR, memoized on the matched bytes (db/iputil.py)
+      return iprange_to_cidrs(match.group(1), match.group(2))
+    match = CIDR_RE.match(value)
+    if match:
+      return [prefix_str(match.group(1))]
+    return None
+
+  # class, first value of the class attribute -> [CIDR str], None when it does not parse
+  def cidrs(self, name, attrs):
+    value = attrs[name][0].strip()
+    if name == b'inetnum':
+      return self.inetnum(value)
+    match = (ROUTE_RE if name == b'route' else IPV6_RE).match(value)
+    return [prefix_str(match.group(1))] if match else None
+
+  # last-modified, else the date of the first changed: "*@ripe.net 19960624"
+  def last_modified(self, attrs, attr, prefix):
+    last_modified = self.prop(attrs, b'last-modified')
+    if last_modified:
+      return last_modified
+    changed = self.prop(attrs, b'changed') or ''
+    if CHANGED_RE.match(changed):
+      date = changed.split(" ")[1].strip()
+      try:
+        # a date postgres refuses (19960231) would reject the whole row
+        if len(date) == 8:
+          return datetime(int(date[0:4]), int(date[4:6]), int(date[6:8])).strftime('%Y-%m-%d')
+      except ValueError:
+        pass
+      logger.debug(f"ignoring invalid changed date {date} ({attr} {prefix})")
+    elif changed:
+      logger.debug(f"ignoring invalid changed date {changed} ({attr} {prefix})")
+    return None
+
+  # block -> parse_block() rows, None when the block is skipped
+  def parse(self, block: bytes):
+    name, attrs = self.tokenize(block)
+    if name is None:
+      return None
+    if self.timer:
+      self.timer.lap('tokenize')
+    rows = {'cidr': [], 'parent': [], 'attr': [], 'member': []}
+    source = self.prop(attrs, b'cust_source')
+    if name in CIDR_CLASSES:
+      inetnum = self.cidrs(name, attrs)
+      if self.timer:
+        self.timer.lap('cidr-convert')
+      if not inetnum:
+        return None
+      netname = self.prop(attrs, b'netname')
+      if netname:
+        attr = 'inetnum'
+      else:
+        # routes have no name: the prefix is their name in the parent table
+        netname = inetnum[0]
+        attr = 'route'
+      autnum = self.prop(attrs, b'origin')
+      rows['cidr'] = [
+        {'inetnum': cidr, 'autnum': autnum or '', 'netname': netname, 'attr': attr, 'description': self.prop(attrs, b'descr'),
+         'remarks': self.prop(attrs, b'remarks'), 'country': self.prop(attrs, b'country'), 'created': self.prop(attrs, b'created'),
+         'last_modified': self.last_modified(attrs, attr, inetnum[0]), 'status': self.prop(attrs, b'status'), 'source': source}
+        for cidr in inetnum
+      ]
+      for parent_type, key in (('mntner', b'mnt-by'), ('organisation', b'org')):
+        for parent in self.props(attrs, key):
+          rows['parent'].append({'parent': parent, 'parent_type': parent_type, 'child': netname, 'child_type': attr})
+      for child in self.props(attrs, b'notify'):
+        rows['parent'].append({'parent': netname, 'parent_type': attr, 'child': child, 'child_type': 'e-mail'})
+      return rows
+    if name in MEMBER_KEYS:
+      return self.member(name, attrs, rows)
+    value = self.prop(attrs, name)
+    if not value:
+      return None
+    attr = name.decode('utf-8')
+    value = value.upper()
+    rows['attr'].append({'name': value, 'attr': attr, 'description': self.prop(attrs, b'descr'), 'remarks': self.prop(attrs, b'remarks')})
+    for parent_type, key in (('mntner', b'mnt-by'), ('organisation', b'org')):
+      for parent in self.props(attrs, key):
+        rows['parent'].append({'parent': parent, 'parent_type': parent_type, 'child': value, 'child_type': attr})
+    if attr != 'aut-num':
+      for member in dict.fromkeys(self.members(attrs, b'members') + self.members(attrs, b'mp-members')):
+        rows['parent'].append({'parent': value, 'parent_type': attr, 'child': member, 'child_type': member_type(member)})
+    return rows
+
+
+  # organisation, role, person, mntner, irt -> member row, the handle as idd
+  def member(self, name, attrs, rows):
+    idd_key, name_key = MEMBER_KEYS[name]
+    idd = self.prop(attrs, idd_key)
+    if not idd:
+      return None
+    member_name = self.prop(attrs, name_key) or idd
+    # the organisation search matches the descriptions: an organisation without descr is found by its name
+    description = self.prop(attrs, b'descr') or (member_name if name == b'organisation' else None)
+    rows['member'].append({'idd': idd, 'attr': name.decode('utf-8'), 'name': member_name, 'description': description,
+                           'remarks': self.prop(attrs, b'remarks')})
+    return rows
+
+
+class RipeAdapter(RpslAdapter):
+  source = 'ripe'
+  # changed: was removed from the RIPE database in 2015, last-modified is always there
+  ATTRIBUTES = ALL_ATTRIBUTES - {b'changed'}
+
+
+class ApnicAdapter(RpslAdapter):
+  source = 'apnic'
+
+
+class AfrinicAdapter(RpslAdapter):
+  source = 'afrinic'
+
+
+class LacnicAdapter(RpslAdapter):
+  source = 'lacnic'
+  # inetnum and aut-num objects only, the contacts are nic handles (owner-c, tech-c), not maintainers
+  CLASSES = (b'inetnum', b'inet6num', b'aut-num')
+  ATTRIBUTES = frozenset(CLASSES + (b'country', b'status', b'created', b'changed', b'last-modified', b'cust_source', b'descr'))
+  SHORT_RE = re.compile(rb'^((?:\d{1,3}\.){1,2}\d{1,3})/(\d+)')
+
+  # prefixes first, the short forms padded with zeros: 177.46.7/24 -> 177.46.7.0/24, 148.204/16 -> 148.204.0.0/16
+  def inetnum(self, value):
+    match = CIDR_RE.match(value)
+    if match:
+      return [prefix_str(match.group(1))]
+    match = self.SHORT_RE.match(value)
+    if match:
+      address = match.group(1).decode('utf-8')
+      return [f"{address}{'.0' * (3 - address.count('.'))}/{match.group(2).decode('utf-8')}"]
+    return super().inetnum(value)
+
+
+class ArinAdapter(RpslAdapter):
+  source = 'arin'
+  # arin.db is ARIN's routing registry: no inetnum, no netname/country/status, the contacts are ARIN handles
+  CLASSES = (b'route', b'route6') + ATTR_CLASSES + (b'mntner',)
+  ATTRIBUTES = ALL_ATTRIBUTES - {b'netname', b'country', b'status'}
+
+
+ADAPTERS = (RipeAdapter, ApnicAdapter, AfrinicAdapter, LacnicAdapter, ArinAdapter)
+
+
+# the adapter of a source (create_db.py get_source()), the generic RPSL one for an unknown source
+def get_adapter(source, timer=None, types=None):
+  for adapter in ADAPTERS:
+    if adapter.source == source:
+      return adapter(timer, types)
+  return RpslAdapter(timer, types)
+
+
+# split dumps: apnic.db.inetnum.gz -> 'inetnum', ripe.db.gz / lacnic.db.gz / arin.db -> None (all the classes)
+def dump_type(filename):
+  parts = filename.split('/')[-1].replace('.gz', '').split('.')
+  if len(parts) >= 3 and parts[1] == 'db':
+    return parts[2]
+  return None
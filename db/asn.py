@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+from datetime import datetime, timezone
+from itertools import groupby
+
+from sqlalchemy import select, delete
+
+from db.helper import create_postgres_pool
+from db.iputil import cidr_bounds
+from db.model import BlockCidr, BlockAsn, BlockAsnDirty
+
+# Post-import stage: the per-ASN aggregate behind "every prefix originated by AS15169".
+# Without it the question is a scan of the autnum B-tree plus a DISTINCT over text prefixes, at every lookup.
+# The workers add the origin of each cidr row they write to asn_dirty (same transaction as the rows), the refresh
+# recomputes those ASNs only. An empty asn table (first import, shadow rebuild, database loaded before 2.2.12) is rebuilt whole.
+FETCH_SIZE = 10000
+
+
+# total addresses covered by (start, end) intervals, overlaps counted once
+def union_size(intervals):
+  total = 0
+  last = -1
+  for start, end in sorted(intervals):
+    if end <= last:
+      continue
+    total += end - max(start, last + 1) + 1
+    last = end
+  return total
+
+
+# autnum, [prefixes] -> asn row
+def aggregate(autnum, prefixes, refreshed):
+  bounds = {4: [], 6: []}
+  ordered = []
+  for prefix in prefixes:
+    bound = cidr_bounds(prefix)
+    if bound is None:
+      continue
+    family, start, end = bound
+    bounds[family].append((start, end))
+    ordered.append((family, start, -end, prefix))
+  ordered.sort()
+  return (autnum, [prefix for _, _, _, prefix in ordered], len(bounds[4]), len(bounds[6]),
+          union_size(bounds[4]), union_size(bounds[6]), refreshed)
+
+
+# returns (ASNs refreshed, True when the whole table was rebuilt)
+def refresh_asns(connection_string, schema=None):
+  engine = create_postgres_pool(connection_string, schema)
+  table = f'"{schema}"."{BlockAsn.__tablename__}"' if schema else f'"{BlockAsn.__tablename__}"'
+  refreshed = datetime.now(timezone.utc).replace(tzinfo=None)
+  asns = 0
+  with engine.begin() as conn:
+    full = conn.execute(select(BlockAsn.autnum).limit(1)).first() is None
+    stmt = select(BlockCidr.autnum, BlockCidr.inetnum).where(BlockCidr.autnum != '').distinct().order_by(BlockCidr.autnum)
+    if full:
+      conn.execute(delete(BlockAsnDirty))
+    else:
+      # the reader below still sees the dirty rows this transaction deletes, it is not committed yet
+      dirty = select(BlockAsnDirty.autnum)
+      stmt = stmt.where(BlockCidr.autnum.in_(dirty))
+      conn.execute(delete(BlockAsn).where(BlockAsn.autnum.in_(dirty)))
+      conn.execute(delete(BlockAsnDirty))
+    # the cidr rows stream in from a second connection: this one is busy with the COPY
+    cursor = conn.connection.driver_connection.cursor()
+    with engine.connect() as reader, cursor.copy(
+        f"COPY {table} (autnum, prefixes, v4_prefixes, v6_prefixes, v4_addresses, v6_addresses, refreshed) FROM STDIN") as copy:
+      rows = reader.execution_options(stream_results=True, yield_per=FETCH_SIZE).execute(stmt)
+      for autnum, group in groupby(rows, key=lambda row: row[0]):
+        copy.write_row(aggregate(autnum, [row[1] for row in group], refreshed))
+        asns += 1
+  return asns, full
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import logging
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+
+from db.model import BlockCidr, BlockAttr, BlockParent, BlockMember, BlockCheckpoint, BlockAsnDirty
+
+# Transaction policy of the loader workers (create_db.py).
+# Up to 2.2.15 every block had its savepoint plus a flush and a SELECT per row to find the dupes, and the transaction
+# followed the chunks whatever --commit_count said. The batcher buffers the parsed rows and writes them when either
+# max_rows rows or max_ms milliseconds have accumulated: one multi-row INSERT .. ON CONFLICT DO NOTHING per table,
+# then one COMMIT, so the WAL flush is paid once per thousands of rows.
+#   - the dupes are dropped twice: inside the batch by primary key, against the table by ON CONFLICT
+#   - the rows are written in key order: two workers inserting the same keys take their locks in the same order, no deadlock
+#   - a failing INSERT is bisected in savepoints: only the sub-batch that fails is retried, down to the bad row
+#   - a failing COMMIT is retried once with the whole batch, the inserts are idempotent
+# The checkpoint rows of the chunks completed so far, and the ASNs to refresh, are committed with the rows.
+# A row the database refuses (DataError, IntegrityError) is rejected: counted and logged, its chunk is checkpointed all the same,
+# a --resume would only refuse it again. A chunk with a row lost (a batch rolled back twice, a row failing for any other reason)
+# never gets its checkpoint: --resume loads it again.
+BATCH_ROWS = 10000
+BATCH_MS = 1000
+# primary key (unique index for attr and member) of each table, the in-batch dedup key and the write order
+TABLES = (
+  (BlockCidr, ('inetnum', 'autnum')),
+  (BlockAttr, ('name', 'attr')),
+  (BlockParent, ('parent', 'parent_type', 'child', 'child_type')),
+  (BlockMember, ('idd',)),
+)
+KEYS = dict(TABLES)
+
+logger = logging.getLogger('create_db')
+
+
+class CommitBatcher(object):
+  # reader: the checkpoint key of the parser and classes of the file, see BlockCheckpoint
+  def __init__(self, session, max_rows=BATCH_ROWS, max_ms=BATCH_MS, chunk_size=0, timer=None, reader=''):
+    self.session = session
+    self.max_rows = max_rows
+    self.max_seconds = max_ms / 1000
+    self.chunk_size = chunk_size
+    self.reader = reader
+    self.timer = timer
+    self.pending = {model: {} for model, _ in TABLES}
+    self.size = 0
+    self.checkpoints = []
+    self.dirty = set()
+    # (model, key) -> chunk of the pending rows, and the other chunks that had the same row
+    self.owners = {}
+    self.shared = {}
+    # the chunks with a row lost, they are never checkpointed
+    self.lost = set()
+    self.oldest = None
+    self.start = time.time()
+    # rows: rows written, inserted: rows new to the table, conflicts: dupes within a batch or against the table,
+    # rejected: rows the database refused, failed: rows lost (rolled back, dropped for another reason), retries: sub-batches and commits retried
+    self.commits = 0
+    self.rows = 0
+    self.inserted = {model: 0 for model, _ in TABLES}
+    self.conflicts = 0
+    self.rejected = 0
+    self.failed = 0
+    self.retries = 0
+    self.commit_seconds = 0.0
+
+  def lap(self, stage):
+    if self.timer:
+      self.timer.lap(stage)
+
+  # rows: parse_block() or adapter output, a table may be missing; chunk: the chunk of the block;
+  # True when this call committed a batch
+  def add(self, rows, chunk=None):
+    for model, key in TABLES:
+      pending = self.pending[model]
+      for row in rows.get(model.__tablename__, ()):
+        k = tuple(row[column] for column in key)
+        if k in pending:
+          self.conflicts += 1
+          # the row of this chunk is written, or lost, with the pending one
+          if self.owners[(model, k)] != chunk:
+            self.shared.setdefault((model, k), set()).add(chunk)
+          continue
+        pending[k] = row
+        self.owners[(model, k)] = chunk
+        self.size += 1
+    self.dirty.update(row['autnum'] for row in rows.get('cidr', ()) if row['autnum'])
+    if self.oldest is None:
+      self.oldest = time.time()
+    self.lap('dedup-check')
+    return self.due() and self.flush()
+
+  # job = (filename, size, chunk, blocks): all its rows are added, its checkpoint goes with the next commit
+  def checkpoint(self, job):
+    filename, size, chunk, blocks = job
+    if chunk in self.lost:
+      logger.error(f"chunk {chunk} of {filename} not checkpointed: rows lost, left for --resume")
+      return False
+    self.checkpoints.append({'filename': filename, 'size': size, 'chunk_size': self.chunk_size, 'reader': self.reader, 'chunk': chunk, 'blocks': len(blocks)})
+    if self.oldest is None:
+      self.oldest = time.time()
+    return self.due() and self.flush()
+
+  def due(self):
+    return self.size >= self.max_rows or (self.oldest is not None and time.time() - self.oldest >= self.max_seconds)
+
+  # the chunks of a pending row
+  def chunks(self, model, k):
+    return {self.owners[(model, k)]} | self.shared.get((model, k), set())
+
+  # write and commit everything pending; a batch that cannot be committed is lost, its chunks have no checkpoint
+  def flush(self):
+    if self.oldest is None:
+      return False
+    # a None in a key (netname missing) sorts first, its NOT NULL violation is bisected down to that row
+    batch = {model: [pending[k] for k in sorted(pending, key=lambda k: tuple(v or '' for v in k))] for model, pending in self.pending.items()}
+    inserted = None
+    for attempt in (1, 2):
+      failed = self.failed
+      rejected = self.rejected
+      try:
+        inserted = {model: self.write(model, rows) for model, rows in batch.items()}
+        # a row lost by write() loses its chunk, even when the chunk is complete in this batch
+        checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint['chunk'] not in self.lost]
+        if checkpoints:
+          self.session.execute(insert(BlockCheckpoint.__table__), checkpoints)
+        # v2.2.12: the ASNs to refresh, committed or rolled back with the rows
+        if self.dirty:
+          self.session.execute(insert(BlockAsnDirty.__table__).values([{'autnum': autnum} for autnum in sorted(self.dirty)]).on_conflict_do_nothing())
+        self.lap('insert')
+        start = time.time()
+        self.session.commit()
+        self.commit_seconds += time.time() - start
+        break
+      except SQLAlchemyError as e:
+        self.session.rollback()
+        inserted = None
+        self.failed = failed
+        self.rejected = rejected
+        if attempt == 1:
+          self.retries += 1
+          logger.warning(f"batch of {self.size} rows retried: {e.__class__.__name__}: {e}")
+        else:
+          chunks = {chunk for model, k in self.owners for chunk in self.chunks(model, k)}
+          chunks.update(checkpoint['chunk'] for checkpoint in self.checkpoints)
+          logger.error(f"batch of {self.size} rows rolled back, chunks {sorted(chunks, key=str)} left for --resume: {e.__class__.__name__}: {e}")
+    self.lap('commit')
+    if inserted is None:
+      self.failed += self.size
+      self.lost.update(chunk for model, k in self.owners for chunk in self.chunks(model, k))
+      self.lost.update(checkpoint['chunk'] for checkpoint in self.checkpoints)
+    else:
+      self.commits += 1
+      self.rows += self.size
+      for model, count in inserted.items():
+        self.inserted[model] += count
+        self.conflicts += len(batch[model]) - count
+      # the rows dropped by write() are not conflicts
+      self.conflicts -= self.failed - failed + self.rejected - rejected
+    for pending in self.pending.values():
+      pending.clear()
+    self.owners.clear()
+    self.shared.clear()
+    self.size = 0
+    self.checkpoints = []
+    self.dirty.clear()
+    self.oldest = None
+    return True
+
+  # INSERT .. ON CONFLICT DO NOTHING in a savepoint, bisected on error; returns the rows actually inserted
+  def write(self, model, rows):
+    if not rows:
+      return 0
+    # RETURNING counts the rows inserted, the conflicts return nothing
+    stmt = insert(model.__table__).on_conflict_do_nothing().returning(*model.__table__.primary_key.columns)
+    savepoint = self.session.begin_nested()
+    try:
+      count = len(self.session.execute(stmt, rows).all())
+      savepoint.commit()
+      return count
+    except SQLAlchemyError as e:
+      savepoint.rollback()
+      if len(rows) == 1:
+        if isinstance(e, (DataError, IntegrityError)):
+          self.rejected += 1
+          logger.error(f"{model.__tablename__} row rejected {rows[0]}: {e.__class__.__name__}: {e}")
+          return 0
+        self.failed += 1
+        self.lost.update(self.chunks(model, tuple(rows[0][column] for column in KEYS[model])))
+        logger.error(f"{model.__tablename__} row lost {rows[0]}: {e.__class__.__name__}: {e}")
+        return 0
+      self.retries += 1
+      half = len(rows) // 2
+      return self.write(model, rows[:half]) + self.write(model, rows[half:])
+
+  def stats(self):
+    seconds = max(time.time() - self.start, 1e-9)
+    return {
+      'commits': self.commits,
+      'rows': self.rows,
+      'inserted': sum(self.inserted.values()),
+      'conflicts': self.conflicts,
+      'rejected': self.rejected,
+      'failed': self.failed,
+      'retries': self.retries,
+      'rows_per_commit': round(self.rows / self.commits) if self.commits else 0,
+      'commits_per_s': round(self.commits / seconds, 2),
+      'commit_ms_avg': round(self.commit_seconds * 1000 / self.commits, 1) if self.commits else 0.0,
+    }
+
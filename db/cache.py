@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import ipaddress
+import time
+from collections import OrderedDict
+
+
+# size-bounded LRU with a time to live, used in front of the lookup queries.
+# Not thread-safe on purpose: the servers are single-threaded asyncio loops.
+class LRUCache(object):
+  def __init__(self, maxsize=100000, ttl=3600):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.data = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, key):
+    entry = self.data.get(key)
+    if entry is None:
+      self.misses += 1
+      return None
+    expires, value = entry
+    if expires < time.monotonic():
+      del self.data[key]
+      self.removed(key)
+      self.misses += 1
+      return None
+    self.data.move_to_end(key)
+    self.hits += 1
+    return value
+
+  def set(self, key, value):
+    self.data[key] = (time.monotonic() + self.ttl, value)
+    self.data.move_to_end(key)
+    while len(self.data) > self.maxsize:
+      key, _ = self.data.popitem(last=False)
+      self.removed(key)
+      self.evictions += 1
+
+  # called for every key leaving the cache through expiry or eviction
+  def removed(self, key):
+    pass
+
+  def clear(self):
+    self.data.clear()
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'size': len(self.data),
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+    }
+
+  def __len__(self):
+    return len(self.data)
+
+
+# IP lookup results keyed by the prefix they were found for, not by the address: one entry answers every address inside the block.
+# get() probes the address masked with each prefix length present in the cache, most specific first.
+# The caller must only set() a prefix whose answer is the same for all of its addresses (see db.lookup.answer_prefix).
+class PrefixCache(LRUCache):
+  def __init__(self, maxsize=100000, ttl=3600):
+    super().__init__(maxsize, ttl)
+    # version -> {prefixlen: entries}
+    self.lengths = {4: {}, 6: {}}
+    self.sorted_lengths = {4: [], 6: []}
+
+  def get(self, ip):
+    address = ipaddress.ip_address(ip)
+    value = int(address)
+    now = time.monotonic()
+    for prefixlen in self.sorted_lengths[address.version]:
+      key = (address.version, prefixlen, value >> (address.max_prefixlen - prefixlen))
+      entry = self.data.get(key)
+      if entry is None:
+        continue
+      if entry[0] < now:
+        del self.data[key]
+        self.removed(key)
+        continue
+      self.data.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+    self.misses += 1
+    return None
+
+  def set(self, prefix, value):
+    network = ipaddress.ip_network(prefix, strict=False)
+    key = (network.version, network.prefixlen, int(network.network_address) >> (network.max_prefixlen - network.prefixlen))
+    if key not in self.data:
+      self.count(network.version, network.prefixlen, 1)
+    super().set(key, value)
+
+  def removed(self, key):
+    self.count(key[0], key[1], -1)
+
+  def count(self, version, prefixlen, increment):
+    lengths = self.lengths[version]
+    total = lengths.get(prefixlen, 0) + increment
+    if total > 0:
+      lengths[prefixlen] = total
+    else:
+      lengths.pop(prefixlen, None)
+    # a prefix length appeared or disappeared
+    if total <= 0 or (total == 1 and increment > 0):
+      self.sorted_lengths[version] = sorted(lengths, reverse=True)
+
+  def clear(self):
+    super().clear()
+    self.lengths = {4: {}, 6: {}}
+    self.sorted_lengths = {4: [], 6: []}
+
+  def stats(self):
+    stats = super().stats()
+    stats['prefix_lengths'] = {f"v{version}": len(lengths) for version, lengths in self.lengths.items()}
+    return stats
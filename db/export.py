@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import os
+
+from db.iputil import cidr_bounds
+
+# pyarrow is only needed with create_db.py --export_dir
+try:
+  import pyarrow as pa
+  import pyarrow.ipc as ipc
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = None
+
+# Columnar export of the rows built by create_db.parse_block(), for DuckDB/Spark/pandas joins without going through postgres.
+# Hive-style partitions, one file per worker process and dump file:
+#   {export_dir}/cidr/source=ripe/family=4/ripe.db.inetnum-1234.parquet
+#   {export_dir}/parent/source=ripe/ripe.db.inetnum-1234.parquet
+# Dictionary columns keep one growing dictionary per file: the batches of a file only ever append to it, which both
+# parquet and the arrow IPC file format (as dictionary deltas) accept.
+# source and family are partition keys only (directory names), they are not repeated inside the files.
+# cidr rows get the first/last address as two uint64 halves (hi, lo): for IPv4 hi is 0 and lo is the address.
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+BATCH_ROWS = 65536
+COMPRESSION = 'zstd'
+
+# table -> [(column, type)], type 'dict' = dictionary encoded string; netname/country/status repeat a lot, attr and the types are enums
+COLUMNS = {
+  'cidr': [('inetnum', 'str'), ('autnum', 'str'), ('netname', 'dict'), ('attr', 'dict'), ('description', 'str'), ('remarks', 'str'),
+           ('country', 'dict'), ('created', 'str'), ('last_modified', 'str'), ('status', 'dict'),
+           ('start_hi', 'uint64'), ('start_lo', 'uint64'), ('end_hi', 'uint64'), ('end_lo', 'uint64')],
+  'parent': [('parent', 'str'), ('parent_type', 'dict'), ('child', 'str'), ('child_type', 'dict')],
+  'member': [('idd', 'str'), ('attr', 'dict'), ('name', 'str'), ('description', 'str'), ('remarks', 'str')],
+  'attr': [('name', 'str'), ('attr', 'dict'), ('description', 'str'), ('remarks', 'str')],
+}
+LOW_MASK = (1 << 64) - 1
+
+
+def available():
+  return pa is not None
+
+
+def arrow_type(kind):
+  return {'str': pa.string(), 'dict': pa.dictionary(pa.int32(), pa.string()), 'uint64': pa.uint64()}[kind]
+
+
+def schema(table):
+  return pa.schema([(column, arrow_type(kind)) for column, kind in COLUMNS[table]])
+
+
+# cidr row + family, start_hi, start_lo, end_hi, end_lo
+def add_bounds(row):
+  bounds = cidr_bounds(row['inetnum'])
+  if bounds is None:
+    return dict(row, family=0, start_hi=None, start_lo=None, end_hi=None, end_lo=None)
+  family, start, end = bounds
+  return dict(row, family=family, start_hi=start >> 64, start_lo=start & LOW_MASK, end_hi=end >> 64, end_lo=end & LOW_MASK)
+
+
+# one output file: buffered columns, dictionaries and the open writer
+class Partition(object):
+  def __init__(self, path, table, export_format):
+    self.path = path
+    self.table = table
+    self.export_format = export_format
+    self.schema = schema(table)
+    self.columns = {column: [] for column, _ in COLUMNS[table]}
+    # column -> {value: index} and the values in index order
+    self.indexes = {column: {} for column, kind in COLUMNS[table] if kind == 'dict'}
+    self.dictionaries = {column: [] for column in self.indexes}
+    self.writer = None
+    self.rows = 0
+    self.buffered = 0
+
+  def add(self, row):
+    for column, values in self.columns.items():
+      value = row.get(column)
+      if column in self.indexes and value is not None:
+        index = self.indexes[column].get(value)
+        if index is None:
+          index = self.indexes[column][value] = len(self.dictionaries[column])
+          self.dictionaries[column].append(value)
+        value = index
+      values.append(value)
+    self.buffered += 1
+    if self.buffered >= BATCH_ROWS:
+      self.flush()
+
+  def flush(self):
+    if not self.buffered:
+      return
+    arrays = []
+    for column, kind in COLUMNS[self.table]:
+      if kind == 'dict':
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array(self.columns[column], pa.int32()), pa.array(self.dictionaries[column], pa.string())))
+      else:
+        arrays.append(pa.array(self.columns[column], arrow_type(kind)))
+    batch = pa.record_batch(arrays, schema=self.schema)
+    if self.writer is None:
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      if self.export_format == 'parquet':
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression=COMPRESSION)
+      else:
+        self.writer = ipc.new_file(self.path, self.schema, options=ipc.IpcWriteOptions(compression=COMPRESSION, emit_dictionary_deltas=True))
+    self.writer.write_batch(batch)
+    self.rows += self.buffered
+    self.buffered = 0
+    for values in self.columns.values():
+      values.clear()
+
+  def close(self):
+    self.flush()
+    if self.writer is not None:
+      self.writer.close()
+
+
+# one Exporter per worker process and dump file
+class Exporter(object):
+  def __init__(self, export_dir, export_format, source, basename):
+    if not available():
+      raise ImportError("--export_dir needs pyarrow: pip install pyarrow")
+    if export_format not in FORMATS:
+      raise ValueError(f"unknown export format {export_format}, expected one of {', '.join(FORMATS)}")
+    self.export_dir = export_dir
+    self.export_format = export_format
+    self.source = source
+    self.filename = f"{basename}-{os.getpid()}.{FORMATS[export_format]}"
+    self.partitions = {}
+
+  def partition(self, table, family=None):
+    key = (table, family)
+    if key not in self.partitions:
+      directory = os.path.join(self.export_dir, table, f"source={self.source}")
+      if family is not None:
+        directory = os.path.join(directory, f"family={family}")
+      self.partitions[key] = Partition(os.path.join(directory, self.filename), table, self.export_format)
+    return self.partitions[key]
+
+  # rows = create_db.parse_block() output: {table: [row dicts]}
+  def add(self, rows):
+    for table, table_rows in rows.items():
+      for row in table_rows:
+        if table == 'cidr':
+          row = add_bounds(row)
+          self.partition(table, row['family']).add(row)
+        else:
+          self.partition(table).add(row)
+
+  # {table: rows written}
+  def close(self):
+    written = {}
+    for (table, _), partition in self.partitions.items():
+      partition.close()
+      written[table] = written.get(table, 0) + partition.rows
+    return written
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*- ®
 
-from sqlalchemy import create_engine
+import os
+import time
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateTable
 # # MovedIn20Warning: The ``declarative_base()`` function is now available as sqlalchemy.orm.declarative_base(). (deprecated since: 2.0) (Background on SQLAlchemy 2.0 at: https://sqlalche.me/e/b8d9)
 # # from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker, exc
@@ -33,27 +38,113 @@ def get_base():
   # print(type(e), error)
 
 
-def create_postgres_pool(connection_string):
-  engine = create_engine(connection_string)
+# v2.2.0: --reset_db no longer empties the live tables for the whole import.
+# The loader builds into SHADOW_SCHEMA, indexes and analyzes it, then swap_shadow() moves the tables into the live schema in one transaction.
+# Readers keep querying the previous dataset until the swap commits, and never see a partial one.
+SHADOW_SCHEMA = 'whoisd_shadow'
+RETIRED_SCHEMA = 'whoisd_retired'
+
+
+# v2.2.4: one engine per process, connection string and profile instead of a new engine (and pool) on every call.
+# prepare_threshold: psycopg prepares a statement server-side once it ran that many times on a connection,
+# the loader repeats the same few INSERT/SELECT shapes millions of times. Set it to None behind pgbouncer in transaction mode.
+PROFILES = {
+  # one long transaction per worker process: a single connection, no pre-ping, prepare from the second execution
+  'bulk': {'pool_size': 1, 'max_overflow': 1, 'pool_pre_ping': False, 'prepare_threshold': 1},
+}
+ENGINES = {}
+SESSIONS = {}
+
+
+# QueuePool recording how long the checkouts waited for a connection
+class TimedQueuePool(QueuePool):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.checkouts = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+
+  def _do_get(self):
+    start_time = time.perf_counter()
+    try:
+      return super()._do_get()
+    finally:
+      wait = time.perf_counter() - start_time
+      self.checkouts += 1
+      self.wait_total += wait
+      self.wait_max = max(self.wait_max, wait)
+
+
+def get_engine(connection_string, profile='bulk'):
+  # keyed by pid: a forked worker never reuses the sockets of its parent
+  key = (os.getpid(), connection_string, profile)
+  if key not in ENGINES:
+    options = PROFILES[profile]
+    ENGINES[key] = create_engine(connection_string, poolclass=TimedQueuePool,
+                                 pool_size=options['pool_size'], max_overflow=options['max_overflow'], pool_pre_ping=options['pool_pre_ping'],
+                                 connect_args={'prepare_threshold': options['prepare_threshold']})
+  return ENGINES[key]
+
+
+def create_postgres_pool(connection_string, schema=None, profile='bulk'):
+  engine = get_engine(connection_string, profile)
+  if schema:
+    # all the models are declared without schema: redirect them to the shadow schema, DDL included
+    # execution_options() returns a proxy sharing the pool of the cached engine
+    engine = engine.execution_options(schema_translate_map={None: schema})
   return engine
 
+
+# {'checkouts': .., 'wait_ms_avg': .., 'wait_ms_max': .., 'checkedout': ..} for the engines of this process
+def pool_stats(connection_string=None, profile=None):
+  result = {}
+  for (pid, engine_string, engine_profile), engine in ENGINES.items():
+    if pid != os.getpid() or (connection_string and engine_string != connection_string) or (profile and engine_profile != profile):
+      continue
+    pool = engine.pool
+    result[engine_profile] = {
+      'checkouts': pool.checkouts,
+      'wait_ms_avg': round(pool.wait_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+      'wait_ms_max': round(pool.wait_max * 1000, 3),
+      'checkedout': pool.checkedout(),
+      'size': pool.size(),
+    }
+  return result
+
+
+def dispose_engines():
+  for key in [key for key in ENGINES if key[0] == os.getpid()]:
+    ENGINES.pop(key).dispose()
+  SESSIONS.clear()
+
+
 # TODO: read https://docs.sqlalchemy.org/en/20/core/connections.html#dbapi-autocommit
 # connection_string = 'postgresql+psycopg://whoisd:whoisd@db:5432/whoisd'
 # session = setup_connection(connection_string)
-def setup_connection(connection_string, reset_db=False):
-  engine = create_postgres_pool(connection_string)
+def setup_connection(connection_string, reset_db=False, schema=None, profile='bulk', resume=False):
+  engine = create_postgres_pool(connection_string, schema, profile)
   # session = sessionmaker()
   # session.configure(bind=engine)
   # session = scoped_session(sessionmaker(bind=engine))
   # session = scoped_session(sessionmaker(bind=engine, autoflush=False))
   # session = scoped_session(sessionmaker(bind=engine, autoflush=True))
   # session = sessionmaker(bind=engine, autoflush=True)
-  session = sessionmaker(bind=engine, autoflush=False)
-  Base.metadata.bind = engine
+  # v2.2.4: the sessionmaker is cached with its engine, Base.metadata.bind is gone (removed in SQLAlchemy 2.0)
+  key = (os.getpid(), connection_string, schema, profile)
+  if key not in SESSIONS:
+    SESSIONS[key] = sessionmaker(bind=engine, autoflush=False)
+  session = SESSIONS[key]
   
-  if reset_db:
+  if reset_db and schema:
+    # resume: keep the shadow of the interrupted run, its checkpoint table says which chunks are already in
+    if resume and shadow_exists(engine, schema):
+      upgrade_checkpoints(engine, schema)
+      Base.metadata.tables['checkpoint'].create(engine, checkfirst=True)
+    else:
+      create_shadow(engine, schema)
+  elif reset_db:
     try:
-      Base.metadata.drop_all(engine)
+      Base.metadata.drop_all(engine, tables=shadow_tables())
     except:
       pass
     try:
@@ -63,3 +154,81 @@ def setup_connection(connection_string, reset_db=False):
   
   return session()
 
+
+# tables added by a newer version (checkpoint, meta..) on a database loaded without --reset_db
+def create_missing(connection_string):
+  engine = get_engine(connection_string)
+  upgrade_checkpoints(engine)
+  Base.metadata.create_all(engine)
+
+
+# a checkpoint table without the reader column is dropped with its checkpoints: --resume loads those chunks again
+def upgrade_checkpoints(engine, schema=None):
+  with engine.begin() as conn:
+    inspector = inspect(conn)
+    if inspector.has_table('checkpoint', schema=schema) and 'reader' not in {column['name'] for column in inspector.get_columns('checkpoint', schema=schema)}:
+      conn.execute(text(f'DROP TABLE "{schema}"."checkpoint"' if schema else 'DROP TABLE "checkpoint"'))
+
+
+# the tables rebuilt by --reset_db, the persistent ones (history) stay in the live schema across imports
+def shadow_tables():
+  return [table for table in Base.metadata.sorted_tables if not table.info.get('persistent')]
+
+
+def shadow_exists(engine, schema=SHADOW_SCHEMA):
+  with engine.connect() as conn:
+    return inspect(conn).has_schema(schema)
+
+
+# (re)create an empty shadow schema: tables and unique indexes only, the other indexes are built by finalize_shadow() once loaded.
+# unique=False: the tables alone, for a snapshot restore (db/snapshot.py) that builds all the indexes after the load
+def create_shadow(engine, schema, unique=True):
+  with engine.begin() as conn:
+    conn.execute(text(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE'))
+    conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    for table in shadow_tables():
+      conn.execute(CreateTable(table))
+      for index in table.indexes:
+        if index.unique and unique:
+          index.create(conn)
+
+
+def drop_shadow(connection_string, schema=SHADOW_SCHEMA):
+  engine = create_postgres_pool(connection_string)
+  with engine.begin() as conn:
+    conn.execute(text(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE'))
+
+
+# build the deferred indexes and statistics while the shadow is still invisible to readers, then swap it live.
+# indexes=False: they are already built (snapshot restore)
+def finalize_shadow(connection_string, schema=SHADOW_SCHEMA, indexes=True):
+  engine = create_postgres_pool(connection_string, schema)
+  with engine.begin() as conn:
+    for table in shadow_tables():
+      for index in table.indexes:
+        if not index.unique and indexes:
+          index.create(conn)
+  with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+    for table in shadow_tables():
+      conn.execute(text(f'ANALYZE "{schema}"."{table.name}"'))
+  swap_shadow(connection_string, schema)
+
+
+# ALTER TABLE .. SET SCHEMA carries indexes, constraints and owned sequences along, and only needs a brief ACCESS EXCLUSIVE lock:
+# readers wait at most for the swap itself, never for the load
+def swap_shadow(connection_string, schema=SHADOW_SCHEMA):
+  engine = create_postgres_pool(connection_string)
+  with engine.begin() as conn:
+    live = conn.execute(text('SELECT current_schema()')).scalar()
+    existing = inspect(conn).get_table_names(schema=live)
+    conn.execute(text(f'DROP SCHEMA IF EXISTS "{RETIRED_SCHEMA}" CASCADE'))
+    conn.execute(text(f'CREATE SCHEMA "{RETIRED_SCHEMA}"'))
+    for table in shadow_tables():
+      if table.name in existing:
+        conn.execute(text(f'ALTER TABLE "{live}"."{table.name}" SET SCHEMA "{RETIRED_SCHEMA}"'))
+      conn.execute(text(f'ALTER TABLE "{schema}"."{table.name}" SET SCHEMA "{live}"'))
+    conn.execute(text(f'DROP SCHEMA "{schema}"'))
+  # the previous dataset is only dropped once nobody can see it anymore
+  with engine.begin() as conn:
+    conn.execute(text(f'DROP SCHEMA IF EXISTS "{RETIRED_SCHEMA}" CASCADE'))
+
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+from sqlalchemy import text
+
+from db.helper import create_postgres_pool
+from db.model import BlockCidr, BlockHistory
+from db.ranges import qualified
+
+# Post-import stage of create_db.py --history: the cidr rows of this import against the open versions of the history table.
+# --reset_db rebuilds cidr from scratch each time, the history table lives outside the shadow rebuild and keeps the past:
+#   - an open version whose key (inetnum, autnum) is gone or whose digest changed is closed at the import time
+#   - a key with no open version left gets a new one, valid from the import time on
+#   - an unchanged row is not touched: the table grows with the churn between imports, not with their size
+# Both steps are one set-based statement each, in one transaction with a single now(): the versions of a key never overlap.
+# The digest covers what the lookups show: the prefix owner (netname, description), country, status, attr and source.
+DIGEST = "md5(ROW(c.netname, c.country, c.status, c.attr, c.source, c.description)::text)"
+
+CLOSE_SQL = """
+UPDATE {history} h SET valid = tstzrange(lower(h.valid), now())
+WHERE upper_inf(h.valid)
+  AND NOT EXISTS (SELECT 1 FROM {cidr} c WHERE c.inetnum = h.inetnum AND c.autnum = h.autnum AND {digest} = h.digest)
+"""
+OPEN_SQL = """
+INSERT INTO {history} (inetnum, autnum, valid, netname, country, status, attr, source, description, digest)
+SELECT c.inetnum, c.autnum, tstzrange(now(), NULL), c.netname, c.country, c.status, c.attr, c.source, c.description, {digest}
+FROM {cidr} c
+WHERE NOT EXISTS (SELECT 1 FROM {history} h WHERE upper_inf(h.valid) AND h.inetnum = c.inetnum AND h.autnum = c.autnum)
+"""
+
+
+# the history table is created in the live schema, never in the shadow one
+def create_history(connection_string):
+  BlockHistory.__table__.create(create_postgres_pool(connection_string), checkfirst=True)
+
+
+# schema: the shadow schema holding the imported cidr rows, None for the live tables; returns (versions closed, versions opened)
+def record_history(connection_string, schema=None):
+  create_history(connection_string)
+  history = qualified(BlockHistory.__tablename__, None)
+  cidr = qualified(BlockCidr.__tablename__, schema)
+  engine = create_postgres_pool(connection_string)
+  with engine.begin() as conn:
+    closed = conn.execute(text(CLOSE_SQL.format(history=history, cidr=cidr, digest=DIGEST))).rowcount
+    opened = conn.execute(text(OPEN_SQL.format(history=history, cidr=cidr, digest=DIGEST))).rowcount
+  with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+    conn.execute(text(f'ANALYZE {history}'))
+  return closed, opened
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import numpy as np
+
+from db.iputil import cidr_bounds
+
+# Batch IP -> most specific prefix matching with NumPy, for enriching large log files without a query per address.
+# The nested prefixes (0.0.0.0/0 > 8.0.0.0/8 > 8.8.8.0/24 ..) are flattened once into sorted, disjoint intervals,
+# each one owned by the most specific prefix covering it. A lookup is then a binary search per address:
+#   IPv4: np.searchsorted over the uint32 interval starts
+#   IPv6: the addresses are (hi, lo) uint64 pairs, numpy cannot binary-search 128-bit keys: np.searchsorted over the
+#         distinct start hi halves, built once per index, then a vectorized binary search over the lo halves of the starts
+#         sharing the hi half of an address (the prefixes longer than /64), a few steps for those addresses only
+# Both return, per address, the index of its prefix in IntervalIndex.prefixes, -1 when nothing covers it.
+LOW_MASK = (1 << 64) - 1
+# array names in the .npz snapshots, see save()
+V4_ARRAYS = ('v4_starts', 'v4_ends', 'v4_owners')
+V6_ARRAYS = ('v6_start_hi', 'v6_start_lo', 'v6_end_hi', 'v6_end_lo', 'v6_owners')
+
+
+# intervals: (start, end, owner) sorted by start ascending then end descending, every two of them nested or disjoint (CIDRs are).
+# yields the disjoint (start, end, owner, ancestors) pieces in address order, ancestors = the covering owners, least specific first.
+# Identical intervals are nested in input order: the last one owns the space.
+def flatten(intervals):
+  stack = []
+  cursor = None
+  for start, end, owner in intervals:
+    while stack and stack[-1][0] < start:
+      top_end, top_owner = stack.pop()
+      if cursor <= top_end:
+        yield cursor, top_end, top_owner, tuple(o for _, o in stack)
+        cursor = top_end + 1
+    # the part of the enclosing interval before this one
+    if stack and cursor < start:
+      yield cursor, start - 1, stack[-1][1], tuple(o for _, o in stack[:-1])
+    cursor = start
+    stack.append((end, owner))
+  while stack:
+    top_end, top_owner = stack.pop()
+    if cursor <= top_end:
+      yield cursor, top_end, top_owner, tuple(o for _, o in stack)
+      cursor = top_end + 1
+
+
+# intervals: same order as flatten() -> yields (owner, parent) per interval, parent = owner of the smallest interval containing it, None at the top.
+# The tree edges of the prefix hierarchy: 10.0.0.0/8 -> 10.1.0.0/16 -> 10.1.2.0/24
+def containment(intervals):
+  stack = []
+  for start, end, owner in intervals:
+    while stack and stack[-1][0] < start:
+      stack.pop()
+    yield owner, stack[-1][1] if stack else None
+    stack.append((end, owner))
+
+
+# prefixes: CIDR strings -> ({4: [(start, end, owner)..], 6: [..]}, distinct prefixes); owner = index in the distinct prefixes
+def prefix_intervals(prefixes):
+  distinct = {}
+  intervals = {4: [], 6: []}
+  for prefix in prefixes:
+    if prefix in distinct:
+      continue
+    bounds = cidr_bounds(prefix)
+    if bounds is None:
+      continue
+    family, start, end = bounds
+    distinct[prefix] = len(distinct)
+    intervals[family].append((start, end, distinct[prefix]))
+  for family in intervals:
+    intervals[family].sort(key=lambda interval: (interval[0], -interval[1]))
+  return intervals, list(distinct)
+
+
+class IntervalIndex(object):
+  def __init__(self, prefixes, v4, v6):
+    # v4 = (starts, ends, owners) uint32/uint32/int64, v6 = (start_hi, start_lo, end_hi, end_lo, owners) uint64 x4/int64
+    self.prefixes = prefixes
+    self.v4 = v4
+    self.v6 = v6
+    # the distinct hi halves of the v6 starts and the index of the first start of each, the start count closing the last one
+    self.v6_hi, first = np.unique(v6[0], return_index=True)
+    self.v6_first = np.append(first, len(v6[0])).astype(np.int64)
+
+  # pieces: {family: [(start, end, owner)..]} disjoint and sorted, owner = index in prefixes
+  @classmethod
+  def from_pieces(cls, prefixes, pieces):
+    v4 = pieces[4]
+    v6 = pieces[6]
+    return cls(prefixes,
+               (np.array([p[0] for p in v4], dtype=np.uint32),
+                np.array([p[1] for p in v4], dtype=np.uint32),
+                np.array([p[2] for p in v4], dtype=np.int64)),
+               (np.array([p[0] >> 64 for p in v6], dtype=np.uint64),
+                np.array([p[0] & LOW_MASK for p in v6], dtype=np.uint64),
+                np.array([p[1] >> 64 for p in v6], dtype=np.uint64),
+                np.array([p[1] & LOW_MASK for p in v6], dtype=np.uint64),
+                np.array([p[2] for p in v6], dtype=np.int64)))
+
+  @classmethod
+  def from_prefixes(cls, prefixes):
+    intervals, distinct = prefix_intervals(prefixes)
+    return cls.from_pieces(distinct, {family: list(flatten(intervals[family])) for family in intervals})
+
+  # v2.2.9: the cidr_range table already holds the flattened intervals, the cidr table is flattened here for older databases
+  @classmethod
+  def from_database(cls, dsn):
+    import psycopg
+    with psycopg.connect(dsn) as conn:
+      try:
+        rows = conn.execute("SELECT family, start_ip, end_ip, inetnum FROM cidr_range ORDER BY family, start_ip").fetchall()
+      except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return cls.from_prefixes([row[0] for row in conn.execute("SELECT DISTINCT inetnum FROM cidr")])
+    owners = {}
+    pieces = {4: [], 6: []}
+    for family, start, end, inetnum in rows:
+      owner = owners.setdefault(inetnum, len(owners))
+      pieces[family].append((int(start), int(end), owner))
+    return cls.from_pieces(list(owners), pieces)
+
+  def __len__(self):
+    return len(self.v4[0]) + len(self.v6[0])
+
+  # v2.2.17: .npz snapshot for query.py, no database needed to load it back.
+  # details = {column: [str per prefix]} carried along (netname, country..), stamp = import timestamp of the database.
+  # Written next to path and renamed over it: a reader polling the file never loads half of it
+  def save(self, path, details=None, stamp=''):
+    import os
+    arrays = {'prefixes': np.array(self.prefixes, dtype=str), 'stamp': np.array(stamp or '')}
+    arrays.update(zip(V4_ARRAYS, self.v4))
+    arrays.update(zip(V6_ARRAYS, self.v6))
+    for column, values in (details or {}).items():
+      arrays[f'detail_{column}'] = np.array(values, dtype=str)
+    with open(f"{path}.tmp", 'wb') as f:
+      np.savez(f, **arrays)
+    os.replace(f"{path}.tmp", path)
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as data:
+      index = cls(data['prefixes'].tolist(), tuple(data[name] for name in V4_ARRAYS), tuple(data[name] for name in V6_ARRAYS))
+      index.details = {name[len('detail_'):]: data[name].tolist() for name in data.files if name.startswith('detail_')}
+      index.stamp = str(data['stamp'])
+    return index
+
+  # ips: uint32 array -> int64 array of prefix indexes, -1 when no prefix covers the address
+  def lookup_v4(self, ips):
+    starts, ends, owners = self.v4
+    ips = np.asarray(ips, dtype=np.uint32)
+    if not len(starts):
+      return np.full(len(ips), -1, dtype=np.int64)
+    candidates = np.searchsorted(starts, ips, side='right') - 1
+    clipped = np.maximum(candidates, 0)
+    found = (candidates >= 0) & (ips <= ends[clipped])
+    return np.where(found, owners[clipped], -1)
+
+  # hi, lo: the two uint64 halves of the IPv6 addresses -> int64 array of prefix indexes, -1 when no prefix covers the address
+  def lookup_v6(self, hi, lo):
+    start_hi, start_lo, end_hi, end_lo, owners = self.v6
+    hi = np.asarray(hi, dtype=np.uint64)
+    lo = np.asarray(lo, dtype=np.uint64)
+    if not len(start_hi):
+      return np.full(len(hi), -1, dtype=np.int64)
+    # the last group of starts with a hi half at or below the address: its last start, unless the hi halves are equal
+    groups = np.searchsorted(self.v6_hi, hi, side='right') - 1
+    clipped = np.maximum(groups, 0)
+    candidates = np.where(groups >= 0, self.v6_first[clipped + 1] - 1, -1)
+    # equal hi halves: the last start of the group with a lo half at or below the address, the previous group's last one when none is
+    tied = np.flatnonzero((groups >= 0) & (self.v6_hi[clipped] == hi))
+    left = self.v6_first[groups[tied]]
+    right = self.v6_first[groups[tied] + 1]
+    address = lo[tied]
+    while (left < right).any():
+      active = left < right
+      middle = (left + right) // 2
+      below = active & (start_lo[np.minimum(middle, len(start_lo) - 1)] <= address)
+      left = np.where(below, middle + 1, left)
+      right = np.where(active & ~below, middle, right)
+    candidates[tied] = left - 1
+    clipped = np.maximum(candidates, 0)
+    found = (candidates >= 0) & ((hi < end_hi[clipped]) | ((hi == end_hi[clipped]) & (lo <= end_lo[clipped])))
+    return np.where(found, owners[clipped], -1)
+
+  # addresses: ipaddress objects -> list of prefix indexes, -1 when not covered
+  def owners(self, addresses):
+    result = [-1] * len(addresses)
+    v4 = [i for i, address in enumerate(addresses) if address.version == 4]
+    v6 = [i for i, address in enumerate(addresses) if address.version == 6]
+    if v4:
+      for i, owner in zip(v4, self.lookup_v4([int(addresses[i]) for i in v4])):
+        result[i] = int(owner)
+    if v6:
+      values = [int(addresses[i]) for i in v6]
+      for i, owner in zip(v6, self.lookup_v6([value >> 64 for value in values], [value & LOW_MASK for value in values])):
+        result[i] = int(owner)
+    return result
+
+  # addresses: iterable of str -> list of prefixes (None when not covered), convenience for small batches
+  def lookup(self, addresses):
+    import ipaddress
+    return [self.prefixes[owner] if owner >= 0 else None for owner in self.owners([ipaddress.ip_address(address) for address in addresses])]
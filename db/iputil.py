@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import ipaddress
+from functools import lru_cache
+
+# IPv4 range -> CIDR on plain integers, without the netaddr IPAddress/IPNetwork objects.
+# The parser hands over the bytes matched in the block and gets back str CIDRs, ready for the BlockCidr rows.
+# Both are memoized: the same ranges and prefixes come back across registries and for every origin of a route.
+RANGE_CACHE = 65536
+PREFIX_CACHE = 65536
+
+
+# b'196.200.128.0' -> 3301539840
+def ipv4_to_int(address: bytes) -> int:
+  a, b, c, d = address.split(b'.')
+  a, b, c, d = int(a), int(b), int(c), int(d)
+  if a > 255 or b > 255 or c > 255 or d > 255:
+    raise ValueError(f"invalid IPv4 address {address!r}")
+  return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def int_to_ipv4(value: int) -> str:
+  return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+# smallest list of CIDRs covering start..end (inclusive): at each step the largest block aligned on start that does not pass end
+def range_to_cidrs(start: int, end: int, bits: int = 32) -> list:
+  # a reversed range gives the start address alone, like netaddr did
+  if start > end:
+    return [(start, bits)]
+  cidrs = []
+  while start <= end:
+    # trailing zeros of start = its alignment; start 0 is aligned on everything
+    size = (start & -start).bit_length() - 1 if start else bits
+    span = (end - start + 1).bit_length() - 1
+    size = min(size, span)
+    cidrs.append((start, bits - size))
+    start += 1 << size
+  return cidrs
+
+
+# inetnum: 196.200.128.0 - 196.200.191.255 -> ('196.200.128.0/18',)
+@lru_cache(maxsize=RANGE_CACHE)
+def iprange_to_cidrs(ip_start: bytes, ip_end: bytes) -> tuple:
+  return tuple(f"{int_to_ipv4(network)}/{prefixlen}" for network, prefixlen in range_to_cidrs(ipv4_to_int(ip_start), ipv4_to_int(ip_end)))
+
+
+# route/route6/inet6num prefixes are kept as written in the dump: decode once, and share one str per distinct prefix
+@lru_cache(maxsize=PREFIX_CACHE)
+def prefix_str(prefix: bytes) -> str:
+  return prefix.decode('utf-8')
+
+
+# '196.200.128.0/18' -> (4, 3301539840, 3301556223): family, first and last address as integers, None when unparsable.
+# Host bits right of the mask are ignored like the inet cast of the lookups does.
+@lru_cache(maxsize=PREFIX_CACHE)
+def cidr_bounds(cidr: str):
+  try:
+    network = ipaddress.ip_network(cidr, strict=False)
+  except ValueError:
+    return None
+  return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def cache_info() -> dict:
+  return {'ranges': iprange_to_cidrs.cache_info()._asdict(), 'prefixes': prefix_str.cache_info()._asdict()}
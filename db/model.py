@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*- ®
 
-from sqlalchemy import Unicode, Column, Integer, String, DateTime, Index, PrimaryKeyConstraint
-from sqlalchemy import literal_column
+from sqlalchemy import Unicode, Column, Integer, SmallInteger, Numeric, String, DateTime, Index, PrimaryKeyConstraint
+from sqlalchemy import literal_column, cast
 from db.helper import get_base
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import func
@@ -51,6 +51,11 @@ class BlockCidr(Base):
   __table_args__ = (
     PrimaryKeyConstraint(inetnum, autnum),
     Index('ix_cidr_description', func.to_tsvector(literal_column("'english'"), description), postgresql_using="gin"), 
+    # inetnum is stored as text: index its inet cast so inetnum::inet >>= ip lookups do not scan the table
+    # inet and not cidr: some registries have host bits set right of the mask, the cidr cast would reject them
+    Index('ix_cidr_inetnum_inet', cast(inetnum, postgresql.INET).label('inetnum_inet'), postgresql_using="gist", postgresql_ops={'inetnum_inet': 'inet_ops'}),
+    # db/search.py: netnames are handles, the simple configuration keeps them unstemmed
+    Index('ix_cidr_netname_tsv', func.to_tsvector(literal_column("'simple'"), netname), postgresql_using="gin"),
   )
   
   def __str__(self):
@@ -92,6 +97,8 @@ class BlockAttr(Base):
   
   __table_args__ = (
     Index('ix_attr_description', func.to_tsvector(literal_column("'english'"), description), postgresql_using="gin"), 
+    # db/batch.py: one row per name and type, the batched INSERT .. ON CONFLICT DO NOTHING relies on it
+    Index('ux_attr_name_attr', name, attr, unique=True),
   )
   
   def __str__(self):
@@ -110,6 +117,9 @@ class BlockParent(Base):
   
   __table_args__ = (
     PrimaryKeyConstraint(parent, parent_type, child, child_type),
+    # db/search.py: maintainer and organisation handles, the other parent rows are never searched
+    Index('ix_parent_parent_tsv', func.to_tsvector(literal_column("'simple'"), parent), postgresql_using="gin",
+          postgresql_where=parent_type.in_(['mntner', 'organisation'])),
   )
   
   def __str__(self):
@@ -117,3 +127,140 @@ class BlockParent(Base):
   
   def __repr__(self):
     return self.__str__()
+
+
+# BlockMeta: facts about the loaded dataset, like the import timestamp and the last NRTM batch ('updated') the lookup services
+# use for ETag and cache invalidation
+class BlockMeta(Base):
+  __tablename__ = 'meta'
+  key   = Column(String, primary_key=True)
+  value = Column(String)
+  
+  def __str__(self):
+    return f'key: {self.key}, value: {self.value}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockCheckpoint: chunks of a dump file already committed, written in the same transaction as the rows of the chunk.
+# A chunk is chunk_size consecutive blocks in file order; size tells a re-downloaded file apart from the one of the interrupted run.
+# reader: the parser and the classes read (create_db.py checkpoint_reader()), the blocks of a chunk depend on --types and the
+# rows on --generic_parser: a run with other ones does not see these checkpoints.
+class BlockCheckpoint(Base):
+  __tablename__ = 'checkpoint'
+  filename    = Column(String)
+  size        = Column(postgresql.BIGINT)
+  chunk_size  = Column(Integer)
+  reader      = Column(String)
+  chunk       = Column(Integer)
+  blocks      = Column(Integer)
+  __table_args__ = (
+    PrimaryKeyConstraint(filename, size, chunk_size, reader, chunk),
+  )
+  
+  def __str__(self):
+    return f'filename: {self.filename}, size: {self.size}, chunk_size: {self.chunk_size}, reader: {self.reader}, chunk: {self.chunk}, blocks: {self.blocks}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockRange: the cidr prefixes flattened into disjoint address ranges, rebuilt after each import (db/ranges.py).
+# inetnum is the most specific prefix covering the range, ancestors the covering ones, least specific first.
+# An ip lookup is a single row: the last range starting at or before the address, its end checked by the caller.
+# Numeric(39, 0) holds IPv6 addresses, bigint stops at 2^63.
+class BlockRange(Base):
+  __tablename__ = 'cidr_range'
+  family    = Column(SmallInteger)
+  start_ip  = Column(Numeric(39, 0))
+  end_ip    = Column(Numeric(39, 0), nullable=False)
+  inetnum   = Column(String, nullable=False)
+  ancestors = Column(postgresql.ARRAY(String), nullable=False)
+  __table_args__ = (
+    PrimaryKeyConstraint(family, start_ip),
+  )
+  
+  def __str__(self):
+    return f'family: {self.family}, start_ip: {self.start_ip}, end_ip: {self.end_ip}, inetnum: {self.inetnum}, ancestors: {self.ancestors}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockAsn: every prefix originated by an ASN across the registries, the aggregate of its cidr rows (db/asn.py).
+# Refreshed after each import for the ASNs in asn_dirty only; the addresses are those of the union of the prefixes,
+# a /24 announced next to its /16 is not counted twice.
+class BlockAsn(Base):
+  __tablename__ = 'asn'
+  autnum        = Column(String, primary_key=True)
+  prefixes      = Column(postgresql.ARRAY(String), nullable=False)
+  v4_prefixes   = Column(Integer, nullable=False)
+  v6_prefixes   = Column(Integer, nullable=False)
+  v4_addresses  = Column(postgresql.BIGINT, nullable=False)
+  v6_addresses  = Column(Numeric(39, 0), nullable=False)
+  refreshed     = Column(DateTime, nullable=False)
+  
+  def __str__(self):
+    return f'autnum: {self.autnum}, v4_prefixes: {self.v4_prefixes}, v6_prefixes: {self.v6_prefixes}, v4_addresses: {self.v4_addresses}, v6_addresses: {self.v6_addresses}, refreshed: {self.refreshed}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockAsnDirty: the ASNs of the cidr rows written since the last refresh, added in the transaction of their chunk
+class BlockAsnDirty(Base):
+  __tablename__ = 'asn_dirty'
+  autnum = Column(String, primary_key=True)
+  
+  def __str__(self):
+    return f'autnum: {self.autnum}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockHistory: the versions of the cidr rows across imports (create_db.py --history, db/history.py), valid over a time range.
+# A row is closed (upper bound set) when its key disappears or its digest changes, a new open version is added;
+# an unchanged row is never rewritten. Not part of the shadow rebuild: --reset_db keeps it (info persistent).
+# Point in time: inetnum::inet >>= ip AND valid @> ts, both through the GiST index.
+class BlockHistory(Base):
+  __tablename__ = 'history'
+  inetnum     = Column(String, nullable=False)
+  autnum      = Column(String, nullable=False)
+  valid       = Column(postgresql.TSTZRANGE, nullable=False)
+  netname     = Column(String)
+  country     = Column(String)
+  status      = Column(String)
+  attr        = Column(String)
+  source      = Column(String)
+  description = Column(String)
+  digest      = Column(String, nullable=False)
+  __table_args__ = (
+    PrimaryKeyConstraint(inetnum, autnum, valid),
+    Index('ix_history_inetnum_valid', cast(inetnum, postgresql.INET).label('inetnum_inet'), valid, postgresql_using="gist", postgresql_ops={'inetnum_inet': 'inet_ops'}),
+    # the open version of each key, what the next import is compared with
+    Index('ux_history_open', inetnum, autnum, unique=True, postgresql_where=func.upper_inf(valid)),
+    {'info': {'persistent': True}},
+  )
+  
+  def __str__(self):
+    return f'inetnum: {self.inetnum}, autnum: {self.autnum}, valid: {self.valid}, netname: {self.netname}, country: {self.country}, status: {self.status}, source: {self.source}'
+  
+  def __repr__(self):
+    return self.__str__()
+
+
+# BlockNrtmState: the last NRTM serial applied per source (nrtm.py), committed with the rows of its batch.
+# Rebuilt empty by --reset_db: the dump replaces the mirrored state, nrtm.py then starts from --serial (RIPE.CURRENTSERIAL)
+class BlockNrtmState(Base):
+  __tablename__ = 'nrtm_state'
+  source  = Column(String, primary_key=True)
+  serial  = Column(postgresql.BIGINT, nullable=False)
+  updated = Column(DateTime, nullable=False)
+  
+  def __str__(self):
+    return f'source: {self.source}, serial: {self.serial}, updated: {self.updated}'
+  
+  def __repr__(self):
+    return self.__str__()
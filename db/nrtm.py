@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import logging
+import random
+import re
+import socket
+import socketserver
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import select, delete, and_, or_, tuple_, inspect
+from sqlalchemy.dialects.postgresql import insert
+
+from db.adapters import get_adapter
+from db.helper import create_postgres_pool
+from db.model import BlockCidr, BlockAttr, BlockParent, BlockMember, BlockAsnDirty, BlockMeta, BlockNrtmState
+
+# Near-real-time mirroring (nrtm.py): the ADD/DEL stream of an NRTM server applied to the tables between two full imports.
+#   %START Version: 3 RIPE 1000-1002
+#
+#   ADD 1000
+#
+#   inetnum: ..
+#
+#   DEL 1001
+#   ..
+#   %END RIPE
+# The objects are parsed by the registry adapter (db/adapters.py), into the same rows as a full import.
+#   ADD  the cidr/attr/member rows are upserted, the members of a set replaced, the other parent rows added
+#   DEL  the rows of the object are deleted, with the parent rows of a name nothing references any more
+# The updates are applied in transactions of `batch` updates, each one committing the last serial of its batch in
+# nrtm_state: an interrupted run resumes after the last committed batch, the updates already applied are skipped.
+# The ASNs touched go to asn_dirty for refresh_asns(); cidr_range and the prefix tree wait for nrtm.py --ranges or the next import.
+# Each batch also sets meta 'updated' to its source and last serial: the lookup services version their caches, ETags and
+# set expansions with it next to the import timestamp (db/lookup.py get_import_stamp()).
+NRTM_PORT = 4444
+BATCH_UPDATES = 100
+START_RE = re.compile(rb'^%START Version: *(\d+) +(\S+) +(\d+)-(\d+)')
+OP_RE = re.compile(rb'^(ADD|DEL)(?: +(\d+))?$')
+QUERY_RE = re.compile(r'^-g +([^:]+):(\d+):(\d+)-(\d+|LAST)')
+TIMEOUT = 30
+
+logger = logging.getLogger('nrtm')
+
+
+class NrtmError(Exception):
+  pass
+
+
+# lines (bytes) -> (op, serial, block) in stream order; NRTM v1 has no serial per update, they count from the %START range
+def read_updates(lines):
+  op = None
+  serial = None
+  block = []
+  next_serial = None
+  for line in lines:
+    if line.startswith(b'%'):
+      match = START_RE.match(line)
+      if match:
+        next_serial = int(match.group(3))
+      elif line.startswith(b'%ERROR'):
+        raise NrtmError(line.decode('utf-8', 'replace').strip())
+      elif line.startswith(b'%END'):
+        break
+      continue
+    if line.startswith(b'#') or line.startswith(b'remarks:'):
+      continue
+    stripped = line.strip()
+    if op is None:
+      if not stripped:
+        continue
+      match = OP_RE.match(stripped)
+      if not match:
+        raise NrtmError(f"expected ADD/DEL, got {stripped[:80]!r}")
+      op = match.group(1).decode('utf-8')
+      if match.group(2):
+        serial = int(match.group(2))
+      elif next_serial is not None:
+        serial = next_serial
+      else:
+        raise NrtmError(f"{op} without serial outside of a %START range")
+      next_serial = serial + 1
+      continue
+    if stripped:
+      block.append(line if line.endswith(b'\n') else line + b'\n')
+    elif block:
+      yield op, serial, b''.join(block)
+      op = None
+      block = []
+  if op is not None and block:
+    yield op, serial, b''.join(block)
+
+
+# the updates first..last of a mirror server: -g SOURCE:3:first-LAST, the server closes the connection at %END
+def query_mirror(host, port, source, first, last='LAST', timeout=TIMEOUT):
+  with socket.create_connection((host, port), timeout=timeout) as sock:
+    sock.sendall(f"-g {source}:3:{first}-{last}\n".encode('utf-8'))
+    with sock.makefile('rb') as stream:
+      yield from stream
+
+
+class NrtmApplier(object):
+  def __init__(self, connection_string, source, batch=BATCH_UPDATES):
+    self.engine = create_postgres_pool(connection_string)
+    self.source = source.upper()
+    # the rows get the registry name as source, like the dumps
+    self.adapter = get_adapter(source.lower())
+    self.source_line = b"cust_source: %s" % source.lower().encode('utf-8')
+    self.batch = batch
+    # applied: ADD/DEL written, ignored: objects of a class that is not loaded, skipped: serials already applied
+    self.counts = {'ADD': 0, 'DEL': 0, 'ignored': 0, 'skipped': 0, 'batches': 0}
+    self.cidr_changed = False
+    # the attr upserts conflict on ux_attr_name_attr (2.2.16): a database loaded before has none, and maybe the duplicates it forbids
+    indexes = inspect(self.engine).get_indexes(BlockAttr.__tablename__)
+    if not any(index['unique'] and index['column_names'] == ['name', 'attr'] for index in indexes):
+      raise NrtmError("attr has no unique index on (name, attr), the database was loaded before 2.2.16: reload it with create_db.py --reset_db")
+
+  # the last serial applied, None before the first run
+  def serial(self):
+    with self.engine.connect() as conn:
+      return conn.execute(select(BlockNrtmState.serial).where(BlockNrtmState.source == self.source)).scalar()
+
+  # updates: read_updates() output; start: the last serial already in the tables, nrtm_state by default; returns the last serial
+  def apply(self, updates, start=None):
+    current = self.serial() if start is None else start
+    pending = []
+    for op, serial, block in updates:
+      if current is not None and serial <= current:
+        self.counts['skipped'] += 1
+        continue
+      if current is not None and serial != current + 1:
+        logger.warning(f"serial gap: {current} then {serial}")
+      pending.append((op, serial, block))
+      current = serial
+      if len(pending) >= self.batch:
+        self.commit(pending)
+        pending = []
+    if pending:
+      self.commit(pending)
+    return current
+
+  # one transaction: the updates in serial order, then their last serial
+  def commit(self, updates):
+    dirty = set()
+    with self.engine.begin() as conn:
+      for op, serial, block in updates:
+        rows = self.adapter.parse(block + self.source_line)
+        if rows is None:
+          self.counts['ignored'] += 1
+          continue
+        if op == 'ADD':
+          self.add(conn, rows)
+        else:
+          self.delete(conn, rows)
+        self.counts[op] += 1
+        dirty.update(row['autnum'] for row in rows['cidr'] if row['autnum'])
+        self.cidr_changed = self.cidr_changed or bool(rows['cidr'])
+      if dirty:
+        conn.execute(insert(BlockAsnDirty).values([{'autnum': autnum} for autnum in sorted(dirty)]).on_conflict_do_nothing())
+      now = datetime.now(timezone.utc).replace(tzinfo=None)
+      stmt = insert(BlockNrtmState).values(source=self.source, serial=updates[-1][1], updated=now)
+      conn.execute(stmt.on_conflict_do_update(index_elements=['source'], set_={'serial': stmt.excluded.serial, 'updated': stmt.excluded.updated}))
+      stmt = insert(BlockMeta).values(key='updated', value=f"{self.source}:{updates[-1][1]}")
+      conn.execute(stmt.on_conflict_do_update(index_elements=['key'], set_={'value': stmt.excluded.value}))
+    self.counts['batches'] += 1
+    logger.debug(f"serials {updates[0][1]}-{updates[-1][1]} applied")
+
+  def add(self, conn, rows):
+    for model, keys, table_rows in ((BlockCidr, ['inetnum', 'autnum'], rows['cidr']), (BlockAttr, ['name', 'attr'], rows['attr']),
+                                    (BlockMember, ['idd'], rows['member'])):
+      if table_rows:
+        stmt = insert(model).values(table_rows)
+        columns = [column for column in table_rows[0] if column not in keys]
+        conn.execute(stmt.on_conflict_do_update(index_elements=keys, set_={column: stmt.excluded[column] for column in columns}))
+    # a set is one object per name: its members and maintainers are replaced. A netname is shared by many inetnums,
+    # their parent rows are only added (the next import drops the stale ones)
+    # the child side: only the object's own mnt-by/org rows, the membership edges of the sets it is in are theirs
+    for row in rows['attr']:
+      conn.execute(delete(BlockParent).where(or_(
+        and_(BlockParent.parent == row['name'], BlockParent.parent_type == row['attr']),
+        and_(BlockParent.child == row['name'], BlockParent.child_type == row['attr'], BlockParent.parent_type.in_(['mntner', 'organisation'])))))
+    if rows['parent']:
+      conn.execute(insert(BlockParent).values(rows['parent']).on_conflict_do_nothing())
+
+  def delete(self, conn, rows):
+    if rows['cidr']:
+      conn.execute(delete(BlockCidr).where(tuple_(BlockCidr.inetnum, BlockCidr.autnum).in_([(row['inetnum'], row['autnum']) for row in rows['cidr']])))
+      for netname, attr in {(row['netname'], row['attr']) for row in rows['cidr']}:
+        if conn.execute(select(BlockCidr.inetnum).where(BlockCidr.netname == netname).limit(1)).first() is None:
+          conn.execute(delete(BlockParent).where(or_(
+            and_(BlockParent.child == netname, BlockParent.child_type == attr, BlockParent.parent_type.in_(['mntner', 'organisation'])),
+            and_(BlockParent.parent == netname, BlockParent.parent_type == attr, BlockParent.child_type == 'e-mail'))))
+    for row in rows['attr']:
+      conn.execute(delete(BlockAttr).where(BlockAttr.name == row['name'], BlockAttr.attr == row['attr']))
+      conn.execute(delete(BlockParent).where(or_(
+        and_(BlockParent.parent == row['name'], BlockParent.parent_type == row['attr']),
+        and_(BlockParent.child == row['name'], BlockParent.child_type == row['attr'], BlockParent.parent_type.in_(['mntner', 'organisation'])))))
+    if rows['member']:
+      conn.execute(delete(BlockMember).where(BlockMember.idd.in_([row['idd'] for row in rows['member']])))
+
+
+# the journal of a mock mirror: count updates of synthetic inetnum/route objects from serial 1, a third of them
+# modifications or deletions of the objects added before
+def mock_journal(source='RIPE', count=1000, seed=42):
+  rng = random.Random(seed)
+  objects = []
+  lines = []
+  for serial in range(1, count + 1):
+    pick = rng.random()
+    if objects and pick < 0.15:
+      op, text = 'DEL', objects.pop(rng.randrange(len(objects)))
+    elif objects and pick < 0.33:
+      # a modification is the new version of the object, sent as ADD
+      index = rng.randrange(len(objects))
+      text = objects[index] = re.sub(r'descr:( +).*', f"descr:\\1modified at serial {serial}", objects[index])
+      op = 'ADD'
+    else:
+      net = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+      if rng.random() < 0.6:
+        text = (f"inetnum:        {net}.0 - {net}.255\nnetname:        MOCK-{serial}\ndescr:          mock customer {serial}\ncountry:        NL\n"
+                f"admin-c:        MOCK1-{source}\nstatus:         ASSIGNED PA\nmnt-by:         MOCK-MNT\nsource:         {source}\n")
+      else:
+        text = (f"route:          {net}.0/24\ndescr:          mock route {serial}\norigin:         AS{rng.randint(64496, 64511)}\n"
+                f"mnt-by:         MOCK-MNT\nsource:         {source}\n")
+      objects.append(text)
+      op = 'ADD'
+    lines.append(f"{op} {serial}\n\n{text}\n")
+  return ''.join(lines).encode('utf-8')
+
+
+# a local NRTM server answering -g SOURCE:3:first-last from a journal, for tests and demos (nrtm.py --mock)
+class MockMirror(object):
+  def __init__(self, journal: bytes, source='RIPE', host='127.0.0.1', port=0):
+    self.source = source.upper()
+    self.updates = list(read_updates(journal.splitlines(keepends=True)))
+    mirror = self
+
+    class Handler(socketserver.StreamRequestHandler):
+      def handle(self):
+        self.wfile.write(mirror.answer(self.rfile.readline().decode('utf-8', 'replace').strip()))
+
+    self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+    self.server.daemon_threads = True
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+  @property
+  def address(self):
+    return self.server.server_address
+
+  def start(self):
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def answer(self, query):
+    match = QUERY_RE.match(query)
+    if not match:
+      return b"%ERROR:405: no flags or query\n"
+    source, version, first, last = match.groups()
+    if source.upper() != self.source:
+      return f"%ERROR:403: unknown source {source}\n".encode('utf-8')
+    low, high = (self.updates[0][1], self.updates[-1][1]) if self.updates else (0, 0)
+    first, last = int(first), high if last == 'LAST' else int(last)
+    if not low <= first <= last <= high:
+      return f"%ERROR:401: invalid range: Not within {low}-{high}\n".encode('utf-8')
+    body = [f"%START Version: {version} {self.source} {first}-{last}\n\n".encode('utf-8')]
+    for op, serial, block in self.updates:
+      if first <= serial <= last:
+        body.append(f"{op} {serial}\n\n".encode('utf-8') + block + b"\n")
+    body.append(f"%END {self.source}\n".encode('utf-8'))
+    return b''.join(body)
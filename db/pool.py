@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from db.lookup import get_dsn
+
+# Connection pool of the lookup services (whois_server.py, http_server.py), the async counterpart of the engines of db/helper.
+# The lookups are a handful of fixed statements: prepare_threshold=0 prepares them server-side on their first execution
+# on each connection, the following executions skip parsing and planning. Use None behind pgbouncer in transaction mode.
+POOL_MIN = 2
+POOL_MAX = 20
+PREPARE_THRESHOLD = 0
+# seconds a caller waits for a free connection before PoolTimeout
+POOL_TIMEOUT = 10
+# connections are recycled after this many seconds to release the server-side memory of the prepared statements
+MAX_LIFETIME = 3600
+
+
+async def configure(conn):
+  conn.prepare_threshold = PREPARE_THRESHOLD
+
+
+def create_lookup_pool(connection_string, min_size=POOL_MIN, max_size=POOL_MAX):
+  return AsyncConnectionPool(get_dsn(connection_string), min_size=min_size, max_size=max_size, open=False,
+                             timeout=POOL_TIMEOUT, max_lifetime=MAX_LIFETIME, configure=configure,
+                             kwargs={'autocommit': True, 'row_factory': dict_row})
+
+
+# get_stats() counters plus the average wait for a connection: requests_wait_ms is the total over requests_num
+def pool_stats(pool):
+  stats = pool.get_stats()
+  requests = stats.get('requests_num', 0)
+  stats['wait_ms_avg'] = round(stats.get('requests_wait_ms', 0) / requests, 3) if requests else 0.0
+  return stats
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import cProfile
+import io
+import os
+import pstats
+import time
+
+# Opt-in instrumentation of the loader (create_db.py --stage_times / --profile).
+# parse_blocks() interleaves regex parsing, CIDR math, ORM objects, flushes, selects and commits: a StageTimer charges the
+# wall time between two lap() calls to a stage, so the stages of a worker add up to its run time.
+# Each worker sends its totals back to main() through a queue; with --profile it also dumps a cProfile file, merged at the end.
+STAGES = ('read', 'queue', 'tokenize', 'cidr-convert', 'dedup-check', 'insert', 'commit', 'export')
+PROFILE_TOP = 25
+
+
+class StageTimer(object):
+  def __init__(self, enabled=False):
+    self.enabled = enabled
+    self.seconds = {}
+    self.counts = {}
+    self.last = time.perf_counter()
+
+  # charge the time since the previous lap to stage
+  def lap(self, stage):
+    if not self.enabled:
+      return
+    now = time.perf_counter()
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + now - self.last
+    self.counts[stage] = self.counts.get(stage, 0) + 1
+    self.last = now
+
+  # restart the clock without charging anything
+  def reset(self):
+    self.last = time.perf_counter()
+
+  def add(self, stage, seconds, count=1):
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+    self.counts[stage] = self.counts.get(stage, 0) + count
+
+  def merge(self, result):
+    for stage, seconds in result['seconds'].items():
+      self.add(stage, seconds, result['counts'].get(stage, 0))
+
+  def result(self):
+    return {'pid': os.getpid(), 'seconds': dict(self.seconds), 'counts': dict(self.counts)}
+
+  # one line per stage: cumulative seconds over all workers, share, calls
+  def summary(self):
+    total = sum(self.seconds.values()) or 1e-9
+    stages = [stage for stage in STAGES if stage in self.seconds] + sorted(set(self.seconds) - set(STAGES))
+    lines = [f"{'stage':14} {'seconds':>10} {'share':>7} {'calls':>10}"]
+    for stage in stages:
+      lines.append(f"{stage:14} {self.seconds[stage]:10.2f} {100 * self.seconds[stage] / total:6.1f}% {self.counts.get(stage, 0):10}")
+    return '\n'.join(lines)
+
+
+# one cProfile file per worker process and dump file
+def start_profile():
+  profiler = cProfile.Profile()
+  profiler.enable()
+  return profiler
+
+
+def stop_profile(profiler, directory, name):
+  profiler.disable()
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, f"{name}-{os.getpid()}.prof")
+  profiler.dump_stats(path)
+  return path
+
+
+# the top functions by cumulative time over all the worker profiles
+def merge_profiles(paths, limit=PROFILE_TOP):
+  if not paths:
+    return ''
+  stream = io.StringIO()
+  stats = pstats.Stats(*paths, stream=stream)
+  stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+  return stream.getvalue()
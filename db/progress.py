@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import time
+from multiprocessing.sharedctypes import RawArray
+
+# Loader progress without locks (create_db.py).
+# CounterShared took a Lock for every block of every worker, and again for each value() read: the workers serialized on it.
+# Here each worker owns one slot of FIELDS counters in a single shared array and is the only process writing it:
+# a plain aligned 64-bit store, no lock, no lost update. Only the main process reads, it sums the slots and computes
+# the rates and the ETA; a sum a few blocks behind the workers is fine for a progress line.
+FIELDS = ('blocks', 'skipped', 'dupes', 'inserts', 'parents', 'commits', 'rows')
+REPORT_SECONDS = 10
+
+
+class Progress(object):
+  def __init__(self, workers, total=0):
+    self.workers = workers
+    self.total = total
+    self.counters = RawArray('q', workers * len(FIELDS))
+    self.start = time.time()
+    self.last = (self.start, 0)
+
+  # worker side: the absolute values of its own counters, in FIELDS order
+  def update(self, worker, *values):
+    base = worker * len(FIELDS)
+    for offset, value in enumerate(values):
+      self.counters[base + offset] = value
+
+  # main side from here
+  def slots(self):
+    values = self.counters[:]
+    width = len(FIELDS)
+    return [dict(zip(FIELDS, values[base:base + width])) for base in range(0, len(values), width)]
+
+  def totals(self):
+    slots = self.slots()
+    return {field: sum(slot[field] for slot in slots) for field in FIELDS}
+
+  # blocks done (parsed or skipped), percent, overall and recent rates, ETA at the recent rate, commits/s and rows per commit,
+  # slowest/fastest worker
+  def report(self):
+    now = time.time()
+    slots = self.slots()
+    done = sum(slot['blocks'] + slot['skipped'] for slot in slots)
+    inserts = sum(slot['inserts'] for slot in slots)
+    parents = sum(slot['parents'] for slot in slots)
+    seconds = max(now - self.start, 1e-9)
+    rate = done / seconds
+    last_time, last_done = self.last
+    recent = (done - last_done) / max(now - last_time, 1e-9)
+    self.last = (now, done)
+    percent = min(100, done * 100 / self.total) if self.total else 100
+    left = max(self.total - done, 0)
+    eta = f"{round(left / recent)} s" if recent else ('0 s' if not left else '?')
+    commits = sum(slot['commits'] for slot in slots)
+    rows = sum(slot['rows'] for slot in slots)
+    per_worker = [slot['blocks'] + slot['skipped'] for slot in slots]
+    return (f"{done}/{self.total} blocks {percent:.0f}% done, {rate:.0f} blocks/s ({recent:.0f} now), ETA {eta}, "
+            f"{inserts}/{parents} inserts/p ({inserts / seconds:.0f}/{parents / seconds:.0f} inserts/p/s), "
+            f"{commits} commits ({commits / seconds:.1f}/s, {rows / commits if commits else 0:.0f} rows/commit), "
+            f"workers {min(per_worker)}..{max(per_worker)} blocks")
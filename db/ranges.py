@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+from sqlalchemy import select, delete
+
+from db.helper import create_postgres_pool
+from db.intervals import flatten, containment, prefix_intervals
+from db.model import BlockCidr, BlockRange, BlockParent
+
+# Post-import stage: flatten the prefix hierarchy of the cidr table into the cidr_range table.
+# 8.8.8.8 used to match five nested cidr rows sorted by masklen; the range probe returns one row
+# naming the most specific prefix and its ancestors.
+# v2.2.10: the same sweep gives the prefix tree, stored as parent rows of type cidr -> cidr (direct parent only),
+# sub-allocations and upstream allocations become indexed lookups on the parent table instead of self-joins on inet.
+PARENT_TYPE = 'cidr'
+
+
+# "schema"."table", or "table" for the live schema
+def qualified(table, schema):
+  return f'"{schema}"."{table}"' if schema else f'"{table}"'
+
+
+# rebuild cidr_range from cidr in one transaction, readers keep the previous ranges until it commits; returns the number of ranges
+def build_ranges(connection_string, schema=None):
+  engine = create_postgres_pool(connection_string, schema)
+  table = qualified(BlockRange.__tablename__, schema)
+  ranges = 0
+  with engine.begin() as conn:
+    prefixes = conn.execute(select(BlockCidr.inetnum).distinct()).scalars().all()
+    intervals, distinct = prefix_intervals(prefixes)
+    conn.execute(delete(BlockRange))
+    # COPY on the psycopg connection of the same transaction: millions of rows, the ORM would be the bottleneck
+    cursor = conn.connection.driver_connection.cursor()
+    with cursor.copy(f"COPY {table} (family, start_ip, end_ip, inetnum, ancestors) FROM STDIN") as copy:
+      for family in (4, 6):
+        for start, end, owner, ancestors in flatten(intervals[family]):
+          copy.write_row((family, start, end, distinct[owner], [distinct[a] for a in ancestors]))
+          ranges += 1
+  return ranges
+
+
+# rebuild the cidr -> cidr parent rows from cidr in one transaction; returns the number of edges
+def build_tree(connection_string, schema=None):
+  engine = create_postgres_pool(connection_string, schema)
+  table = qualified(BlockParent.__tablename__, schema)
+  edges = 0
+  with engine.begin() as conn:
+    prefixes = conn.execute(select(BlockCidr.inetnum).distinct()).scalars().all()
+    intervals, distinct = prefix_intervals(prefixes)
+    conn.execute(delete(BlockParent).where(BlockParent.parent_type == PARENT_TYPE, BlockParent.child_type == PARENT_TYPE))
+    cursor = conn.connection.driver_connection.cursor()
+    with cursor.copy(f"COPY {table} (parent, parent_type, child, child_type) FROM STDIN") as copy:
+      for family in (4, 6):
+        for owner, parent in containment(intervals[family]):
+          if parent is not None:
+            copy.write_row((distinct[parent], PARENT_TYPE, distinct[owner], PARENT_TYPE))
+            edges += 1
+  return edges
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import ipaddress
+
+# RDAP-shaped (RFC 9083) JSON built from the rows returned by db.lookup.
+# Not a full RDAP server: no redirects to the authoritative RIR and no links, but the field names match
+# so that RDAP clients and parsers can read the responses.
+
+CONFORMANCE = ['rdap_level_0', 'cidr0']
+# parent_type -> RDAP entity role
+ENTITY_ROLES = {'mntner': 'registrant', 'organisation': 'registrant', 'route-set': 'member'}
+
+
+def events(row):
+  result = []
+  if row.get('created'):
+    result.append({'eventAction': 'registration', 'eventDate': row['created'].isoformat() + 'Z'})
+  if row.get('last_modified'):
+    result.append({'eventAction': 'last changed', 'eventDate': row['last_modified'].isoformat() + 'Z'})
+  return result
+
+
+def remarks(row):
+  result = []
+  if row.get('description'):
+    result.append({'title': 'description', 'description': [row['description']]})
+  if row.get('remarks'):
+    result.append({'title': 'remarks', 'description': [row['remarks']]})
+  return result
+
+
+def entities(parents):
+  result = {}
+  for parent_type, parent in parents:
+    entity = result.setdefault(parent, {'objectClassName': 'entity', 'handle': parent, 'roles': []})
+    role = ENTITY_ROLES.get(parent_type, parent_type)
+    if role not in entity['roles']:
+      entity['roles'].append(role)
+  return list(result.values())
+
+
+# all the rows share the same prefix (several sources or origins): the inetnum row wins over the route rows,
+# the route origins are listed like ARIN's originas0 extension does
+def ip_network(rows, less_specific=()):
+  main = next((row for row in rows if row['attr'] != 'route'), rows[0])
+  network = ipaddress.ip_network(main['inetnum'], strict=False)
+  parents = []
+  for row in rows:
+    parents += row.get('parents', [])
+  result = {
+    'rdapConformance': CONFORMANCE,
+    'objectClassName': 'ip network',
+    'handle': main['inetnum'],
+    'name': main['netname'],
+    'startAddress': str(network.network_address),
+    'endAddress': str(network.broadcast_address),
+    'ipVersion': f"v{network.version}",
+    'type': main['status'],
+    'country': main['country'],
+    'cidr0_cidrs': [{f"v{network.version}prefix": str(network.network_address), 'length': network.prefixlen}],
+    'arin_originas0_originautnums': sorted({row['autnum'] for row in rows if row['autnum']}),
+    'events': events(main),
+    'remarks': remarks(main),
+    'entities': entities(parents),
+    'port43': (main['source'] or '').lower(),
+  }
+  # less_specific: the covering rows of the shorter prefixes, most specific first
+  if less_specific:
+    result['parentHandle'] = less_specific[0]['inetnum']
+  return result
+
+
+def autnum(asn, objects, routes):
+  number = int(asn[2:])
+  main = objects[0] if objects else {}
+  return {
+    'rdapConformance': CONFORMANCE,
+    'objectClassName': 'autnum',
+    'handle': asn,
+    'startAutnum': number,
+    'endAutnum': number,
+    'name': main.get('name', asn),
+    'remarks': remarks(main),
+    'networks': [{'objectClassName': 'ip network', 'handle': row['inetnum'], 'name': row['netname'], 'port43': (row['source'] or '').lower()} for row in routes],
+  }
+
+
+def entity(handle, members, objects, children):
+  main = (members + objects)[0] if members or objects else {}
+  return {
+    'rdapConformance': CONFORMANCE,
+    'objectClassName': 'entity',
+    'handle': main.get('idd') or main.get('name') or handle,
+    'vcardArray': ['vcard', [['version', {}, 'text', '4.0'], ['fn', {}, 'text', main.get('name', handle)], ['kind', {}, 'text', main.get('attr', 'org')]]],
+    'roles': sorted({ENTITY_ROLES.get(row['parent_type'], row['parent_type']) for row in children}),
+    'remarks': remarks(main),
+    'networks': [{'objectClassName': 'ip network', 'handle': row['child'], 'type': row['child_type']} for row in children if row['child_type'] in ('inetnum', 'route')],
+  }
+
+
+def error(code, title, description=None):
+  result = {'rdapConformance': CONFORMANCE, 'errorCode': code, 'title': title}
+  if description:
+    result['description'] = [description]
+  return result
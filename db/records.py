@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import sys
+from array import array
+
+# Read-only cidr records held in memory by the lookup side (query.py snapshots, bench_records.py).
+# A BlockCidr instance carries its SQLAlchemy instance state and instrumented attributes, a dict row its hash table:
+# a few hundred bytes per row before the strings, times millions of prefixes. The store keeps columns instead:
+#   inetnum, netname         one bytes blob per column + offsets; netnames repeat a lot and are stored once,
+#                            the prefixes are nearly all distinct and not deduplicated (the dedup dict would double the peak)
+#   attr, country, source,   a uint16 code per row into a small table of interned strings
+#   status
+#   autnum                   int64, AS15169 -> 15169, -1 for none
+# The descr/remarks texts stay in the database. A Record (__slots__, no __dict__) is built per row read.
+FIELDS = ('inetnum', 'autnum', 'attr', 'netname', 'country', 'status', 'source')
+NONE_ID = 0xFFFFFFFF
+
+
+class Record(object):
+  __slots__ = FIELDS
+
+  def __init__(self, inetnum, autnum, attr, netname, country, status, source):
+    self.inetnum = inetnum
+    self.autnum = autnum
+    self.attr = attr
+    self.netname = netname
+    self.country = country
+    self.status = status
+    self.source = source
+
+  def as_dict(self):
+    return {field: getattr(self, field) for field in FIELDS}
+
+  def __repr__(self):
+    return f"Record({', '.join(f'{field}={getattr(self, field)!r}' for field in FIELDS)})"
+
+
+# str column: row -> value id (uint32), value id -> offset in the blob.
+# dedupe: equal values stored once; without it the value id is the row and None reads back as ''
+class StringColumn(object):
+  def __init__(self, dedupe=True):
+    self.dedupe = dedupe
+    self.ids = array('I')
+    self.offsets = array('Q', [0])
+    self.blob = bytearray()
+    # value -> id while appending, dropped by freeze()
+    self.index = {} if dedupe else None
+
+  def append(self, value):
+    if not self.dedupe:
+      self.blob += (value or '').encode('utf-8')
+      self.offsets.append(len(self.blob))
+      return
+    if value is None:
+      self.ids.append(NONE_ID)
+      return
+    value_id = self.index.get(value)
+    if value_id is None:
+      value_id = self.index[value] = len(self.offsets) - 1
+      self.blob += value.encode('utf-8')
+      self.offsets.append(len(self.blob))
+    self.ids.append(value_id)
+
+  # the blob stays a bytearray: bytes() would copy it, twice the column at the peak
+  def freeze(self):
+    self.index = None
+
+  def __getitem__(self, row):
+    value_id = self.ids[row] if self.dedupe else row
+    if value_id == NONE_ID:
+      return None
+    return self.blob[self.offsets[value_id]:self.offsets[value_id + 1]].decode('utf-8')
+
+  def nbytes(self):
+    return self.ids.itemsize * len(self.ids) + self.offsets.itemsize * len(self.offsets) + len(self.blob)
+
+
+# few distinct values: row -> uint16 code, code -> interned str, code 0 = None
+class CodedColumn(object):
+  def __init__(self):
+    self.codes = array('H')
+    self.values = [None]
+    self.index = {None: 0}
+
+  def append(self, value):
+    code = self.index.get(value)
+    if code is None:
+      code = self.index[value] = len(self.values)
+      self.values.append(sys.intern(value))
+    self.codes.append(code)
+
+  def __getitem__(self, row):
+    return self.values[self.codes[row]]
+
+  def nbytes(self):
+    return self.codes.itemsize * len(self.codes)
+
+
+class RecordStore(object):
+  def __init__(self):
+    self.inetnum = StringColumn(dedupe=False)
+    self.netname = StringColumn()
+    self.autnum = array('q')
+    self.attr = CodedColumn()
+    self.country = CodedColumn()
+    self.status = CodedColumn()
+    self.source = CodedColumn()
+
+  # rows: dicts with the FIELDS keys (cidr rows, parse_block() output..), missing keys are None
+  @classmethod
+  def from_rows(cls, rows):
+    store = cls()
+    for row in rows:
+      store.append(row)
+    store.freeze()
+    return store
+
+  def append(self, row):
+    self.inetnum.append(row.get('inetnum'))
+    self.netname.append(row.get('netname'))
+    autnum = row.get('autnum')
+    self.autnum.append(int(autnum[2:]) if autnum and autnum[:2].upper() == 'AS' and autnum[2:].isdigit() else -1)
+    self.attr.append(row.get('attr'))
+    self.country.append(row.get('country'))
+    self.status.append(row.get('status'))
+    self.source.append(row.get('source'))
+
+  # no more appends, the build-time dedup tables are released
+  def freeze(self):
+    self.inetnum.freeze()
+    self.netname.freeze()
+
+  def __len__(self):
+    return len(self.autnum)
+
+  def __getitem__(self, row):
+    autnum = self.autnum[row]
+    return Record(self.inetnum[row], f"AS{autnum}" if autnum >= 0 else None, self.attr[row], self.netname[row],
+                  self.country[row], self.status[row], self.source[row])
+
+  # bytes held by the columns, the small code tables aside
+  def nbytes(self):
+    return (self.inetnum.nbytes() + self.netname.nbytes() + self.autnum.itemsize * len(self.autnum)
+            + sum(column.nbytes() for column in (self.attr, self.country, self.status, self.source)))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import base64
+import binascii
+import json
+
+# Full-text search over the loaded objects: "all the netranges of a company".
+# websearch_to_tsquery() takes what people type ("acme corp", "acme -telecom", '"acme networks"') and is matched against:
+#   cidr.description   english tsvector, ix_cidr_description
+#   cidr.netname       simple tsvector (no stemming of handles), ix_cidr_netname_tsv
+#   mnt-by/org handles simple tsvector of parent.parent, partial ix_parent_parent_tsv
+#   member.description english tsvector of the maintainers/organisations, ix_member_description
+# Matching netnames are grouped by owner (their organisation, else their maintainer, else the netname itself),
+# a group ranks as its best match and carries its prefixes.
+# Pages follow a keyset cursor (rank, owner) of the last group returned: no OFFSET, page 50 costs what page 1 does.
+LIMIT = 20
+MAX_LIMIT = 100
+PREFIX_LIMIT = 1000
+# a query word found in the netname or a handle says more than in a free-form description
+NETNAME_WEIGHT = 2
+HANDLE_WEIGHT = 2
+
+SEARCH_SQL = f"""
+WITH q AS (SELECT websearch_to_tsquery('english', %(q)s) AS en, websearch_to_tsquery('simple', %(q)s) AS si),
+hits AS (
+  SELECT c.netname, ts_rank(to_tsvector('english', c.description), q.en) AS rank
+    FROM cidr c, q WHERE to_tsvector('english', c.description) @@ q.en
+  UNION ALL
+  SELECT c.netname, ts_rank(to_tsvector('simple', c.netname), q.si) * {NETNAME_WEIGHT}::real
+    FROM cidr c, q WHERE to_tsvector('simple', c.netname) @@ q.si
+  UNION ALL
+  SELECT p.child, ts_rank(to_tsvector('simple', p.parent), q.si) * {HANDLE_WEIGHT}::real
+    FROM parent p, q WHERE to_tsvector('simple', p.parent) @@ q.si AND p.parent_type IN ('mntner', 'organisation') AND p.child_type IN ('inetnum', 'route')
+  UNION ALL
+  SELECT p.child, ts_rank(to_tsvector('english', m.description), q.en)
+    FROM member m JOIN parent p ON p.parent = m.idd AND p.parent_type = m.attr, q
+    WHERE to_tsvector('english', m.description) @@ q.en AND m.attr IN ('mntner', 'organisation') AND p.child_type IN ('inetnum', 'route')
+),
+scored AS (SELECT netname, max(rank) AS rank FROM hits WHERE netname IS NOT NULL GROUP BY netname),
+owned AS (
+  SELECT coalesce(
+      (SELECT min(parent) FROM parent WHERE child = s.netname AND parent_type = 'organisation'),
+      (SELECT min(parent) FROM parent WHERE child = s.netname AND parent_type = 'mntner'),
+      s.netname) AS owner,
+    s.netname, s.rank
+  FROM scored s
+),
+groups AS (SELECT owner, max(rank) AS rank, array_agg(netname ORDER BY netname) AS netnames FROM owned GROUP BY owner)
+SELECT g.owner, m.name AS owner_name, g.rank, g.netnames, p.prefixes, p.prefix_count
+FROM groups g
+LEFT JOIN member m ON m.idd = g.owner
+CROSS JOIN LATERAL (
+  SELECT (array_agg(inetnum ORDER BY inetnum::inet))[1:{PREFIX_LIMIT}] AS prefixes, count(*) AS prefix_count
+  FROM (SELECT DISTINCT inetnum FROM cidr WHERE netname = ANY(g.netnames)) d
+) p
+WHERE %(rank)s::real IS NULL OR g.rank < %(rank)s::real OR (g.rank = %(rank)s::real AND g.owner > %(owner)s)
+ORDER BY g.rank DESC, g.owner
+LIMIT %(limit)s
+"""
+
+
+class CursorError(ValueError):
+  pass
+
+
+# (rank, owner) of the last group of a page <-> opaque url-safe string
+def encode_cursor(rank, owner):
+  return base64.urlsafe_b64encode(json.dumps([rank, owner]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+  try:
+    rank, owner = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return float(rank), str(owner)
+  except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+    raise CursorError(f"invalid cursor {cursor!r}")
+
+
+# conn: psycopg AsyncConnection with a dict_row row factory.
+# Returns (groups, next cursor or None): groups = [{owner, owner_name, rank, netnames, prefixes, prefix_count}]
+async def search(conn, query: str, limit=LIMIT, cursor=None):
+  limit = max(1, min(int(limit), MAX_LIMIT))
+  rank, owner = decode_cursor(cursor) if cursor else (None, None)
+  # one more than asked tells whether there is a next page
+  cur = await conn.execute(SEARCH_SQL, {'q': query, 'rank': rank, 'owner': owner, 'limit': limit + 1})
+  groups = await cur.fetchall()
+  next_cursor = None
+  if len(groups) > limit:
+    groups = groups[:limit]
+    next_cursor = encode_cursor(groups[-1]['rank'], groups[-1]['owner'])
+  return groups, next_cursor
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import ipaddress
+import re
+
+from psycopg.errors import UndefinedTable
+
+from db.lookup import get_import_stamp
+
+# Recursive as-set/route-set expansion, what bgpq4 asks the IRR servers for: AS-FOO -> every ASN and prefix below it.
+# The loader stores each set member as a parent row (set -> member, child_type aut-num/as-set/route-set/route).
+# One recursive CTE fetches the membership graph reachable from the set, the expansion is then done in memory:
+#   - the sets of a cycle (AS-A members AS-B members AS-A) all expand to the same thing: the graph is collapsed
+#     into strongly connected components (Tarjan) and each component is expanded once, the cycles are reported
+#   - every set expanded is memoized until the next import: AS-HURRICANE reuses the customer sets expanded before,
+#     and the recursive query stops at them
+# Prefixes: the route members, plus the prefixes originated by the ASNs (asn table, 2.2.12), like bgpq4 does for as-sets.
+SET_TYPES = ('as-set', 'route-set')
+ASN_RE = re.compile(r'^AS(\d+)$')
+
+GRAPH_SQL = """
+WITH RECURSIVE reach(name) AS (
+  SELECT unnest(%(roots)s::text[])
+  UNION
+  SELECT p.child FROM parent p JOIN reach r ON p.parent = r.name
+  WHERE p.parent_type IN ('as-set', 'route-set') AND p.child_type IN ('as-set', 'route-set') AND p.child <> ALL(%(known)s::text[])
+)
+SELECT p.parent, p.child, p.child_type FROM parent p JOIN reach r ON p.parent = r.name
+WHERE p.parent_type IN ('as-set', 'route-set')
+"""
+
+
+def asn_key(asn):
+  match = ASN_RE.match(asn)
+  return int(match.group(1)) if match else -1
+
+
+# 192.0.2.0/24^+ sorts as 192.0.2.0/24
+def prefix_key(prefix):
+  try:
+    network = ipaddress.ip_network(prefix.split('^')[0], strict=False)
+  except ValueError:
+    return (0, 0, 0, prefix)
+  return (network.version, int(network.network_address), network.prefixlen, prefix)
+
+
+# strongly connected components of graph {node: [nodes]}, each one listed after the components it reaches.
+# Iterative Tarjan: set graphs are deep enough to hit the recursion limit.
+def components(graph, roots):
+  index = {}
+  low = {}
+  stack = []
+  on_stack = set()
+  result = []
+  counter = 0
+  for root in roots:
+    if root in index:
+      continue
+    work = [(root, iter(graph.get(root, ())))]
+    index[root] = low[root] = counter
+    counter += 1
+    stack.append(root)
+    on_stack.add(root)
+    while work:
+      node, children = work[-1]
+      for child in children:
+        if child not in index:
+          index[child] = low[child] = counter
+          counter += 1
+          stack.append(child)
+          on_stack.add(child)
+          work.append((child, iter(graph.get(child, ()))))
+          break
+        if child in on_stack:
+          low[node] = min(low[node], index[child])
+      else:
+        work.pop()
+        if work:
+          low[work[-1][0]] = min(low[work[-1][0]], low[node])
+        if low[node] == index[node]:
+          component = []
+          while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            component.append(member)
+            if member == node:
+              break
+          result.append(component)
+  return result
+
+
+class SetExpander(object):
+  def __init__(self):
+    # set -> (frozenset of ASNs, frozenset of route members), valid for one data stamp (import or NRTM batch)
+    self.memo = {}
+    self.results = {}
+    self.stamp = None
+    self.queries = 0
+    self.hits = 0
+
+  # a new import or NRTM batch invalidates everything expanded so far
+  async def check_stamp(self, conn):
+    stamp = await get_import_stamp(conn)
+    if stamp != self.stamp:
+      self.memo.clear()
+      self.results.clear()
+      self.stamp = stamp
+
+  # conn: psycopg AsyncConnection with a dict_row row factory.
+  # Returns {name, asns, prefixes, sets, cycles, missing}: asns sorted by number, prefixes by address,
+  # cycles = the sets found in membership cycles, missing = the sets referenced but not in the database,
+  # both among the sets expanded by this call: the ones memoized by earlier expansions are not looked at again
+  async def expand(self, conn, name: str):
+    name = name.strip().upper()
+    self.queries += 1
+    await self.check_stamp(conn)
+    if name in self.results:
+      self.hits += 1
+      return self.results[name]
+    cycles, missing, expanded = await self.expand_sets(conn, [name])
+    asns, routes = self.memo[name]
+    prefixes = set(routes)
+    prefixes.update(await self.originated(conn, asns))
+    result = {
+      'name': name,
+      'asns': sorted(asns, key=asn_key),
+      'prefixes': sorted(prefixes, key=prefix_key),
+      'sets': expanded,
+      'cycles': cycles,
+      'missing': missing,
+    }
+    self.results[name] = result
+    return result
+
+  # fills self.memo for the roots and every set below them; returns (cycles, missing sets, sets expanded by this call)
+  async def expand_sets(self, conn, roots):
+    roots = [root for root in roots if root not in self.memo]
+    if not roots:
+      return [], [], 0
+    cur = await conn.execute(GRAPH_SQL, {'roots': roots, 'known': list(self.memo)})
+    graph = {}
+    direct = {}
+    for row in await cur.fetchall():
+      if row['child_type'] in SET_TYPES:
+        graph.setdefault(row['parent'], []).append(row['child'])
+      else:
+        direct.setdefault(row['parent'], []).append((row['child_type'], row['child']))
+    nodes = set(roots) | set(graph) | set(direct)
+    nodes.update(child for children in graph.values() for child in children)
+    nodes.difference_update(self.memo)
+    missing = []
+    if nodes:
+      cur = await conn.execute("SELECT name FROM attr WHERE name = ANY(%s) AND attr IN ('as-set', 'route-set')", (list(nodes),))
+      missing = sorted(nodes - {row['name'] for row in await cur.fetchall()})
+    # the memoized sets are leaves here, their edges were not fetched
+    walk = {parent: [child for child in children if child not in self.memo] for parent, children in graph.items()}
+    cycles = []
+    for component in components(walk, sorted(nodes)):
+      members = set(component)
+      if len(component) > 1 or component[0] in graph.get(component[0], ()):
+        cycles.append(sorted(component))
+      asns = set()
+      routes = set()
+      for member in component:
+        for child_type, child in direct.get(member, ()):
+          (asns if child_type == 'aut-num' else routes).add(child)
+        for child in graph.get(member, ()):
+          if child not in members:
+            child_asns, child_routes = self.memo[child]
+            asns |= child_asns
+            routes |= child_routes
+      value = (frozenset(asns), frozenset(routes))
+      for member in component:
+        self.memo[member] = value
+    return cycles, missing, len(nodes)
+
+  # prefixes originated by the ASNs, from the per-ASN aggregate or the cidr rows on a database loaded before 2.2.12
+  async def originated(self, conn, asns):
+    if not asns:
+      return []
+    try:
+      cur = await conn.execute("SELECT prefixes FROM asn WHERE autnum = ANY(%s)", (list(asns),))
+      return [prefix for row in await cur.fetchall() for prefix in row['prefixes']]
+    except UndefinedTable:
+      # the lookup connections are in autocommit mode, nothing to roll back
+      pass
+    cur = await conn.execute("SELECT DISTINCT inetnum FROM cidr WHERE autnum = ANY(%s)", (list(asns),))
+    return [row['inetnum'] for row in await cur.fetchall()]
+
+  def stats(self):
+    return {'queries': self.queries, 'hits': self.hits, 'sets': len(self.memo), 'results': len(self.results)}
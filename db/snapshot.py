@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg
+from psycopg import sql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from db.helper import SHADOW_SCHEMA, create_missing, create_postgres_pool, create_shadow, drop_shadow, finalize_shadow, shadow_tables
+from db.lookup import get_dsn
+
+# zstandard is only needed for zstd snapshots, gzip ones need nothing
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# a damaged file fails in the decompressor before its checksum is known
+DECOMPRESS_ERRORS = (EOFError, OSError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Database snapshots for the read replicas (snapshot.py): the tables of a loaded database, so a new node restores them
+# instead of parsing the dumps again. One `COPY .. TO STDOUT (FORMAT binary)` per table, compressed, into a directory:
+#   {directory}/cidr.copy.zst ..  one file per table (.gz with gzip)
+#   {directory}/manifest.json     whoisd version, compression, and per table: columns, rows, size and sha256 of the file
+# The tables are copied in parallel connections sharing one exported transaction snapshot (pg_export_snapshot()):
+# the files are consistent with each other, as with pg_dump, while the imports and nrtm.py keep writing.
+# The restore loads the files in parallel into the shadow schema, tables only, checking the sha256 of each file while
+# it streams. The indexes are built after the load, in parallel, then finalize_shadow() analyzes and swaps the shadow live:
+# the lookups keep the previous dataset until then. The history table stays out of the snapshots, it keeps its own past.
+MANIFEST = 'manifest.json'
+COMPRESSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+LEVELS = {'zstd': 3, 'gzip': 6}
+JOBS = 4
+CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger('snapshot')
+
+
+class SnapshotError(Exception):
+  pass
+
+
+def default_compression():
+  return 'zstd' if zstandard else 'gzip'
+
+
+# a file hashing the compressed bytes as they are written or read
+class HashedFile(object):
+  def __init__(self, path, mode):
+    self.file = open(path, mode)
+    self.sha256 = hashlib.sha256()
+    self.size = 0
+
+  def write(self, data):
+    self.sha256.update(data)
+    self.size += len(data)
+    return self.file.write(data)
+
+  def read(self, size=-1):
+    data = self.file.read(size)
+    self.sha256.update(data)
+    self.size += len(data)
+    return data
+
+  # the decompressors stop at the end of their frame: the rest of the file counts in the checksum too
+  def drain(self):
+    while self.read(CHUNK_SIZE):
+      pass
+
+  def flush(self):
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
+
+
+def compress_writer(raw, compression, level):
+  if compression == 'zstd':
+    if zstandard is None:
+      raise ImportError("zstd snapshots need zstandard: pip install zstandard")
+    return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=False)
+  return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level)
+
+
+def decompress_reader(raw, compression):
+  if compression == 'zstd':
+    if zstandard is None:
+      raise ImportError("zstd snapshots need zstandard: pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+  if compression == 'gzip':
+    return gzip.GzipFile(fileobj=raw, mode='rb')
+  raise SnapshotError(f"unknown compression {compression}, expected one of {', '.join(COMPRESSIONS)}")
+
+
+def copy_columns(table):
+  return sql.SQL(', ').join(sql.Identifier(column.name) for column in table.columns)
+
+
+def write_table(dsn, snapshot_id, table, path, compression, level):
+  raw = HashedFile(path, 'wb')
+  with psycopg.connect(dsn) as conn:
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    conn.execute(sql.SQL("SET TRANSACTION SNAPSHOT {}").format(sql.Literal(snapshot_id)))
+    cur = conn.cursor()
+    writer = compress_writer(raw, compression, level)
+    with cur.copy(sql.SQL("COPY {} ({}) TO STDOUT (FORMAT binary)").format(sql.Identifier(table.name), copy_columns(table))) as copy:
+      for data in copy:
+        writer.write(data)
+    writer.close()
+    raw.close()
+  logger.info(f"{table.name}: {cur.rowcount} rows, {raw.size >> 20} MB")
+  return {'table': table.name, 'file': os.path.basename(path), 'columns': [column.name for column in table.columns],
+          'rows': cur.rowcount, 'size': raw.size, 'sha256': raw.sha256.hexdigest()}
+
+
+# connection_string -> directory/manifest.json and one file per table; returns the manifest
+def write_snapshot(connection_string, directory, compression=None, level=None, jobs=JOBS, version=None):
+  compression = compression or default_compression()
+  level = LEVELS[compression] if level is None else level
+  dsn = get_dsn(connection_string)
+  os.makedirs(directory, exist_ok=True)
+  # the exported snapshot lives as long as this transaction: it stays open until every table is copied
+  with psycopg.connect(dsn) as conn:
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    snapshot_id = conn.execute("SELECT pg_export_snapshot()").fetchone()[0]
+    tables = [table for table in shadow_tables() if conn.execute("SELECT to_regclass(%s)", [table.name]).fetchone()[0]]
+    server_version = conn.info.server_version
+    with ThreadPoolExecutor(jobs) as executor:
+      futures = [executor.submit(write_table, dsn, snapshot_id, table, os.path.join(directory, table.name + '.copy' + COMPRESSIONS[compression]),
+                                 compression, level) for table in tables]
+      entries = [future.result() for future in futures]
+  manifest = {'whoisd': version, 'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'server_version': server_version,
+              'compression': compression, 'format': 'binary', 'tables': entries}
+  # the manifest comes last: a directory without one is an unfinished snapshot
+  with open(os.path.join(directory, MANIFEST), 'w') as f:
+    json.dump(manifest, f, indent=2)
+  return manifest
+
+
+# the manifest of a snapshot, checked against the tables of this version
+def read_manifest(directory):
+  path = os.path.join(directory, MANIFEST)
+  if not os.path.exists(path):
+    raise SnapshotError(f"{path} not found: no snapshot or an unfinished one")
+  with open(path) as f:
+    manifest = json.load(f)
+  tables = {table.name: table for table in shadow_tables()}
+  for entry in manifest['tables']:
+    table = tables.get(entry['table'])
+    if table is None:
+      raise SnapshotError(f"{entry['table']}: not a table of this version")
+    if entry['columns'] != [column.name for column in table.columns]:
+      raise SnapshotError(f"{entry['table']}: columns {entry['columns']} of the snapshot differ from this version, write a new snapshot")
+    path = os.path.join(directory, entry['file'])
+    if not os.path.exists(path):
+      raise SnapshotError(f"{path} not found")
+    if os.path.getsize(path) != entry['size']:
+      raise SnapshotError(f"{entry['file']}: {os.path.getsize(path)} bytes, {entry['size']} in the manifest")
+  return manifest
+
+
+# sha256 of every file against the manifest, no database needed; returns the files that differ
+def verify_snapshot(directory):
+  manifest = read_manifest(directory)
+  differ = []
+  for entry in manifest['tables']:
+    raw = HashedFile(os.path.join(directory, entry['file']), 'rb')
+    raw.drain()
+    raw.close()
+    if raw.sha256.hexdigest() != entry['sha256']:
+      differ.append(entry['file'])
+  return differ
+
+
+# the checksum is known once the file is read: a mismatch rolls the COPY back
+def load_table(dsn, schema, table, path, entry, compression):
+  raw = HashedFile(path, 'rb')
+  with psycopg.connect(dsn) as conn:
+    cur = conn.cursor()
+    reader = decompress_reader(raw, compression)
+    try:
+      with cur.copy(sql.SQL("COPY {}.{} ({}) FROM STDIN (FORMAT binary)").format(sql.Identifier(schema), sql.Identifier(table.name), copy_columns(table))) as copy:
+        while data := reader.read(CHUNK_SIZE):
+          copy.write(data)
+    except (*DECOMPRESS_ERRORS, psycopg.DataError) as error:
+      raise SnapshotError(f"{entry['file']}: {error}, the file is damaged") from error
+    raw.drain()
+    raw.close()
+    if raw.sha256.hexdigest() != entry['sha256']:
+      raise SnapshotError(f"{entry['file']}: sha256 {raw.sha256.hexdigest()} differs from the manifest")
+    if cur.rowcount != entry['rows']:
+      raise SnapshotError(f"{entry['file']}: {cur.rowcount} rows loaded, {entry['rows']} in the manifest")
+  logger.info(f"{table.name}: {cur.rowcount} rows loaded")
+  return cur.rowcount
+
+
+# one connection per index: postgres builds each one with its own maintenance_work_mem
+def build_index(dsn, schema, index):
+  with psycopg.connect(dsn) as conn:
+    conn.execute(sql.SQL("SET search_path TO {}").format(sql.Identifier(schema)))
+    conn.execute(str(CreateIndex(index).compile(dialect=postgresql.dialect())))
+  logger.debug(f"{index.name} built")
+
+
+# a serial column continues after the restored ids: nrtm.py inserts into member and attr
+def reset_sequences(dsn, schema):
+  with psycopg.connect(dsn) as conn:
+    for table in shadow_tables():
+      column = table.autoincrement_column
+      if column is None:
+        continue
+      qualified = sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(table.name))
+      conn.execute(sql.SQL("SELECT setval(pg_get_serial_sequence(%s, %s), coalesce(max({}), 0) + 1, false) FROM {}").format(
+        sql.Identifier(column.name), qualified), [f'"{schema}"."{table.name}"', column.name])
+
+
+# directory -> the live tables, through the shadow schema; returns the rows loaded
+def restore_snapshot(connection_string, directory, jobs=JOBS, schema=SHADOW_SCHEMA):
+  manifest = read_manifest(directory)
+  tables = {table.name: table for table in shadow_tables()}
+  dsn = get_dsn(connection_string)
+  # a fresh database gets the tables that are not in the snapshot too (history, ..)
+  create_missing(connection_string)
+  create_shadow(create_postgres_pool(connection_string, schema), schema, unique=False)
+  try:
+    # the largest files first, the small ones fill the gaps
+    entries = sorted(manifest['tables'], key=lambda entry: -entry['size'])
+    with ThreadPoolExecutor(jobs) as executor:
+      futures = [executor.submit(load_table, dsn, schema, tables[entry['table']], os.path.join(directory, entry['file']), entry, manifest['compression'])
+                 for entry in entries]
+      rows = sum(future.result() for future in futures)
+    reset_sequences(dsn, schema)
+    indexes = [index for entry in entries for index in tables[entry['table']].indexes]
+    indexes += [index for table in shadow_tables() if table.name not in {entry['table'] for entry in entries} for index in table.indexes]
+    with ThreadPoolExecutor(jobs) as executor:
+      for future in [executor.submit(build_index, dsn, schema, index) for index in indexes]:
+        future.result()
+    logger.info(f"{len(indexes)} indexes built")
+    finalize_shadow(connection_string, schema, indexes=False)
+  except BaseException:
+    drop_shadow(connection_string, schema)
+    raise
+  return rows
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*- ®
+
+# the version of whoisd, shared by the loader and the services without importing one into the other
+VERSION = '2.2.24'
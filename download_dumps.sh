@@ -20,17 +20,23 @@ function download {
 # RIPE NCC (Europe)
 # AFRINIC (Africa)
 
-# download "https://ftp.apnic.net/apnic/whois/apnic.db.inetnum.gz"
-# download "https://ftp.apnic.net/apnic/whois/apnic.db.inet6num.gz"
-# download "https://ftp.apnic.net/apnic/whois/apnic.db.organisation.gz"
-# download "https://ftp.apnic.net/apnic/whois/apnic.db.role.gz"
+# v2.2.20: create_db.py loads every dump of downloads/ it knows: the monolithic ones and the per-class splits
+# (inetnum, inet6num, route, route6, aut-num, as-set, route-set, organisation, role, mntner, irt)
+APNIC_SPLITS="inetnum inet6num route route6 aut-num as-set route-set organisation role mntner irt"
+RIPE_SPLITS="inetnum inet6num route route6 aut-num as-set route-set organisation role mntner irt"
+
+for split in $APNIC_SPLITS; do
+  download "https://ftp.apnic.net/apnic/whois/apnic.db.$split.gz"
+done
 
 download "https://ftp.arin.net/pub/rr/arin.db.gz"
 
-# download "https://ftp.lacnic.net/lacnic/dbase/lacnic.db.gz"
+download "https://ftp.lacnic.net/lacnic/dbase/lacnic.db.gz"
 
+# the splits instead of the monolithic ripe.db.gz: the same objects, each file parsed for its class only
 # download "https://ftp.ripe.net/ripe/dbase/ripe.db.gz"
-# download "https://ftp.ripe.net/ripe/dbase/split/ripe.db.inetnum.gz"
-# download "https://ftp.ripe.net/ripe/dbase/split/ripe.db.inet6num.gz"
+for split in $RIPE_SPLITS; do
+  download "https://ftp.ripe.net/ripe/dbase/split/ripe.db.$split.gz"
+done
 
 download "https://ftp.afrinic.net/dbase/afrinic.db.gz"
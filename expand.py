@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# recursive as-set/route-set expansion to ASNs and prefixes, like bgpq4 against an IRR server, see db/sets.py
+# ./expand.py -c postgresql+psycopg://whoisd:whoisd@db:5432/whoisd AS-HURRICANE          ASNs
+# ./expand.py -c ... -4 AS-HURRICANE                                                      IPv4 prefix list
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db.lookup import get_dsn
+from db.sets import SetExpander
+
+
+async def main(connection_string, names, family, as_json):
+  expander = SetExpander()
+  async with await psycopg.AsyncConnection.connect(get_dsn(connection_string), autocommit=True, row_factory=dict_row) as conn:
+    for name in names:
+      start_time = time.perf_counter()
+      result = await expander.expand(conn, name)
+      elapsed = time.perf_counter() - start_time
+      # a filtered copy: the expander keeps the result it returned for the next names
+      if family == 4:
+        result = dict(result, prefixes=[prefix for prefix in result['prefixes'] if ':' not in prefix])
+      elif family == 6:
+        result = dict(result, prefixes=[prefix for prefix in result['prefixes'] if ':' in prefix])
+      if as_json:
+        print(json.dumps(result))
+      else:
+        print('\n'.join(result['prefixes'] if family else result['asns']))
+      for cycle in result['cycles']:
+        print(f"# {result['name']}: membership cycle between {', '.join(cycle)}", file=sys.stderr)
+      if result['missing']:
+        print(f"# {result['name']}: sets not found {', '.join(result['missing'])}", file=sys.stderr)
+      print(f"# {result['name']}: {len(result['asns'])} ASNs, {len(result['prefixes'])} prefixes, {result['sets']} sets expanded in {elapsed * 1000:.0f} ms", file=sys.stderr)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='recursive as-set/route-set expansion')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
+  parser.add_argument('-4', dest='family', action='store_const', const=4, default=None, help="print the IPv4 prefixes instead of the ASNs")
+  parser.add_argument('-6', dest='family', action='store_const', const=6, help="print the IPv6 prefixes instead of the ASNs")
+  parser.add_argument('--json', action='store_true', default=False, help="print the whole expansion as JSON")
+  parser.add_argument('names', nargs='+', help="as-set or route-set names, expanded with a shared memo")
+  args = parser.parse_args()
+
+  asyncio.run(main(args.connection_string, args.names, args.family, args.json))
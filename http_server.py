@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# HTTP/JSON lookup service with RDAP-shaped responses: curl localhost:8080/ip/8.8.8.8
+import argparse
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+from db.version import VERSION
+from db import rdap
+from db.cache import LRUCache, PrefixCache
+from db.pool import POOL_MIN, POOL_MAX, create_lookup_pool, pool_stats
+from db.lookup import get_import_stamp, classify_query, answer_prefix, lookup_ip, lookup_asn, lookup_asn_prefixes, lookup_handle
+from db.search import LIMIT, CursorError, search
+from db.sets import SetExpander
+
+HOST = '0.0.0.0'
+PORT = 8080
+CACHE_SIZE = 100000
+CACHE_TTL = 3600
+MAX_AGE = 3600
+BATCH_MAX = 1000
+STAMP_INTERVAL = 60
+KEEPALIVE_TIMEOUT = 75
+DEBUG = False
+CONTENT_TYPE = 'application/rdap+json'
+LOG_FORMAT = '[%(name)s:%(lineno)4s - %(funcName)20s ] %(levelname)-8s: %(message)s'
+
+logger = logging.getLogger('http_server')
+logger.setLevel(logging.INFO)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+logger.addHandler(stream_handler)
+
+
+class HttpServer(object):
+  def __init__(self, connection_string, pool_min=POOL_MIN, pool_max=POOL_MAX, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, max_age=MAX_AGE, batch_max=BATCH_MAX):
+    self.pool = create_lookup_pool(connection_string, pool_min, pool_max)
+    self.cache = LRUCache(cache_size, cache_ttl)
+    # ip lookups: one entry per covering prefix instead of one per address
+    self.prefix_cache = PrefixCache(cache_size, cache_ttl)
+    self.expander = SetExpander()
+    self.max_age = max_age
+    self.batch_max = batch_max
+    self.stamp = None
+
+  # the data stamp versions every response: new import or NRTM batch = new ETag and an empty cache
+  async def refresh_stamp(self):
+    async with self.pool.connection() as conn:
+      stamp = await get_import_stamp(conn)
+    if stamp != self.stamp:
+      logger.info(f"data stamp {self.stamp} -> {stamp}: caches cleared, {self.cache.stats()} {self.prefix_cache.stats()}")
+      self.cache.clear()
+      self.prefix_cache.clear()
+      self.stamp = stamp
+
+  async def watch_stamp(self):
+    while True:
+      await asyncio.sleep(STAMP_INTERVAL)
+      try:
+        await self.refresh_stamp()
+      except Exception as e:
+        logger.error(f"refresh_stamp {e.__class__.__name__}: {e}")
+
+  async def startup(self, app):
+    await self.pool.open(wait=True)
+    await self.refresh_stamp()
+    app['watch_stamp'] = asyncio.create_task(self.watch_stamp())
+
+  async def cleanup(self, app):
+    app['watch_stamp'].cancel()
+    await self.pool.close()
+
+  def headers(self):
+    headers = {'Cache-Control': f"public, max-age={self.max_age}"}
+    if self.stamp:
+      headers['ETag'] = f'"{self.stamp}"'
+    return headers
+
+  # (status, body, prefix): prefix is what the PrefixCache entry of an ip lookup is keyed by, None otherwise
+  async def search(self, conn, kind, value):
+    if kind in ('ip', 'prefix'):
+      rows = await lookup_ip(conn, value, less_specific=True)
+      prefix = await answer_prefix(conn, value, rows) if kind == 'ip' else None
+      if not rows:
+        return 404, rdap.error(404, 'Not Found', f"no network covers {value}"), prefix
+      top = rows[0]['masklen']
+      return 200, rdap.ip_network([row for row in rows if row['masklen'] == top], [row for row in rows if row['masklen'] < top]), prefix
+    if kind == 'asn_prefixes':
+      row = await lookup_asn_prefixes(conn, value)
+      if row is None:
+        return 404, rdap.error(404, 'Not Found', f"{value} originates no prefix"), None
+      return 200, {'handle': row.pop('autnum'), **row}, None
+    if kind == 'asn':
+      objects, routes = await lookup_asn(conn, value)
+      if not objects and not routes:
+        return 404, rdap.error(404, 'Not Found', f"{value} not found"), None
+      return 200, rdap.autnum(value, objects, routes), None
+    members, objects, children = await lookup_handle(conn, value)
+    if not members and not objects and not children:
+      return 404, rdap.error(404, 'Not Found', f"{value} not found"), None
+    return 200, rdap.entity(value, members, objects, children), None
+
+  def cache_get(self, kind, value):
+    if kind == 'ip':
+      return self.prefix_cache.get(value)
+    return self.cache.get((kind, value))
+
+  # (status, json text) from the database, stored in the cache
+  async def fetch(self, conn, kind, value):
+    status, body, prefix = await self.search(conn, kind, value)
+    result = (status, json.dumps(body, default=str))
+    if prefix:
+      self.prefix_cache.set(prefix, result)
+    else:
+      self.cache.set((kind, value), result)
+    return result
+
+  async def respond(self, request, kind, value):
+    headers = self.headers()
+    if self.stamp and request.headers.get('If-None-Match') == headers['ETag']:
+      return web.Response(status=304, headers=headers)
+    # cache hits never wait for a pooled connection
+    result = self.cache_get(kind, value)
+    if result is None:
+      async with self.pool.connection() as conn:
+        result = await self.fetch(conn, kind, value)
+    status, text = result
+    return web.Response(status=status, text=text, content_type=CONTENT_TYPE, headers=headers)
+
+  def bad_request(self, description):
+    return web.Response(status=400, text=json.dumps(rdap.error(400, 'Bad Request', description)), content_type=CONTENT_TYPE)
+
+  async def ip(self, request):
+    kind, value = classify_query(request.match_info['addr'])
+    if kind not in ('ip', 'prefix'):
+      return self.bad_request(f"{request.match_info['addr']} is not an IP address or prefix")
+    return await self.respond(request, kind, value)
+
+  async def autnum(self, request):
+    asn = request.match_info['asn'].upper()
+    if not asn.startswith('AS'):
+      asn = f"AS{asn}"
+    kind, value = classify_query(asn)
+    if kind != 'asn':
+      return self.bad_request(f"{request.match_info['asn']} is not an AS number")
+    return await self.respond(request, kind, value)
+
+  # every prefix originated by the ASN with the IPv4/IPv6 counts, from the precomputed asn table
+  async def autnum_prefixes(self, request):
+    asn = request.match_info['asn'].upper()
+    if not asn.startswith('AS'):
+      asn = f"AS{asn}"
+    kind, value = classify_query(asn)
+    if kind != 'asn':
+      return self.bad_request(f"{request.match_info['asn']} is not an AS number")
+    return await self.respond(request, 'asn_prefixes', value)
+
+  async def entity(self, request):
+    return await self.respond(request, 'handle', request.match_info['handle'])
+
+  # POST {"queries": ["8.8.8.8", "AS15169", "MNT-IEVOL"]}: one pooled connection for the whole batch
+  async def batch(self, request):
+    try:
+      queries = (await request.json())['queries']
+    except (ValueError, KeyError, TypeError):
+      return self.bad_request('expected a JSON body like {"queries": ["8.8.8.8", "AS15169"]}')
+    if not isinstance(queries, list) or len(queries) > self.batch_max:
+      return self.bad_request(f"queries must be a list of at most {self.batch_max} strings")
+    results = []
+    async with self.pool.connection() as conn:
+      for query in queries:
+        kind, value = classify_query(str(query))
+        status, text = self.cache_get(kind, value) or await self.fetch(conn, kind, value)
+        results.append(f'{{"query": {json.dumps(query)}, "status": {status}, "result": {text}}}')
+    text = '{"results": [' + ', '.join(results) + ']}'
+    return web.Response(text=text, content_type=CONTENT_TYPE, headers=self.headers())
+
+  # GET /search?q=acme+corp[&limit=20][&cursor=..]: owners and their prefixes, see db/search.py; not cached, the pages move with the cursor
+  async def search_owners(self, request):
+    query = request.query.get('q', '').strip()
+    if not query:
+      return self.bad_request('expected /search?q=<words>')
+    try:
+      limit = int(request.query.get('limit', LIMIT))
+      async with self.pool.connection() as conn:
+        groups, next_cursor = await search(conn, query, limit, request.query.get('cursor'))
+    except (CursorError, ValueError) as e:
+      return self.bad_request(str(e))
+    return web.Response(text=json.dumps({'results': groups, 'next': next_cursor}, default=str), content_type='application/json', headers=self.headers())
+
+  # GET /set/AS-FOO: recursive as-set/route-set expansion, memoized by db/sets.py until the next import
+  async def expand_set(self, request):
+    async with self.pool.connection() as conn:
+      result = await self.expander.expand(conn, request.match_info['name'])
+    return web.Response(text=json.dumps(result), content_type='application/json', headers=self.headers())
+
+  async def stats(self, request):
+    return web.json_response({'sets': self.expander.stats(), 'version': VERSION, 'imported': self.stamp, 'cache': self.cache.stats(), 'prefix_cache': self.prefix_cache.stats(), 'pool': pool_stats(self.pool)})
+
+  def app(self):
+    app = web.Application()
+    app.on_startup.append(self.startup)
+    app.on_cleanup.append(self.cleanup)
+    app.router.add_get('/ip/{addr:.+}', self.ip)
+    app.router.add_get('/autnum/{asn}', self.autnum)
+    app.router.add_get('/autnum/{asn}/prefixes', self.autnum_prefixes)
+    app.router.add_get('/entity/{handle}', self.entity)
+    app.router.add_post('/batch', self.batch)
+    app.router.add_get('/search', self.search_owners)
+    app.router.add_get('/set/{name}', self.expand_set)
+    app.router.add_get('/stats', self.stats)
+    return app
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='HTTP/JSON lookup service')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
+  parser.add_argument("-d", "--debug", action='store_true', default=DEBUG, help="set loglevel to DEBUG")
+  parser.add_argument('--host', type=str, default=HOST, help="listen address")
+  parser.add_argument('--port', type=int, default=PORT, help="listen port")
+  parser.add_argument('--pool_min', type=int, default=POOL_MIN, help="minimum database connections")
+  parser.add_argument('--pool_max', type=int, default=POOL_MAX, help="maximum database connections")
+  parser.add_argument('--cache_size', type=int, default=CACHE_SIZE, help="responses kept in the cache")
+  parser.add_argument('--cache_ttl', type=int, default=CACHE_TTL, help="seconds a cached response stays valid")
+  parser.add_argument('--max_age', type=int, default=MAX_AGE, help="Cache-Control max-age sent to the clients")
+  parser.add_argument('--batch_max', type=int, default=BATCH_MAX, help="maximum queries per POST /batch")
+  parser.add_argument('--version', action='version', version=f"%(prog)s {VERSION}")
+  args = parser.parse_args()
+
+  if args.debug: logger.setLevel(logging.DEBUG)
+  server = HttpServer(args.connection_string, args.pool_min, args.pool_max, args.cache_size, args.cache_ttl, args.max_age, args.batch_max)
+  web.run_app(server.app(), host=args.host, port=args.port, keepalive_timeout=KEEPALIVE_TIMEOUT, access_log=logger if args.debug else None)
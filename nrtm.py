@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# applies the ADD/DEL updates of an NRTM mirror to the tables between two full imports, see db/nrtm.py
+# ./nrtm.py -c postgresql+psycopg://whoisd:whoisd@db:5432/whoisd --source RIPE --host whois.ripe.net --serial 41000000
+# ./nrtm.py -c ... --source RIPE --host nrtm.example.net --follow 60 --ranges    poll every minute from the last serial
+# ./nrtm.py -c ... --source RIPE --file ripe.nrtm.gz                           a saved stream, plain or gzipped
+# ./nrtm.py -c ... --mock --mock_updates 5000                                  a local mock mirror, for tests and demos
+import argparse
+import gzip
+import logging
+import sys
+import time
+
+from db.version import VERSION
+from db.asn import refresh_asns
+from db.helper import create_missing
+from db.nrtm import NRTM_PORT, BATCH_UPDATES, NrtmApplier, NrtmError, MockMirror, mock_journal, query_mirror, read_updates
+from db.ranges import build_ranges, build_tree
+
+MOCK_UPDATES = 1000
+LOG_FORMAT = '[%(name)s:%(lineno)4s - %(funcName)20s ] %(levelname)-8s: %(message)s'
+
+logger = logging.getLogger('nrtm')
+logger.setLevel(logging.INFO)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+logger.addHandler(stream_handler)
+
+
+def open_stream(path):
+  return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+# one pass over the mirror: the updates after the last serial applied, or after `serial` on the first run
+def apply_mirror(applier, host, port, serial=None):
+  current = applier.serial()
+  if current is None:
+    if serial is None:
+      raise NrtmError(f"no serial applied yet for {applier.source}: start with --serial, the serial of the dump loaded")
+    current = serial
+  return applier.apply(read_updates(query_mirror(host, port, applier.source, current + 1)), current)
+
+
+def apply_file(applier, path, serial=None):
+  with open_stream(path) as stream:
+    return applier.apply(read_updates(stream), serial)
+
+
+def rebuild(connection_string, applier, ranges):
+  if ranges and applier.cidr_changed:
+    start_time = time.time()
+    logger.info(f"cidr_range rebuilt: {build_ranges(connection_string)} ranges, prefix tree: {build_tree(connection_string)} edges "
+                f"in {round(time.time() - start_time)} seconds")
+    applier.cidr_changed = False
+  asns, full = refresh_asns(connection_string)
+  logger.info(f"asn {'rebuilt' if full else 'refreshed'}: {asns} ASNs")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='apply the ADD/DEL updates of an NRTM mirror to the tables')
+  parser.add_argument('-c', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
+  parser.add_argument('--source', type=str, default='RIPE', help="registry of the updates (RIPE, APNIC, AFRINIC..)")
+  parser.add_argument('--file', type=str, help="read the updates from a saved stream (.gz or plain) instead of a mirror")
+  parser.add_argument('--host', type=str, help="NRTM mirror to query from the last serial applied")
+  parser.add_argument('--port', type=int, default=NRTM_PORT, help="port of the NRTM mirror")
+  parser.add_argument('--mock', action='store_true', help="start a local mock mirror and consume its journal")
+  parser.add_argument('--mock_updates', type=int, default=MOCK_UPDATES, help="updates in the journal of the mock mirror")
+  parser.add_argument('--serial', type=int, help="last serial already in the tables, for the first run (the serial of the dump)")
+  parser.add_argument('--batch', type=int, default=BATCH_UPDATES, help="updates per transaction")
+  parser.add_argument('--follow', type=int, metavar='SECONDS', help="keep polling the mirror every SECONDS")
+  parser.add_argument('--ranges', action='store_true', help="rebuild cidr_range and the prefix tree when prefixes changed")
+  parser.add_argument('-d', '--debug', action='store_true', help="set loglevel to DEBUG")
+  parser.add_argument('--version', action='version', version=f"%(prog)s {VERSION}")
+  args = parser.parse_args()
+
+  if args.debug: logger.setLevel(logging.DEBUG)
+  if sum(1 for option in (args.file, args.host, args.mock) if option) != 1:
+    parser.error("one of --file, --host or --mock is required")
+  if args.follow and args.file:
+    parser.error("--follow polls a mirror, not a file")
+
+  create_missing(args.connection_string)
+  try:
+    applier = NrtmApplier(args.connection_string, args.source, args.batch)
+  except NrtmError as error:
+    logger.error(error)
+    sys.exit(1)
+  mirror = None
+  if args.mock:
+    # the mock journal starts at serial 1: serial 0 is the empty dump it mirrors
+    mirror = MockMirror(mock_journal(args.source.upper(), args.mock_updates), args.source).start()
+    args.host, args.port = mirror.address
+    args.serial = 0 if args.serial is None else args.serial
+  try:
+    while True:
+      start_time = time.time()
+      try:
+        if args.file:
+          serial = apply_file(applier, args.file, args.serial)
+        else:
+          serial = apply_mirror(applier, args.host, args.port, args.serial)
+      except OSError as error:
+        # a mirror down or a connection cut: the batches committed stay, --follow retries from there
+        if not args.follow:
+          raise NrtmError(f"{args.host or args.file}: {error}")
+        logger.warning(f"{args.host}:{args.port}: {error}, retrying in {args.follow} seconds")
+        time.sleep(args.follow)
+        continue
+      logger.info(f"{args.source.upper()} at serial {serial}: {applier.counts['ADD']} added, {applier.counts['DEL']} deleted, "
+                  f"{applier.counts['ignored']} ignored, {applier.counts['skipped']} skipped in {applier.counts['batches']} "
+                  f"transactions, {round(time.time() - start_time, 1)} seconds")
+      rebuild(args.connection_string, applier, args.ranges)
+      if not args.follow:
+        break
+      time.sleep(args.follow)
+  except NrtmError as error:
+    logger.error(error)
+    sys.exit(1)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if mirror:
+      mirror.stop()
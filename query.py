@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ip -> most specific prefix, netname, country, origin, source: the shell lookup tool, see bin/query
+# ./query.py -c postgresql://whoisd:whoisd@db:5432/whoisd 8.8.8.8 2001:4860:4860::8888
+# ./query.py -c ... --write_snapshot cidr.npz         flatten the database into a local snapshot file
+# ./query.py --snapshot cidr.npz 8.8.8.8               no database at all
+# awk '{print $1}' access.log | ./query.py --snapshot cidr.npz --json
+# tail -f access.log | awk '{print $1}' | ./query.py --snapshot cidr.npz --serve_stdin
+# ./query.py -c ... --at 2024-03-01 203.0.113.7          who held it then: the history table of create_db.py --history
+#
+# Startup time is the point of this script: only the standard library is imported here, psycopg or numpy when the
+# lookup mode needs them, never SQLAlchemy or netaddr. The stdin lines are answered by batch, as they arrive:
+# one query per batch on a long-lived connection, or one vectorized search of the snapshot.
+import argparse
+import json
+import os
+import sys
+import time
+
+COLUMNS = ('prefix', 'netname', 'country', 'autnum', 'source')
+# the first cidr row of the most specific prefix, the same row as the snapshot details
+LOOKUP_SQL = """
+SELECT r.inetnum AS prefix, c.netname, c.country, c.autnum, c.source
+FROM unnest(%s::smallint[], %s::numeric[]) WITH ORDINALITY AS q(family, ip, n)
+LEFT JOIN LATERAL (SELECT inetnum, end_ip FROM cidr_range WHERE family = q.family AND start_ip <= q.ip ORDER BY start_ip DESC LIMIT 1) r ON r.end_ip >= q.ip
+LEFT JOIN LATERAL (SELECT netname, country, autnum, source FROM cidr WHERE inetnum = r.inetnum ORDER BY source, autnum LIMIT 1) c ON true
+ORDER BY q.n
+"""
+# v2.2.22: the version valid at a point in time, most specific first: GiST index on (inetnum::inet, valid)
+LOOKUP_AT_SQL = """
+SELECT h.inetnum AS prefix, h.netname, h.country, h.autnum, h.source
+FROM unnest(%s::inet[]) WITH ORDINALITY AS q(ip, n)
+LEFT JOIN LATERAL (SELECT inetnum, netname, country, autnum, source FROM history
+                   WHERE inetnum::inet >>= q.ip AND valid @> %s::timestamptz
+                   ORDER BY masklen(inetnum::inet) DESC, source, autnum LIMIT 1) h ON true
+ORDER BY q.n
+"""
+DETAILS_SQL = "SELECT DISTINCT ON (inetnum) inetnum, netname, country, autnum, source FROM cidr ORDER BY inetnum, source, autnum"
+READ_SIZE = 1 << 16
+
+
+# str -> ipaddress object, None when the line is not an address
+def parse_ip(line):
+  import ipaddress
+  try:
+    return ipaddress.ip_address(line)
+  except ValueError:
+    return None
+
+
+class DatabaseLookup(object):
+  # at: a timestamp postgres understands ('2024-03-01', '2024-03-01 12:00+02'..), answered from the history table
+  def __init__(self, connection_string, at=None):
+    import psycopg
+    from db.lookup import get_dsn
+    self.psycopg = psycopg
+    self.dsn = get_dsn(connection_string)
+    self.at = at
+    self.conn = None
+
+  # addresses: [ipaddress objects] -> [{column: value}], the connection is reopened once if it was lost
+  def lookup(self, addresses):
+    for attempt in (1, 2):
+      try:
+        if self.conn is None or self.conn.closed:
+          self.conn = self.psycopg.connect(self.dsn, autocommit=True)
+        if self.at:
+          rows = self.conn.execute(LOOKUP_AT_SQL, ([str(address) for address in addresses], self.at)).fetchall()
+        else:
+          rows = self.conn.execute(LOOKUP_SQL, ([address.version for address in addresses], [int(address) for address in addresses])).fetchall()
+        # '' (an inetnum has no origin) reads as missing, like in the snapshots
+        return [dict(zip(COLUMNS, (value or None for value in row))) for row in rows]
+      except self.psycopg.errors.UndefinedTable:
+        if self.at:
+          raise SystemExit("query.py: no history table, --at needs imports made with create_db.py --history")
+        raise SystemExit("query.py: no cidr_range table, the database was loaded before 2.2.9: reload it or use --snapshot")
+      except self.psycopg.errors.DataError as e:
+        raise SystemExit(f"query.py: --at {self.at}: {e}")
+      except self.psycopg.OperationalError:
+        self.conn = None
+        if attempt == 2:
+          raise
+
+
+class SnapshotLookup(object):
+  def __init__(self, path, reload=False):
+    self.path = path
+    self.reload = reload
+    self.load()
+
+  def load(self):
+    from db.intervals import IntervalIndex
+    from db.records import RecordStore
+    self.mtime = os.stat(self.path).st_mtime
+    self.index = IntervalIndex.load(self.path)
+    prefixes = self.index.prefixes
+    # v2.2.18: one compact record per prefix (db/records.py) instead of a dict, a lookup is an index search plus a column read
+    details = [self.index.details.get(column) or [''] * len(prefixes) for column in COLUMNS[1:]]
+    self.records = RecordStore.from_rows(
+      {'inetnum': prefix, 'netname': netname or None, 'country': country or None, 'autnum': autnum or None, 'source': source or None}
+      for prefix, netname, country, autnum, source in zip(prefixes, *details))
+
+  # addresses: [ipaddress objects] -> [{column: value}]
+  def lookup(self, addresses):
+    # --serve_stdin picks up a snapshot rewritten by --write_snapshot
+    if self.reload and os.stat(self.path).st_mtime != self.mtime:
+      self.load()
+    return [self.row(owner) for owner in self.index.owners(addresses)]
+
+  def row(self, owner):
+    if owner < 0:
+      return dict.fromkeys(COLUMNS)
+    record = self.records[owner]
+    return {'prefix': record.inetnum, 'netname': record.netname, 'country': record.country, 'autnum': record.autnum, 'source': record.source}
+
+
+def write_snapshot(connection_string, path):
+  import psycopg
+  from db.intervals import IntervalIndex
+  from db.lookup import get_dsn
+  dsn = get_dsn(connection_string)
+  index = IntervalIndex.from_database(dsn)
+  with psycopg.connect(dsn) as conn:
+    details = {row[0]: row[1:] for row in conn.execute(DETAILS_SQL)}
+    stamp = conn.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone()
+  empty = ('',) * (len(COLUMNS) - 1)
+  columns = zip(*(tuple('' if value is None else value for value in details.get(prefix, empty)) for prefix in index.prefixes))
+  index.save(path, dict(zip(COLUMNS[1:], columns)), stamp[0] if stamp else '')
+  return index
+
+
+def format_row(ip, row, as_json):
+  if as_json:
+    return json.dumps(dict(ip=ip, **row) if row else {'ip': ip, 'error': 'not an ip address'})
+  if row is None:
+    return f"{ip}\t!not an ip address"
+  return '\t'.join([ip] + [row[column] or '-' for column in COLUMNS])
+
+
+# the lines -> one lookup for the valid addresses -> one output line per input line, in order
+def answer(lookup, lines, as_json):
+  addresses = [parse_ip(line) for line in lines]
+  valid = [address for address in addresses if address is not None]
+  rows = iter(lookup.lookup(valid) if valid else [])
+  return [format_row(line, next(rows) if address is not None else None, as_json) for line, address in zip(lines, addresses)]
+
+
+# stdin read by chunks of whatever is available: a pipe feeding lines one by one is answered line by line,
+# a file or a fast producer in batches of thousands of lines
+def stream(lookup, as_json, flush):
+  fd = sys.stdin.fileno()
+  rest = b''
+  while True:
+    chunk = os.read(fd, READ_SIZE)
+    if chunk:
+      lines = (rest + chunk).split(b'\n')
+      rest = lines.pop()
+    else:
+      lines = [rest] if rest else []
+    lines = [line.decode('utf-8', 'replace').strip() for line in lines]
+    lines = [line for line in lines if line and not line.startswith('#')]
+    if lines:
+      sys.stdout.write('\n'.join(answer(lookup, lines, as_json)) + '\n')
+      if flush:
+        sys.stdout.flush()
+    if not chunk:
+      break
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='ip lookups from the shell: most specific prefix, netname, country, origin, source')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, default=None, help="Connection string to the postgres database")
+  parser.add_argument('--snapshot', type=str, default=None, help="answer from this snapshot file instead of the database")
+  parser.add_argument('--write_snapshot', '--write-snapshot', dest='write_snapshot', type=str, default=None, help="flatten the database (-c) into this snapshot file and exit")
+  parser.add_argument('--serve_stdin', '--serve-stdin', dest='serve_stdin', action='store_true', default=False, help="keep answering the ips of stdin line by line as they come, flushing each batch")
+  parser.add_argument('--at', type=str, default=None, help="answer as of this date/time from the history table (create_db.py --history), needs -c")
+  parser.add_argument('--json', action='store_true', default=False, help="one JSON object per line instead of tab separated columns")
+  parser.add_argument('ips', nargs='*', help="ip addresses, read from stdin when none is given")
+  args = parser.parse_args()
+
+  if args.write_snapshot:
+    if not args.connection_string:
+      parser.error("--write_snapshot needs -c")
+    start_time = time.perf_counter()
+    index = write_snapshot(args.connection_string, args.write_snapshot)
+    print(f"# {len(index.prefixes)} prefixes, {len(index)} ranges written to {args.write_snapshot} in {time.perf_counter() - start_time:.1f} seconds", file=sys.stderr)
+    sys.exit(0)
+  if args.at and not args.connection_string:
+    parser.error("--at needs -c, the snapshots have no history")
+  if args.snapshot and not args.at:
+    lookup = SnapshotLookup(args.snapshot, reload=args.serve_stdin)
+  elif args.connection_string:
+    lookup = DatabaseLookup(args.connection_string, args.at)
+  else:
+    parser.error("-c or --snapshot is needed")
+
+  try:
+    if args.ips:
+      print('\n'.join(answer(lookup, args.ips, args.json)), flush=True)
+    if args.serve_stdin or not args.ips:
+      stream(lookup, args.json, args.serve_stdin)
+  except (BrokenPipeError, KeyboardInterrupt):
+    # head, grep -m.. closed the pipe: quiet exit
+    sys.stderr.close()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# full-text search of the netranges by organisation, maintainer, netname or description, see db/search.py
+# ./search.py -c postgresql+psycopg://whoisd:whoisd@db:5432/whoisd "acme corp"
+# ./search.py -c ... "acme corp" --cursor <next cursor printed by the previous page>
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db.lookup import get_dsn
+from db.search import LIMIT, CursorError, search
+
+
+def print_groups(groups):
+  for group in groups:
+    name = f" ({group['owner_name']})" if group['owner_name'] else ''
+    print(f"{group['owner']}{name}  rank {group['rank']:.4f}  netnames: {', '.join(group['netnames'])}")
+    more = group['prefix_count'] - len(group['prefixes'])
+    print(f"  {' '.join(group['prefixes'])}" + (f" .. and {more} more" if more > 0 else ''))
+
+
+async def main(connection_string, query, limit, cursor, as_json):
+  async with await psycopg.AsyncConnection.connect(get_dsn(connection_string), row_factory=dict_row) as conn:
+    start_time = time.perf_counter()
+    groups, next_cursor = await search(conn, query, limit, cursor)
+    elapsed = time.perf_counter() - start_time
+  if as_json:
+    print(json.dumps({'results': groups, 'next': next_cursor}, default=str))
+    return
+  print_groups(groups)
+  print(f"# {len(groups)} owners in {elapsed * 1000:.0f} ms" + (f", next page: --cursor {next_cursor}" if next_cursor else ''), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='full-text search of the netranges by organisation')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
+  parser.add_argument('-n', '--limit', type=int, default=LIMIT, help="owners per page")
+  parser.add_argument('--cursor', type=str, default=None, help="next page cursor printed by the previous page")
+  parser.add_argument('--json', action='store_true', default=False, help="print the page as JSON")
+  parser.add_argument('query', type=str, help='websearch syntax: acme corp, "acme networks", acme -telecom, acme or example')
+  args = parser.parse_args()
+
+  try:
+    asyncio.run(main(args.connection_string, args.query, args.limit, args.cursor, args.json))
+  except CursorError as e:
+    parser.error(str(e))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# database snapshots for the read replicas: the loaded and indexed tables without parsing the dumps again, see db/snapshot.py
+# ./snapshot.py -c postgresql+psycopg://whoisd:whoisd@db:5432/whoisd --write downloads/snapshot
+# ./snapshot.py -c ... --restore downloads/snapshot --jobs 8     a fresh node: load, index, swap live
+# ./snapshot.py --verify downloads/snapshot                      sha256 of the files against the manifest, no database
+import argparse
+import logging
+import sys
+import time
+
+from db.version import VERSION
+from db.snapshot import COMPRESSIONS, JOBS, SnapshotError, default_compression, restore_snapshot, verify_snapshot, write_snapshot, zstandard
+
+LOG_FORMAT = '[%(name)s:%(lineno)4s - %(funcName)20s ] %(levelname)-8s: %(message)s'
+
+logger = logging.getLogger('snapshot')
+logger.setLevel(logging.INFO)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+logger.addHandler(stream_handler)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='write or restore a database snapshot')
+  parser.add_argument('-c', dest='connection_string', type=str, help="Connection string to the postgres database")
+  action = parser.add_mutually_exclusive_group(required=True)
+  action.add_argument('--write', type=str, metavar='DIR', help="write the tables to a snapshot directory")
+  action.add_argument('--restore', type=str, metavar='DIR', help="load a snapshot directory into the database and swap it live")
+  action.add_argument('--verify', type=str, metavar='DIR', help="check the files of a snapshot directory against its manifest")
+  parser.add_argument('--compression', choices=list(COMPRESSIONS), default=default_compression(), help="zstd (needs zstandard) or gzip")
+  parser.add_argument('--level', type=int, help="compression level (zstd 3, gzip 6 by default)")
+  parser.add_argument('--jobs', type=int, default=JOBS, help="tables copied and indexes built in parallel")
+  parser.add_argument('-d', '--debug', action='store_true', help="set loglevel to DEBUG")
+  parser.add_argument('--version', action='version', version=f"%(prog)s {VERSION}")
+  args = parser.parse_args()
+
+  if args.debug: logger.setLevel(logging.DEBUG)
+  if not args.verify and not args.connection_string:
+    parser.error("--write and --restore need -c")
+  if args.compression == 'zstd' and not zstandard:
+    parser.error("--compression zstd needs zstandard: pip install zstandard")
+
+  start_time = time.time()
+  try:
+    if args.write:
+      manifest = write_snapshot(args.connection_string, args.write, args.compression, args.level, args.jobs, VERSION)
+      size = sum(entry['size'] for entry in manifest['tables'])
+      logger.info(f"{len(manifest['tables'])} tables, {sum(entry['rows'] for entry in manifest['tables'])} rows, {size >> 20} MB "
+                  f"written to {args.write} in {round(time.time() - start_time, 1)} seconds")
+    elif args.restore:
+      rows = restore_snapshot(args.connection_string, args.restore, args.jobs)
+      logger.info(f"{rows} rows restored from {args.restore} and swapped live in {round(time.time() - start_time, 1)} seconds")
+    else:
+      differ = verify_snapshot(args.verify)
+      for name in differ:
+        logger.error(f"{name}: sha256 differs from the manifest")
+      if differ:
+        sys.exit(1)
+      logger.info(f"{args.verify}: all files match the manifest")
+  except SnapshotError as error:
+    logger.error(error)
+    sys.exit(1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# RFC 3912 whois server answering from the whoisd database: whois -h localhost 8.8.8.8
+import argparse
+import asyncio
+import logging
+import time
+
+from db.version import VERSION
+from db.cache import LRUCache, PrefixCache
+from db.pool import POOL_MIN, POOL_MAX, create_lookup_pool, pool_stats
+from db.lookup import get_import_stamp, classify_query, answer_prefix, lookup_ip, lookup_upstream, lookup_more_specific, lookup_asn, lookup_asn_prefixes, format_asn_prefixes, lookup_handle, format_cidr, format_object, format_reference
+
+HOST = '0.0.0.0'
+PORT = 43
+CACHE_SIZE = 100000
+CACHE_TTL = 3600
+READ_TIMEOUT = 10
+STAMP_INTERVAL = 60
+MAX_QUERY = 1024
+DEBUG = False
+LOG_FORMAT = '[%(name)s:%(lineno)4s - %(funcName)20s ] %(levelname)-8s: %(message)s'
+
+HEADER = f"% This is whoisd {VERSION}, a local replica of the ARIN/APNIC/LACNIC/AfriNIC/RIPE databases\n\n"
+NOT_FOUND = "%ERROR:101: no entries found\n"
+HELP = """% Usage: whois -h <host> [-L|-l|-m|-M] <query>
+%   <query>   IPv4/IPv6 address or prefix, AS number, maintainer/person/role/organisation/set handle
+%   -L        return all the less specific prefixes, not only the most specific one
+%   -l        return the one level less specific prefix (the upstream allocation)
+%   -m        return the one level more specific prefixes (direct sub-allocations)
+%   -M        return all the more specific prefixes
+"""
+# supported flags, the last one given wins
+FLAGS = ('-L', '-l', '-m', '-M')
+
+logger = logging.getLogger('whois_server')
+logger.setLevel(logging.INFO)
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+logger.addHandler(stream_handler)
+
+
+class WhoisServer(object):
+  def __init__(self, connection_string, pool_min=POOL_MIN, pool_max=POOL_MAX, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL):
+    self.pool = create_lookup_pool(connection_string, pool_min, pool_max)
+    self.cache = LRUCache(cache_size, cache_ttl)
+    # plain ip lookups: one entry per covering prefix instead of one per address
+    self.prefix_cache = PrefixCache(cache_size, cache_ttl)
+    self.stamp = None
+    self.queries = 0
+    self.errors = 0
+
+  # "-L 8.8.8.8" -> ('-L', '8.8.8.8'), flag None without one
+  def parse_flags(self, query):
+    tokens = query.split()
+    flags = [t for t in tokens if t in FLAGS]
+    tokens = [t for t in tokens if not t.startswith('-')]
+    return flags[-1] if flags else None, ' '.join(tokens)
+
+  async def answer(self, query):
+    flag, search = self.parse_flags(query)
+    if not search or search.lower() == 'help':
+      return HELP
+    kind, value = classify_query(search)
+    if kind == 'ip' and flag is None:
+      response = self.prefix_cache.get(value)
+      if response is None:
+        async with self.pool.connection() as conn:
+          rows = await lookup_ip(conn, value)
+          response = '\n'.join(format_cidr(row) for row in rows) or NOT_FOUND
+          self.prefix_cache.set(await answer_prefix(conn, value, rows), response)
+      return response
+    key = (kind, value, flag)
+    response = self.cache.get(key)
+    if response is None:
+      async with self.pool.connection() as conn:
+        response = await self.search(conn, kind, value, flag)
+      self.cache.set(key, response)
+    return response
+
+  async def search(self, conn, kind, value, flag=None):
+    if kind in ('ip', 'prefix'):
+      if flag == '-l':
+        rows = await lookup_upstream(conn, value)
+      elif flag in ('-m', '-M'):
+        rows = await lookup_more_specific(conn, value, all_levels=flag == '-M')
+      else:
+        rows = await lookup_ip(conn, value, less_specific=flag == '-L')
+      objects = [format_cidr(row) for row in rows]
+    elif kind == 'asn':
+      autnums, routes = await lookup_asn(conn, value)
+      objects = [format_object(row) for row in autnums] + [format_cidr(row) for row in routes]
+      summary = await lookup_asn_prefixes(conn, value)
+      if summary and objects:
+        objects[0] = format_asn_prefixes(summary) + '\n' + objects[0]
+    else:
+      members, sets, children = await lookup_handle(conn, value)
+      objects = [format_object(row) for row in members + sets] + [format_reference(row) for row in children]
+    if not objects:
+      return NOT_FOUND
+    return '\n'.join(objects)
+
+  async def handle_client(self, reader, writer):
+    start_time = time.time()
+    peer = writer.get_extra_info('peername')
+    query = ''
+    try:
+      line = await asyncio.wait_for(reader.readline(), timeout=READ_TIMEOUT)
+      query = line[:MAX_QUERY].decode('utf-8', 'replace').strip()
+      response = await self.answer(query)
+    except (asyncio.TimeoutError, ConnectionError):
+      writer.close()
+      return
+    except Exception as e:
+      self.errors += 1
+      logger.error(f"{peer} {query!r}: {e.__class__.__name__}: {e}")
+      response = "%ERROR:100: internal software error\n"
+    self.queries += 1
+    try:
+      writer.write((HEADER + response + "\n").encode('utf-8'))
+      await writer.drain()
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+    logger.debug(f"{peer} {query!r} answered in {round((time.time() - start_time) * 1000, 2)} ms")
+
+  # a new import or NRTM batch invalidates every cached answer
+  async def refresh_stamp(self):
+    async with self.pool.connection() as conn:
+      stamp = await get_import_stamp(conn)
+    if stamp != self.stamp:
+      logger.info(f"data stamp {self.stamp} -> {stamp}: caches cleared")
+      self.cache.clear()
+      self.prefix_cache.clear()
+      self.stamp = stamp
+
+  async def watch_stamp(self):
+    while True:
+      await asyncio.sleep(STAMP_INTERVAL)
+      try:
+        await self.refresh_stamp()
+      except Exception as e:
+        logger.error(f"refresh_stamp {e.__class__.__name__}: {e}")
+
+  async def report(self, interval=60):
+    while True:
+      await asyncio.sleep(interval)
+      logger.info(f"queries={self.queries} errors={self.errors} cache={self.cache.stats()} prefix_cache={self.prefix_cache.stats()} pool={pool_stats(self.pool)}")
+
+  async def serve(self, host=HOST, port=PORT):
+    await self.pool.open(wait=True)
+    await self.refresh_stamp()
+    server = await asyncio.start_server(self.handle_client, host, port, backlog=4096)
+    logger.info(f"whoisd {VERSION} listening on {host}:{port}")
+    tasks = [asyncio.create_task(self.report()), asyncio.create_task(self.watch_stamp())]
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      for task in tasks:
+        task.cancel()
+      await self.pool.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='whois server (RFC 3912)')
+  parser.add_argument('-c', '--connection_string', dest='connection_string', type=str, required=True, help="Connection string to the postgres database")
+  parser.add_argument("-d", "--debug", action='store_true', default=DEBUG, help="set loglevel to DEBUG")
+  parser.add_argument('--host', type=str, default=HOST, help="listen address")
+  parser.add_argument('--port', type=int, default=PORT, help="listen port")
+  parser.add_argument('--pool_min', type=int, default=POOL_MIN, help="minimum database connections")
+  parser.add_argument('--pool_max', type=int, default=POOL_MAX, help="maximum database connections")
+  parser.add_argument('--cache_size', type=int, default=CACHE_SIZE, help="responses kept in the cache")
+  parser.add_argument('--cache_ttl', type=int, default=CACHE_TTL, help="seconds a cached response stays valid")
+  parser.add_argument('--version', action='version', version=f"%(prog)s {VERSION}")
+  args = parser.parse_args()
+
+  if args.debug: logger.setLevel(logging.DEBUG)
+  server = WhoisServer(args.connection_string, args.pool_min, args.pool_max, args.cache_size, args.cache_ttl)
+  try:
+    asyncio.run(server.serve(args.host, args.port))
+  except KeyboardInterrupt:
+    pass